@@ -87,6 +87,8 @@ def create_stacks(app: cdk.App, env: Environment) -> Dict[str, cdk.Stack]:
         app,
         "batch-ffmpeg-sfn-stack",
         s3_bucket=stacks["storage"].s3_bucket,
+        sizing_function=stacks["batch"].sizing_function,
+        result_table=stacks["batch"].result_table,
         env=env,
         description="AWS Batch with FFmpeg: AWS Step Functions",
     )
@@ -96,6 +98,7 @@ def create_stacks(app: cdk.App, env: Environment) -> Dict[str, cdk.Stack]:
         "batch-ffmpeg-api-stack",
         batch_jobs=stacks["batch"].batch_jobs,
         sfn_state_machine=stacks["sfn"].state_machine,
+        sizing_function=stacks["batch"].sizing_function,
         env=env,
         description="AWS Batch with FFmpeg: API Gateway",
     )
@@ -8,9 +8,19 @@ PROCESSOR_CONFIGS = {
         "excluded_regions": ["eu-west-3"],
         "container_tag": "6.0-nvidia2004-amd64",
         "ami_ssm_parameter": "/aws/service/ecs/optimized-ami/amazon-linux-2/gpu/recommended/image_id",
+        # GPUs of the job definition, overridden by the CDK context
+        # batch-ffmpeg:nvidia:gpus, or per job with containerOverrides
         "gpu": 1,
         "container_type": "EC2",
         "spot": True,
+        # Concurrent NVENC encodes per GPU for multi-command jobs, and opt-in
+        # rewrite of x264/x265 commands to a full GPU pipeline (scale_cuda or
+        # scale_npp scaler)
+        "environment": {
+            "NVENC_SESSIONS_PER_GPU": "4",
+            "FFMPEG_GPU_PIPELINE": "FALSE",
+            "FFMPEG_GPU_SCALER": "scale_cuda",
+        },
     },
     "intel": {
         "instance_classes": [
@@ -135,9 +145,106 @@ PROCESSOR_CONFIGS = {
 JOB_DEF_CPU = 2
 JOB_DEF_MEMORY = 8192  # in MiB
 
+# Job sizing rules (vCPU and memory in MiB per input resolution class, vCPU
+# factor per output video codec family). Enabled with the SSM parameter
+# /batch-ffmpeg/sizing and refined with the resource usage of previous jobs.
+JOB_SIZING_RULES = {
+    "resolution": {
+        "audio": {"vcpus": 1, "memory": 2048},
+        "sd": {"vcpus": 1, "memory": 4096},
+        "hd": {"vcpus": 2, "memory": 4096},
+        "fhd": {"vcpus": 2, "memory": 8192},
+        "uhd": {"vcpus": 8, "memory": 16384},
+        "unknown": {"vcpus": JOB_DEF_CPU, "memory": JOB_DEF_MEMORY},
+    },
+    "codec_vcpus_factor": {"avc": 1, "hevc": 2, "av1": 2, "vp9": 2, "copy": 0},
+    "min_vcpus": 1,
+    "max_vcpus": 16,
+    "min_memory": 2048,
+    "max_memory": 61440,
+    "memory_headroom": 1.25,
+    # Resolution class of a video not probed (no ffprobe), from its minimum
+    # object size in bytes
+    "size_classes": {
+        "sd": 0,
+        "hd": 256 * 1024**2,
+        "fhd": 1024**3,
+        "uhd": 8 * 1024**3,
+    },
+}
+
+# Admission control of the job submissions of the state machine: items are
+# admitted while the RUNNABLE jobs of their queue stay below max_runnable,
+# at submit_rate submissions per second (burst) for the account
+ADMISSION = {
+    "submit_rate": 20,
+    "burst": 50,
+    "max_runnable": 100,
+    "depth_ttl_seconds": 10,
+    "max_wait_seconds": 60,
+}
+
+# ffmpeg version of each compute family, from the tag of its container image:
+# part of the fingerprint of the results indexed by the jobs
+FFMPEG_VERSIONS = {
+    name: config["container_tag"].split("-", 1)[0]
+    for name, config in PROCESSOR_CONFIGS.items()
+}
+# Settings of the job definition environment of each compute family rewriting
+# the ffmpeg arguments: part of the fingerprint of the results too
+FFMPEG_REWRITES = {
+    name: {
+        key: value
+        for key, value in config.get("environment", {}).items()
+        if key.startswith("FFMPEG_")
+    }
+    for name, config in PROCESSOR_CONFIGS.items()
+}
+
+# Container resource sampler interval in seconds (0 disables the sampler)
+RESOURCE_SAMPLER_INTERVAL = 5
+
 # FSx Lustre configurations
 LUSTRE_MOUNT_POINT = "/fsx-lustre"
 
+# Layouts (lfs setstripe options) of the Lustre outputs: progressive file
+# layout for the outputs expected above large_file_bytes, one stripe per file
+# for the directories of segments
+LUSTRE_STRIPING = {
+    "large_file_bytes": 1024**3,
+    "layouts": {
+        "large": "-E 64M -c 1 -S 1M -E 1G -c 4 -S 4M -E -1 -c -1 -S 4M",
+        "segments": "-c 1 -S 1M",
+    },
+}
+
+# Batched export of the Lustre job outputs to S3: the jobs queue their
+# outputs and a scheduled Lambda function groups them in data repository
+# tasks (100 paths at most per task)
+LUSTRE_EXPORT = {
+    "schedule_minutes": 5,
+    "max_paths_per_task": 100,
+    "max_active_tasks": 2,
+    "max_wait_seconds": 600,
+}
+
+# Release of the least recently used files of the Lustre file system, already
+# exported to S3, when its usage exceeds the high-water mark
+LUSTRE_RELEASE = {
+    "schedule_minutes": 30,
+    "high_water_mark": 0.8,
+    "low_water_mark": 0.6,
+    "min_idle_minutes": 60,
+}
+
+# NVMe instance store (RAID0 if several devices) mounted by the launch
+# template and used by the wrapper as working directory when present
+INSTANCE_STORE_MOUNT_POINT = "/mnt/instance-store"
+
+# Host input cache shared by the jobs of an EC2 instance, enabled with the
+# context batch-ffmpeg:input-cache:enable in cdk.json
+INPUT_CACHE_PATH = "/var/cache/batch-ffmpeg"
+
 # FFMPEG script configurations
 FFMPEG_SCRIPT_COMMAND = [
     "--global_options",
@@ -152,6 +259,10 @@ FFMPEG_SCRIPT_COMMAND = [
     "Ref::output_url",
     "--name",
     "Ref::name",
+    "--commands_url",
+    "Ref::commands_url",
+    "--manifest_url",
+    "Ref::manifest_url",
 ]
 
 FFMPEG_SCRIPT_DEFAULT_VALUES = {
@@ -161,4 +272,6 @@ FFMPEG_SCRIPT_DEFAULT_VALUES = {
     "output_file_options": "null",
     "output_url": "null",
     "name": "null",
+    "commands_url": "null",
+    "manifest_url": "null",
 }
@@ -5,21 +5,29 @@ from aws_cdk import (
     aws_ecs as ecs,
     aws_iam as iam,
     aws_batch as batch,
+    aws_dynamodb as dynamodb,
     aws_s3 as s3,
     aws_ecr as ecr,
     aws_fsx as fsx,
+    aws_sqs as sqs,
     Duration,
     Size,
     Environment,
 )
+import json
 import logging
 import os
 from constructs import Construct
 from infrastructure.config.batch_config import (
     PROCESSOR_CONFIGS,
+    FFMPEG_VERSIONS,
     JOB_DEF_CPU,
     JOB_DEF_MEMORY,
     LUSTRE_MOUNT_POINT,
+    LUSTRE_STRIPING,
+    INPUT_CACHE_PATH,
+    INSTANCE_STORE_MOUNT_POINT,
+    RESOURCE_SAMPLER_INTERVAL,
     FFMPEG_SCRIPT_COMMAND,
     FFMPEG_SCRIPT_DEFAULT_VALUES,
 )
@@ -61,6 +69,9 @@ class BatchJobConstruct(Construct):
         execution_role: iam.IRole,
         job_role: iam.IRole,
         lustre_fs: fsx.LustreFileSystem = None,
+        lustre_export_queue: sqs.IQueue = None,
+        work_queue: sqs.IQueue = None,
+        result_table: dynamodb.ITable = None,
         env: Environment,
         **kwargs,
     ) -> None:
@@ -74,32 +85,95 @@ class BatchJobConstruct(Construct):
 
         # Create all necessary components for the Batch job
         self.create_container_definition(
-            s3_bucket, ecr_repository, execution_role, job_role, lustre_fs
+            s3_bucket,
+            ecr_repository,
+            execution_role,
+            job_role,
+            lustre_fs,
+            lustre_export_queue,
+            work_queue,
+            result_table,
         )
         self.create_job_definition()
         self.create_compute_environment(vpc, security_group, instance_role, lustre_fs)
         self.create_job_queue()
 
     def create_container_definition(
-        self, s3_bucket, ecr_repository, execution_role, job_role, lustre_fs
+        self,
+        s3_bucket,
+        ecr_repository,
+        execution_role,
+        job_role,
+        lustre_fs,
+        lustre_export_queue=None,
+        work_queue=None,
+        result_table=None,
     ):
         # Set up basic environment variables
         job_definition_container_env = {
             "AWS_XRAY_SDK_ENABLED": "true",
             "S3_BUCKET": s3_bucket.bucket_name,
+            "RESOURCE_SAMPLER_INTERVAL": str(RESOURCE_SAMPLER_INTERVAL),
         }
+        # Queue of the persistent workers, started with `--queue_url`
+        if work_queue:
+            job_definition_container_env["WORK_QUEUE_URL"] = work_queue.queue_url
+        # Index of the results of the jobs, to skip unchanged work
+        job_definition_container_env["FFMPEG_VERSION"] = FFMPEG_VERSIONS[
+            self.processor_name
+        ]
+        if result_table:
+            job_definition_container_env["RESULT_CACHE"] = result_table.table_name
 
         # Set up Lustre volumes if a Lustre file system is provided
-        lustre_volumes = None
+        volumes = []
         if lustre_fs and self.processor_config["container_type"] == "EC2":
             job_definition_container_env["FSX_MOUNT_POINT"] = LUSTRE_MOUNT_POINT
-            lustre_volumes = [
+            job_definition_container_env["LUSTRE_STRIPING"] = json.dumps(
+                LUSTRE_STRIPING
+            )
+            volumes.append(
                 batch.HostVolume(
                     host_path=LUSTRE_MOUNT_POINT,
                     name="fsx-lustre-vol-name",
                     container_path=LUSTRE_MOUNT_POINT,
                 )
-            ]
+            )
+            if lustre_export_queue:
+                job_definition_container_env["LUSTRE_EXPORT_QUEUE_URL"] = (
+                    lustre_export_queue.queue_url
+                )
+
+        # Set up the NVMe instance store mounted by the launch template
+        if self.processor_config["container_type"] == "EC2":
+            job_definition_container_env["INSTANCE_STORE_DIR"] = (
+                INSTANCE_STORE_MOUNT_POINT
+            )
+            volumes.append(
+                batch.HostVolume(
+                    host_path=INSTANCE_STORE_MOUNT_POINT,
+                    name="instance-store-vol-name",
+                    container_path=INSTANCE_STORE_MOUNT_POINT,
+                )
+            )
+
+        # Set up the input cache shared by the jobs of the same instance
+        if (
+            self.node.try_get_context("batch-ffmpeg:input-cache:enable")
+            and self.processor_config["container_type"] == "EC2"
+        ):
+            cache_size = self.node.try_get_context("batch-ffmpeg:input-cache:size_gi_b")
+            job_definition_container_env["INPUT_CACHE_DIR"] = INPUT_CACHE_PATH
+            job_definition_container_env["INPUT_CACHE_MAX_BYTES"] = str(
+                int(cache_size or 20) * 1024**3
+            )
+            volumes.append(
+                batch.HostVolume(
+                    host_path=INPUT_CACHE_PATH,
+                    name="input-cache-vol-name",
+                    container_path=INPUT_CACHE_PATH,
+                )
+            )
 
         # Prepare common arguments for container definition
         container_def_args = {
@@ -112,7 +186,7 @@ class BatchJobConstruct(Construct):
             "job_role": job_role,
             "cpu": JOB_DEF_CPU,
             "memory": Size.mebibytes(JOB_DEF_MEMORY),
-            "volumes": lustre_volumes,
+            "volumes": volumes or None,
         }
 
         # Add Linux parameters if specified in the processor configuration
@@ -124,8 +198,13 @@ class BatchJobConstruct(Construct):
                 linux_parameters.add_devices(batch.Device(**device))
             container_def_args["linux_parameters"] = linux_parameters
 
+        # GPUs reserved by a job, several to schedule the commands of a
+        # multi-command job over the GPUs of an instance (g4dn.12xlarge: 4)
         if self.processor_config.get("gpu"):
-            container_def_args["gpu"] = self.processor_config["gpu"]
+            container_def_args["gpu"] = int(
+                self.node.try_get_context("batch-ffmpeg:nvidia:gpus")
+                or self.processor_config["gpu"]
+            )
         if self.processor_config.get("privileged"):
             container_def_args["privileged"] = self.processor_config["privileged"]
         if self.processor_config.get("environment"):
@@ -178,6 +257,18 @@ class BatchJobConstruct(Construct):
                         body=user_data_xray_txt,
                     )
                 )
+            with open(
+                from_root("infrastructure", "constructs", "user_data_nvme.txt")
+            ) as f:
+                user_data_nvme_txt = f.read().replace(
+                    "%MOUNT_POINT%", INSTANCE_STORE_MOUNT_POINT
+                )
+                multipart_user_data.add_part(
+                    ec2.MultipartBody.from_raw_body(
+                        content_type='text/x-shellscript; charset="us-ascii"',
+                        body=user_data_nvme_txt,
+                    )
+                )
             if lustre_fs:
                 # BUG issue with GPU AMI https://github.com/aws/amazon-ecs-ami/pull/191
                 if proc_name in ["xilinx", "nvidia"]:
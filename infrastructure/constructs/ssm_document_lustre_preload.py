@@ -10,9 +10,12 @@ from aws_cdk import Fn as fn
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_fsx as fsx
 from aws_cdk import aws_iam as iam
+from aws_cdk import aws_logs as logs
+from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_ssm as ssm
 from constructs import Construct
 from from_root import from_root
+from infrastructure.config.batch_config import LUSTRE_STRIPING
 
 try:
     from yaml import CLoader as Loader
@@ -26,7 +29,16 @@ logger.setLevel(LOGLEVEL)
 
 
 class SSMDocumentLustrePreload(Construct):
+    """SSM Automation documents preloading files in the Lustre file system.
+
+    - `batch-ffmpeg-lustre-preload` restores a single file.
+    - `batch-ffmpeg-lustre-bulk-preload` restores all the files of an S3
+      prefix or manifest from one instance, with bounded parallelism, and
+      logs the progress per file in CloudWatch Logs.
+    """
+
     ssm_document: ssm.CfnDocument
+    ssm_bulk_document: ssm.CfnDocument
 
     def __init__(
         self,
@@ -34,6 +46,7 @@ class SSMDocumentLustrePreload(Construct):
         construct_id: str,
         subnet: ec2.Subnet,
         lustre_fs: fsx.LustreFileSystem = None,
+        s3_bucket: s3.IBucket = None,
     ) -> None:
         super().__init__(scope, construct_id)
         ec2_ami = ec2.MachineImage.from_ssm_parameter(
@@ -56,6 +69,30 @@ class SSMDocumentLustrePreload(Construct):
                 ),
             ],
         )
+        # Bulk preload: list the prefix or read the manifest, log the progress
+        if s3_bucket:
+            s3_bucket.grant_read(ec2_ssm_role)
+        preload_log_group = logs.LogGroup(
+            self,
+            "preload-log-group",
+            log_group_name="/batch-ffmpeg/lustre-preload",
+            retention=logs.RetentionDays.ONE_MONTH,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+        )
+        ec2_ssm_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "logs:CreateLogStream",
+                    "logs:PutLogEvents",
+                    "logs:DescribeLogGroups",
+                    "logs:DescribeLogStreams",
+                ],
+                resources=[
+                    preload_log_group.log_group_arn,
+                    f"{preload_log_group.log_group_arn}:*",
+                ],
+            )
+        )
         ec2_ssm_instance_profile = iam.InstanceProfile(
             self,
             "ssm-ec2-instance-profile",
@@ -113,13 +150,20 @@ class SSMDocumentLustrePreload(Construct):
         md5_hash = hashlib.md5(user_data_lustre_txt.encode(), usedforsecurity=False)
         short_hash = md5_hash.hexdigest()[:5]
 
-        # SSM Automation Document YAML
-        with open(
-            from_root(
-                "infrastructure", "constructs", "ssm-documents", "lustre-preload.yaml"
-            )
-        ) as f:
-            lustre_preload_document_yaml = f.read()
+        # SSM Automation Documents YAML
+        documents = {}
+        for construct_name, file_name, document_name in [
+            ("ssm-automation", "lustre-preload.yaml", "batch-ffmpeg-lustre-preload"),
+            (
+                "ssm-automation-bulk",
+                "lustre-bulk-preload.yaml",
+                "batch-ffmpeg-lustre-bulk-preload",
+            ),
+        ]:
+            with open(
+                from_root("infrastructure", "constructs", "ssm-documents", file_name)
+            ) as f:
+                lustre_preload_document_yaml = f.read()
             lustre_preload_document_yaml = lustre_preload_document_yaml.replace(
                 "%IMAGE_ID%", ec2_ami.get_image(self).image_id
             )
@@ -138,14 +182,22 @@ class SSMDocumentLustrePreload(Construct):
             lustre_preload_document_yaml = lustre_preload_document_yaml.replace(
                 "%HASH_USERDATA%", short_hash
             )
+            lustre_preload_document_yaml = lustre_preload_document_yaml.replace(
+                "%LOG_GROUP%", preload_log_group.log_group_name
+            )
+            lustre_preload_document_yaml = lustre_preload_document_yaml.replace(
+                "%STRIPE_OPTIONS%", LUSTRE_STRIPING["layouts"]["large"]
+            )
 
-            self.ssm_document = ssm.CfnDocument(
+            documents[document_name] = ssm.CfnDocument(
                 self,
-                "ssm-automation",
+                construct_name,
                 content=yaml.load(lustre_preload_document_yaml, Loader=Loader),
                 document_type="Automation",
                 document_format="YAML",
-                name="batch-ffmpeg-lustre-preload",
+                name=document_name,
                 update_method="NewVersion",
                 tags=[cdk.CfnTag(key="hash-user-data", value=short_hash)],
             )
+        self.ssm_document = documents["batch-ffmpeg-lustre-preload"]
+        self.ssm_bulk_document = documents["batch-ffmpeg-lustre-bulk-preload"]
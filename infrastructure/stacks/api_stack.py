@@ -2,6 +2,7 @@ from aws_cdk import Stack
 import aws_cdk as cdk
 from aws_cdk import aws_apigateway as apigw
 from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lmb
 from aws_cdk import aws_stepfunctions as sfn
 from aws_cdk import aws_fsx as fsx
 from aws_cdk import aws_ssm as ssm
@@ -19,6 +20,7 @@ class ApiStack(Stack):
         construct_id: str,
         batch_jobs: List[BatchJob],
         sfn_state_machine: sfn.IStateMachine,
+        sizing_function: Optional[lmb.IFunction] = None,
         lustre_fs: Optional[fsx.LustreFileSystem] = None,
         ssm_document: Optional[ssm.CfnDocument] = None,
         **kwargs,
@@ -27,6 +29,7 @@ class ApiStack(Stack):
 
         self.lustre_fs = lustre_fs
         self.ssm_document = ssm_document
+        self.sizing_function = sizing_function
         self.api_role = self.create_api_role()
         self.api = self.create_api()
         self.create_batch_endpoints(batch_jobs)
@@ -143,6 +146,7 @@ class ApiStack(Stack):
                     ),
                     "output_url": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
                     "name": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
+                    "commands_url": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
                     "instance_type": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
                 },
             ),
@@ -215,6 +219,23 @@ class ApiStack(Stack):
                 ),
             )
 
+            # Job submission sized from the input media and resource history
+            if self.sizing_function:
+                sized_resource = proc_resource.add_resource("sized")
+                sized_resource.add_method(
+                    "POST",
+                    integration=apigw.LambdaIntegration(self.sizing_function),
+                    authorization_type=apigw.AuthorizationType.IAM,
+                    request_models={"application/json": request_model_submit},
+                    request_validator=apigw.RequestValidator(
+                        self,
+                        job.processor_name + "-sized-body-validator",
+                        rest_api=self.api,
+                        validate_request_body=True,
+                        validate_request_parameters=True,
+                    ),
+                )
+
     def create_batch_describe_endpoint(self, batch_resource: apigw.IResource) -> None:
         """Create an API endpoint for describing AWS Batch jobs."""
         # AWS Integation
@@ -307,6 +328,36 @@ class ApiStack(Stack):
                 properties={
                     "name": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
                     "compute": apigw.JsonSchema(type=apigw.JsonSchemaType.STRING),
+                    "fan_out": apigw.JsonSchema(
+                        type=apigw.JsonSchemaType.STRING,
+                        enum=["map", "array", "pack", "redrive"],
+                    ),
+                    "tolerated_failure_percentage": apigw.JsonSchema(
+                        type=apigw.JsonSchemaType.NUMBER, minimum=0, maximum=100
+                    ),
+                    "pack": apigw.JsonSchema(
+                        type=apigw.JsonSchemaType.OBJECT,
+                        properties={
+                            "target_seconds": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.NUMBER
+                            ),
+                            "profile": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.STRING
+                            ),
+                            "bytes_per_second": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.NUMBER
+                            ),
+                            "max_commands": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.INTEGER
+                            ),
+                            "gpus": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.INTEGER, minimum=0
+                            ),
+                        },
+                    ),
+                    "array_size": apigw.JsonSchema(
+                        type=apigw.JsonSchemaType.INTEGER, minimum=2, maximum=10000
+                    ),
                     "input": apigw.JsonSchema(
                         type=apigw.JsonSchemaType.OBJECT,
                         properties={
@@ -316,6 +367,42 @@ class ApiStack(Stack):
                             "s3_prefix": apigw.JsonSchema(
                                 type=apigw.JsonSchemaType.STRING
                             ),
+                            "manifest_url": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.STRING, pattern="^s3://"
+                            ),
+                            "manifest_format": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.STRING,
+                                enum=["csv", "json", "inventory"],
+                            ),
+                            "redrive_url": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.STRING,
+                                pattern="^(s3://|arn:)",
+                            ),
+                            "redrive_statuses": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.ARRAY,
+                                items=apigw.JsonSchema(
+                                    type=apigw.JsonSchemaType.STRING,
+                                    enum=["FAILED", "TIMED_OUT", "ABORTED"],
+                                ),
+                            ),
+                            "include": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.ARRAY,
+                                items=apigw.JsonSchema(
+                                    type=apigw.JsonSchemaType.STRING
+                                ),
+                            ),
+                            "exclude": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.ARRAY,
+                                items=apigw.JsonSchema(
+                                    type=apigw.JsonSchemaType.STRING
+                                ),
+                            ),
+                            "min_size": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.INTEGER, minimum=0
+                            ),
+                            "max_size": apigw.JsonSchema(
+                                type=apigw.JsonSchemaType.INTEGER, minimum=0
+                            ),
                             "file_options": apigw.JsonSchema(
                                 type=apigw.JsonSchemaType.STRING
                             ),
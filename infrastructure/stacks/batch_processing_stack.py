@@ -1,15 +1,30 @@
-from aws_cdk import Stack
+import json
+import os
+from aws_cdk import Stack, Duration, RemovalPolicy
+from aws_cdk import aws_dynamodb as dynamodb
 from aws_cdk import aws_ec2 as ec2
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
 from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lmb
+from aws_cdk import aws_ssm as ssm
 from aws_cdk import Environment
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_ecr as ecr
 from aws_cdk import aws_fsx as fsx
+from aws_cdk import aws_sqs as sqs
+from aws_cdk.aws_logs import RetentionDays
 from constructs import Construct
+from from_root import from_root
 from typing import List, Dict, Optional
 from infrastructure.constructs.batch_constructs import BatchJobConstruct
 from infrastructure.config.batch_config import (
     PROCESSOR_CONFIGS,
+    JOB_DEF_CPU,
+    JOB_DEF_MEMORY,
+    JOB_SIZING_RULES,
+    LUSTRE_EXPORT,
+    LUSTRE_RELEASE,
 )
 
 
@@ -63,11 +78,18 @@ class BatchProcessingStack(Stack):
         self.instance_role = self.create_instance_role()
         self.job_role = self.create_job_role()
         self.execution_role = self.create_execution_role()
+        self.lustre_export_queue = self.create_lustre_export_queue()
+        self.work_queue = self.create_work_queue()
+        self.result_table = self.create_result_table()
 
         self._batch_jobs: Dict[str, BatchJob] = {}
         for processor_name in PROCESSOR_CONFIGS.keys():
             self._batch_jobs[processor_name] = self.create_batch_job(processor_name)
 
+        self.sizing_function = self.create_sizing_function()
+        self.lustre_export_function = self.create_lustre_export_function()
+        self.lustre_release_function = self.create_lustre_release_function()
+
     def create_security_group(self) -> ec2.SecurityGroup:
         return ec2.SecurityGroup(
             self,
@@ -170,6 +192,9 @@ class BatchProcessingStack(Stack):
             execution_role=self.execution_role,
             job_role=self.job_role,
             lustre_fs=self.lustre_fs,
+            lustre_export_queue=self.lustre_export_queue,
+            work_queue=self.work_queue,
+            result_table=self.result_table,
             env=self.env,
         )
 
@@ -179,3 +204,281 @@ class BatchProcessingStack(Stack):
             compute_environment=batch_job_construct.compute_environment,
             processor_name=processor_name,
         )
+
+    def create_sizing_function(self) -> lmb.Function:
+        """Create the Lambda function recommending vCPU, memory and ffmpeg
+        threads per job, and the SSM parameter enabling it."""
+        ssm.StringParameter(
+            self,
+            "JobSizingFlag",
+            allowed_pattern="TRUE|FALSE",
+            description="Enable the input-aware job sizing in the AWS BATCH FFMPEG Stack",
+            parameter_name="/batch-ffmpeg/sizing",
+            string_value="FALSE",
+        )
+
+        role = iam.Role(
+            self,
+            "SizingLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the job sizing Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["ssm:GetParameter"],
+                resources=[
+                    f"arn:aws:ssm:{self.env.region}:{self.env.account}"
+                    f":parameter/batch-ffmpeg/*",
+                ],
+            )
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["batch:SubmitJob"],
+                resources=[
+                    f"arn:aws:batch:{self.env.region}:{self.env.account}:job-queue/batch-ffmpeg-job-queue-*",
+                    f"arn:aws:batch:{self.env.region}:{self.env.account}:job-definition/batch-ffmpeg-job-definition-*",
+                ],
+            )
+        )
+        # Inputs can be read from any bucket the jobs have access to
+        role.add_to_policy(
+            iam.PolicyStatement(actions=["s3:GetObject"], resources=["*"])
+        )
+        self.s3_bucket.grant_read(role)
+
+        # ffprobe binary in /opt/bin of a Lambda layer, otherwise the jobs are
+        # sized from the object size and extension
+        environment = {
+            "S3_BUCKET": self.s3_bucket.bucket_name,
+            "JOB_DEF_CPU": str(JOB_DEF_CPU),
+            "JOB_DEF_MEMORY": str(JOB_DEF_MEMORY),
+            "SIZING_RULES": json.dumps(JOB_SIZING_RULES),
+        }
+        layers = []
+        ffprobe_layer_arn = self.node.try_get_context(
+            "batch-ffmpeg:sizing:ffprobe_layer_arn"
+        )
+        if ffprobe_layer_arn:
+            layers.append(
+                lmb.LayerVersion.from_layer_version_arn(
+                    self, "FfprobeLayer", ffprobe_layer_arn
+                )
+            )
+            environment["FFPROBE_PATH"] = "/opt/bin/ffprobe"
+
+        return lmb.Function(
+            self,
+            "JobSizingFunction",
+            description="Recommend vCPU, memory and ffmpeg threads of AWS Batch FFmpeg jobs",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="sizing.sizing_lambda.handler",
+            code=lmb.Code.from_asset(os.path.join(from_root("src", "dist_lambda.zip"))),
+            timeout=Duration.seconds(30),
+            memory_size=512,
+            environment=environment,
+            layers=layers,
+            role=role,
+            log_retention=RetentionDays.ONE_WEEK,
+        )
+
+    def create_lustre_export_queue(self) -> Optional[sqs.Queue]:
+        """Create the queue of the Lustre outputs waiting for the export to
+        S3, when the Lustre file system is deployed."""
+        if not self.lustre_fs:
+            return None
+        dead_letter_queue = sqs.Queue(
+            self,
+            "LustreExportDeadLetterQueue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        queue = sqs.Queue(
+            self,
+            "LustreExportQueue",
+            queue_name="batch-ffmpeg-lustre-export",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+            visibility_timeout=Duration.minutes(15),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=10, queue=dead_letter_queue
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        queue.grant_send_messages(self.job_role)
+        return queue
+
+    def create_work_queue(self) -> sqs.Queue:
+        """Create the queue of the job payloads of the persistent workers
+        (`--queue_url`)."""
+        dead_letter_queue = sqs.Queue(
+            self,
+            "WorkDeadLetterQueue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        queue = sqs.Queue(
+            self,
+            "WorkQueue",
+            queue_name="batch-ffmpeg-work-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+            visibility_timeout=Duration.minutes(2),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3, queue=dead_letter_queue
+            ),
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        queue.grant_consume_messages(self.job_role)
+        return queue
+
+    def create_result_table(self) -> dynamodb.Table:
+        """Create the index of the results of the jobs, by fingerprint of
+        their inputs, command, ffmpeg version and compute family."""
+        table = dynamodb.Table(
+            self,
+            "ResultTable",
+            table_name="batch-ffmpeg-results",
+            partition_key=dynamodb.Attribute(
+                name="fingerprint", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        table.grant_read_write_data(self.job_role)
+        return table
+
+    def create_lustre_export_function(self) -> Optional[lmb.Function]:
+        """Create the scheduled Lambda function grouping the queued Lustre
+        outputs in data repository export tasks."""
+        if not self.lustre_export_queue:
+            return None
+        role = iam.Role(
+            self,
+            "LustreExportLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the Lustre export Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "fsx:CreateDataRepositoryTask",
+                    "fsx:DescribeDataRepositoryTasks",
+                    "fsx:TagResource",
+                ],
+                resources=["*"],
+            )
+        )
+        self.lustre_export_queue.grant_consume_messages(role)
+        self.lustre_export_queue.grant_send_messages(role)
+        self.s3_bucket.grant_read_write(role)
+
+        function = lmb.Function(
+            self,
+            "LustreExportFunction",
+            description="Export the FSx for Lustre outputs of AWS Batch FFmpeg jobs to S3 in batches",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="lustre_export.lustre_export_lambda.handler",
+            code=lmb.Code.from_asset(os.path.join(from_root("src", "dist_lambda.zip"))),
+            timeout=Duration.minutes(5),
+            memory_size=256,
+            reserved_concurrent_executions=1,
+            environment={
+                "S3_BUCKET": self.s3_bucket.bucket_name,
+                "FILE_SYSTEM_ID": self.lustre_fs.file_system_id,
+                "QUEUE_URL": self.lustre_export_queue.queue_url,
+                "MAX_PATHS_PER_TASK": str(LUSTRE_EXPORT["max_paths_per_task"]),
+                "MAX_ACTIVE_TASKS": str(LUSTRE_EXPORT["max_active_tasks"]),
+                "MAX_WAIT_SECONDS": str(LUSTRE_EXPORT["max_wait_seconds"]),
+            },
+            role=role,
+            log_retention=RetentionDays.ONE_WEEK,
+        )
+        events.Rule(
+            self,
+            "LustreExportSchedule",
+            schedule=events.Schedule.rate(
+                Duration.minutes(LUSTRE_EXPORT["schedule_minutes"])
+            ),
+            targets=[targets.LambdaFunction(function)],
+        )
+        return function
+
+    def create_lustre_release_function(self) -> Optional[lmb.Function]:
+        """Create the scheduled Lambda function releasing the least recently
+        used files when the Lustre file system fills up."""
+        if not self.lustre_fs:
+            return None
+        role = iam.Role(
+            self,
+            "LustreReleaseLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the Lustre release Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=[
+                    "fsx:CreateDataRepositoryTask",
+                    "fsx:DescribeDataRepositoryTasks",
+                    "fsx:DescribeFileSystems",
+                    "fsx:TagResource",
+                    "cloudwatch:GetMetricStatistics",
+                ],
+                resources=["*"],
+            )
+        )
+        self.s3_bucket.grant_read_write(role)
+
+        function = lmb.Function(
+            self,
+            "LustreReleaseFunction",
+            description="Release the least recently used files of the FSx for Lustre file system",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="lustre_release.lustre_release_lambda.handler",
+            code=lmb.Code.from_asset(os.path.join(from_root("src", "dist_lambda.zip"))),
+            timeout=Duration.minutes(10),
+            memory_size=256,
+            reserved_concurrent_executions=1,
+            environment={
+                "S3_BUCKET": self.s3_bucket.bucket_name,
+                "FILE_SYSTEM_ID": self.lustre_fs.file_system_id,
+                "HIGH_WATER_MARK": str(LUSTRE_RELEASE["high_water_mark"]),
+                "LOW_WATER_MARK": str(LUSTRE_RELEASE["low_water_mark"]),
+                "MIN_IDLE_SECONDS": str(LUSTRE_RELEASE["min_idle_minutes"] * 60),
+            },
+            role=role,
+            log_retention=RetentionDays.ONE_WEEK,
+        )
+        events.Rule(
+            self,
+            "LustreReleaseSchedule",
+            schedule=events.Schedule.rate(
+                Duration.minutes(LUSTRE_RELEASE["schedule_minutes"])
+            ),
+            targets=[targets.LambdaFunction(function)],
+        )
+        return function
@@ -132,7 +132,11 @@ class MetricsStack(Stack):
                 ],
             ),
             iam.PolicyStatement(
-                actions=["athena:StartQueryExecution", "athena:GetQueryExecution"],
+                actions=[
+                    "athena:StartQueryExecution",
+                    "athena:GetQueryExecution",
+                    "athena:GetQueryResults",
+                ],
                 resources=[
                     f"arn:aws:athena:{self.region}:{self.account}:workgroup/primary"
                 ],
@@ -188,6 +192,12 @@ class MetricsStack(Stack):
                     glue.CfnCrawler.S3TargetProperty(
                         path=f"s3://{self.s3_bucket.bucket_name}/metrics/ffqm/"
                     ),
+                    glue.CfnCrawler.S3TargetProperty(
+                        path=f"s3://{self.s3_bucket.bucket_name}/metrics/resources/"
+                    ),
+                    glue.CfnCrawler.S3TargetProperty(
+                        path=f"s3://{self.s3_bucket.bucket_name}/metrics/io/"
+                    ),
                 ]
             ),
             schema_change_policy=glue.CfnCrawler.SchemaChangePolicyProperty(
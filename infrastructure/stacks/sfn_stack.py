@@ -1,12 +1,21 @@
 import json
-from aws_cdk import Stack, CfnOutput
+import os
+from aws_cdk import Stack, CfnOutput, Duration
+from aws_cdk import aws_dynamodb as dynamodb
 from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lmb
 from aws_cdk import aws_logs as logs
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_stepfunctions as sfn
 import aws_cdk as cdk
 from constructs import Construct
 import from_root
+from infrastructure.config.batch_config import (
+    ADMISSION,
+    FFMPEG_REWRITES,
+    FFMPEG_VERSIONS,
+    JOB_DEF_CPU,
+)
 
 
 class SfnStack(Stack):
@@ -14,20 +23,43 @@ class SfnStack(Stack):
     AWS Batch with FFmpeg jobs.
 
     This stack creates a Step Functions state machine that processes a
-    list of S3 objects using AWS Batch jobs with FFmpeg. It includes the
+    list of S3 objects, from a prefix, a manifest or an S3 Inventory report
+    filtered by key and size, using AWS Batch jobs with FFmpeg. It includes the
     necessary IAM roles and permissions, as well as logging
-    configuration for the state machine.
+    configuration for the state machine. With ``"fan_out": "array"`` in the
+    input, the objects are processed by AWS Batch array jobs instead of one
+    job per object, and with ``"fan_out": "pack"`` by multi-command jobs
+    packed by estimated duration, and with ``"fan_out": "redrive"`` only the
+    failed items of a previous map run are processed again. Each submission
+    is admitted by a Lambda
+    function from the RUNNABLE depth of its queue and the AWS Batch API
+    rate, unless the result of the object is already indexed by a previous
+    job. A second state machine runs the compute-family benchmark matrix.
     """
 
     def __init__(
-        self, scope: Construct, construct_id: str, s3_bucket: s3.IBucket, **kwargs
+        self,
+        scope: Construct,
+        construct_id: str,
+        s3_bucket: s3.IBucket,
+        sizing_function: lmb.IFunction,
+        result_table: dynamodb.ITable,
+        **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
         self.s3_bucket = s3_bucket
+        self.sizing_function = sizing_function
+        self.result_table = result_table
+        self.benchmark_function = self.create_benchmark_function()
+        self.fan_out_function = self.create_fan_out_function()
+        self.admission_table = self.create_admission_table()
+        self.admission_function = self.create_admission_function()
+        self.result_index_function = self.create_result_index_function()
         self.state_role = self.create_state_machine_role()
         self.log_group = self.create_log_group()
         self.state_machine = self.create_state_machine()
+        self.benchmark_state_machine = self.create_benchmark_state_machine()
 
     def create_state_machine_role(self) -> iam.Role:
         """Create and return the IAM role for the Step Functions state
@@ -77,14 +109,248 @@ class SfnStack(Stack):
                 resources=[
                     f"arn:aws:states:{self.region}:{self.account}:stateMachine:batch-ffmpeg-state-machine",
                     f"arn:aws:states:{self.region}:{self.account}:execution:batch-ffmpeg-state-machine:*",
+                    f"arn:aws:states:{self.region}:{self.account}:stateMachine:batch-ffmpeg-benchmark-state-machine",
+                    f"arn:aws:states:{self.region}:{self.account}:execution:batch-ffmpeg-benchmark-state-machine:*",
                 ],
             )
         )
 
         self.s3_bucket.grant_read_write(role)
+        self.sizing_function.grant_invoke(role)
+        self.benchmark_function.grant_invoke(role)
+        self.fan_out_function.grant_invoke(role)
+        self.admission_function.grant_invoke(role)
+        self.result_index_function.grant_invoke(role)
 
         return role
 
+    def create_benchmark_function(self) -> lmb.Function:
+        """Create the Lambda function expanding the benchmark matrix and
+        aggregating its results."""
+        role = iam.Role(
+            self,
+            "BenchmarkLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the benchmark matrix Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["xray:GetTraceSummaries", "xray:BatchGetTraces"],
+                resources=["*"],
+            )
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["batch:DescribeJobDefinitions"], resources=["*"]
+            )
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["batch:RegisterJobDefinition", "batch:TagResource"],
+                resources=[
+                    f"arn:aws:batch:{self.region}:{self.account}:job-definition/batch-ffmpeg-job-definition-*",
+                ],
+            )
+        )
+        # Job and execution roles of the cloned job definitions
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["iam:PassRole"],
+                resources=[f"arn:aws:iam::{self.account}:role/*"],
+                conditions={
+                    "StringEquals": {
+                        "iam:PassedToService": [
+                            "batch.amazonaws.com",
+                            "ecs-tasks.amazonaws.com",
+                        ]
+                    }
+                },
+            )
+        )
+        self.s3_bucket.grant_read_write(role)
+
+        return lmb.Function(
+            self,
+            "BenchmarkFunction",
+            description="Expand the AWS Batch FFmpeg benchmark matrix and aggregate its results",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="benchmark.benchmark_lambda.handler",
+            code=lmb.Code.from_asset(
+                os.path.join(from_root.from_root("src", "dist_lambda.zip"))
+            ),
+            timeout=Duration.minutes(5),
+            memory_size=512,
+            environment={"S3_BUCKET": self.s3_bucket.bucket_name},
+            role=role,
+            log_retention=logs.RetentionDays.ONE_WEEK,
+        )
+
+    def create_fan_out_function(self) -> lmb.Function:
+        """Create the Lambda function selecting the objects of the state
+        machine (prefix, manifest or S3 Inventory report, key and size
+        filters) and writing the list of items, the manifests of the AWS
+        Batch array jobs (``"fan_out": "array"``) or the packed
+        multi-command jobs (``"fan_out": "pack"``), or the failed items of
+        a previous map run (``"fan_out": "redrive"``)."""
+        role = iam.Role(
+            self,
+            "FanOutLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the array job fan-out Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        # Manifests, S3 Inventory reports and inputs can be in any bucket the
+        # jobs have access to
+        role.add_to_policy(
+            iam.PolicyStatement(actions=["s3:GetObject"], resources=["*"])
+        )
+        # Map runs of the executions to redrive
+        role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["states:DescribeExecution", "states:ListMapRuns"],
+                resources=[
+                    f"arn:aws:states:{self.region}:{self.account}:execution:batch-ffmpeg-state-machine:*"
+                ],
+            )
+        )
+        # Failed children of the array jobs to redrive
+        role.add_to_policy(
+            iam.PolicyStatement(actions=["batch:ListJobs"], resources=["*"])
+        )
+        self.s3_bucket.grant_read_write(role)
+
+        return lmb.Function(
+            self,
+            "FanOutFunction",
+            description="Select the objects or failed items of the AWS Batch FFmpeg state machine and write the array job manifests and packed jobs",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="fan_out.fan_out_lambda.handler",
+            code=lmb.Code.from_asset(
+                os.path.join(from_root.from_root("src", "dist_lambda.zip"))
+            ),
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            # List of the selected objects, written before its upload
+            ephemeral_storage_size=cdk.Size.gibibytes(10),
+            environment={
+                "S3_BUCKET": self.s3_bucket.bucket_name,
+                "JOB_DEF_CPU": str(JOB_DEF_CPU),
+            },
+            role=role,
+            log_retention=logs.RetentionDays.ONE_WEEK,
+        )
+
+    def create_admission_table(self) -> dynamodb.Table:
+        """Create the table of the AWS Batch API token bucket and of the
+        RUNNABLE depth of the job queues."""
+        return dynamodb.Table(
+            self,
+            "AdmissionTable",
+            table_name="batch-ffmpeg-admission",
+            partition_key=dynamodb.Attribute(
+                name="id", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+        )
+
+    def create_admission_function(self) -> lmb.Function:
+        """Create the Lambda function admitting the job submissions of the
+        state machine."""
+        role = iam.Role(
+            self,
+            "AdmissionLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the admission control Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        role.add_to_policy(
+            iam.PolicyStatement(actions=["batch:ListJobs"], resources=["*"])
+        )
+        self.admission_table.grant_read_write_data(role)
+
+        return lmb.Function(
+            self,
+            "AdmissionFunction",
+            description="Admit the AWS Batch FFmpeg job submissions from the queue depth and the API rate",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="admission.admission_lambda.handler",
+            code=lmb.Code.from_asset(
+                os.path.join(from_root.from_root("src", "dist_lambda.zip"))
+            ),
+            timeout=Duration.seconds(30),
+            memory_size=256,
+            environment={
+                "TABLE_NAME": self.admission_table.table_name,
+                "SUBMIT_RATE": str(ADMISSION["submit_rate"]),
+                "BURST": str(ADMISSION["burst"]),
+                "MAX_RUNNABLE": str(ADMISSION["max_runnable"]),
+                "DEPTH_TTL_SECONDS": str(ADMISSION["depth_ttl_seconds"]),
+                "MAX_WAIT_SECONDS": str(ADMISSION["max_wait_seconds"]),
+            },
+            role=role,
+            log_retention=logs.RetentionDays.ONE_WEEK,
+        )
+
+    def create_result_index_function(self) -> lmb.Function:
+        """Create the Lambda function skipping the items of the state
+        machine whose result is indexed by a previous job."""
+        role = iam.Role(
+            self,
+            "ResultIndexLambdaRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            description="Role for the result index Lambda function",
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name(
+                    "service-role/AWSLambdaBasicExecutionRole"
+                )
+            ],
+        )
+        # ETags of the inputs, which can be in any bucket the jobs have access to
+        role.add_to_policy(
+            iam.PolicyStatement(actions=["s3:GetObject"], resources=["*"])
+        )
+        self.s3_bucket.grant_read_write(role)
+        self.result_table.grant_read_data(role)
+
+        return lmb.Function(
+            self,
+            "ResultIndexFunction",
+            description="Skip the AWS Batch FFmpeg jobs whose result is indexed and unchanged",
+            runtime=lmb.Runtime.PYTHON_3_13,
+            runtime_management_mode=lmb.RuntimeManagementMode.AUTO,
+            handler="result_index.result_index_lambda.handler",
+            code=lmb.Code.from_asset(
+                os.path.join(from_root.from_root("src", "dist_lambda.zip"))
+            ),
+            # Server-side copy of the reused outputs
+            timeout=Duration.minutes(5),
+            memory_size=256,
+            environment={
+                "TABLE_NAME": self.result_table.table_name,
+                "FFMPEG_VERSIONS": json.dumps(FFMPEG_VERSIONS),
+                "FFMPEG_REWRITES": json.dumps(FFMPEG_REWRITES),
+            },
+            role=role,
+            log_retention=logs.RetentionDays.ONE_WEEK,
+        )
+
     def create_log_group(self) -> logs.LogGroup:
         """Create and return the CloudWatch log group for the state machine."""
         return logs.LogGroup(
@@ -118,14 +384,43 @@ class SfnStack(Stack):
 
         return state_machine
 
-    def load_state_machine_definition(self) -> str:
+    def create_benchmark_state_machine(self) -> sfn.StateMachine:
+        """Create and return the state machine running the benchmark
+        matrix."""
+        definition = self.load_state_machine_definition("benchmark_state.asl.json")
+
+        state_machine = sfn.StateMachine(
+            self,
+            "FFmpegBenchmarkStateMachine",
+            definition_body=sfn.DefinitionBody.from_string(definition),
+            role=self.state_role,
+            logs=sfn.LogOptions(destination=self.log_group, level=sfn.LogLevel.ALL),
+            tracing_enabled=True,
+            state_machine_name="batch-ffmpeg-benchmark-state-machine",
+        )
+
+        CfnOutput(
+            self,
+            "BenchmarkStateMachineArn",
+            value=state_machine.state_machine_arn,
+            description="ARN of the FFmpeg Benchmark State Machine",
+        )
+
+        return state_machine
+
+    def load_state_machine_definition(
+        self, file_name: str = "main_state.asl.json"
+    ) -> str:
         """Load and return the state machine definition from a JSON file.
 
+        Args:
+            file_name (str): The file in ``infrastructure/stacks/state-machine``.
+
         Returns:
             str: The state machine definition as a JSON string.
         """
         file_path = from_root.from_root(
-            "infrastructure", "stacks", "state-machine", "main_state.asl.json"
+            "infrastructure", "stacks", "state-machine", file_name
         )
         with open(file_path, "r") as f:
             definition = json.load(f)
@@ -135,6 +430,11 @@ class SfnStack(Stack):
         replacements = {
             "${REGION}": self.region,
             "${ACCOUNT}": self.account,
+            "${SIZING_FUNCTION_ARN}": self.sizing_function.function_arn,
+            "${BENCHMARK_FUNCTION_ARN}": self.benchmark_function.function_arn,
+            "${FAN_OUT_FUNCTION_ARN}": self.fan_out_function.function_arn,
+            "${ADMISSION_FUNCTION_ARN}": self.admission_function.function_arn,
+            "${RESULT_INDEX_FUNCTION_ARN}": self.result_index_function.function_arn,
         }
         for key, value in replacements.items():
             definition_str = definition_str.replace(key, value)
@@ -29,6 +29,7 @@ class StorageStack(Stack):
         self.vpc = vpc
         self.s3_bucket = self.create_s3_bucket()
         self.ecr_repository = self.create_ecr_repository()
+        self.ssm_bulk_document: Optional[ssm.CfnDocument] = None
         self.lustre_fs, self.ssm_document = self.create_lustre_filesystem()
         self.add_outputs()
 
@@ -109,15 +110,15 @@ class StorageStack(Stack):
     def create_ssm_document(
         self, lustre_fs: fsx.LustreFileSystem, subnet: ec2.ISubnet
     ) -> ssm.CfnDocument:
-        """Create an SSM document for preloading data into the Lustre file
-        system.
+        """Create the SSM documents for preloading data into the Lustre file
+        system (a single file, or an S3 prefix or manifest).
 
         Args:
             lustre_fs (fsx.LustreFileSystem): The Lustre file system to preload data into.
             subnet (ec2.ISubnet): The subnet to use for the preload process.
 
         Returns:
-            ssm.CfnDocument: The created SSM document.
+            ssm.CfnDocument: The created single file SSM document.
         """
 
         ssm_document_preload = SSMDocumentLustrePreload(
@@ -125,7 +126,9 @@ class StorageStack(Stack):
             "SSMLustrePreload",
             lustre_fs=lustre_fs,
             subnet=subnet,
+            s3_bucket=self.s3_bucket,
         )
+        self.ssm_bulk_document = ssm_document_preload.ssm_bulk_document
         return ssm_document_preload.ssm_document
 
     def add_outputs(self) -> None:
@@ -0,0 +1,415 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Emulate a small AWS Batch fleet on one Linux host.
+
+The emulator exposes the job queues of the stack
+(``batch-ffmpeg-job-queue-<compute>``) and a subset of the AWS Batch API
+(``submit_job``, ``describe_jobs``, ``list_jobs``, ``terminate_job``). Jobs
+are scheduled on a vCPU and memory budget and run ``wrapper.py`` as local
+processes, with the command of the job definition (``FFMPEG_SCRIPT_COMMAND``)
+and its default parameters (``FFMPEG_SCRIPT_DEFAULT_VALUES``), and the
+environment of the job definition of the compute family. S3 requests of the
+jobs go to a local stand-in (moto server or MinIO) with
+``AWS_ENDPOINT_URL_S3``.
+
+Scheduling policies:
+
+- ``fifo``: jobs start in submission order, a job that does not fit blocks
+  the next ones;
+- ``first-fit``: the first submitted job that fits starts (backfilling);
+- ``smallest-first``: the job with the fewest vCPUs starts first.
+
+Replay a job mix and print the queueing and throughput statistics, from the
+``src`` directory:
+
+    python -m benchmarks.batch_emulator replay jobs.jsonl --vcpus 16 \\
+        --endpoint-url http://localhost:9000 --bucket my-bucket
+
+Each line of the job mix is a job: ``compute``, ``parameters`` (as in
+``SubmitJob``), optional ``vcpus``, ``memory``, ``environment``,
+``submit_offset`` (seconds after the start of the replay) and
+``duration``. With ``--sleep``, jobs sleep for their ``duration`` instead of
+running ffmpeg, to compare scheduling policies without media.
+
+Processes are not confined like containers: ``FFMPEG_THREADS`` is set to the
+vCPUs of the job so that ffmpeg does not use all the cores of the host.
+"""
+
+import json
+import os
+import subprocess  # nosec B404
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from shared_libraries import benchmark
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from infrastructure.config.batch_config import (  # noqa: E402
+    FFMPEG_SCRIPT_COMMAND,
+    FFMPEG_SCRIPT_DEFAULT_VALUES,
+    JOB_DEF_CPU,
+    JOB_DEF_MEMORY,
+    PROCESSOR_CONFIGS,
+    RESOURCE_SAMPLER_INTERVAL,
+)
+
+WRAPPER = os.path.join(os.path.dirname(__file__), "..", "wrapper", "wrapper.py")
+POLICIES = ["fifo", "first-fit", "smallest-first"]
+QUEUE_PREFIX = "batch-ffmpeg-job-queue-"
+DEFINITION_PREFIX = "batch-ffmpeg-job-definition-"
+FINAL_STATUSES = ["SUCCEEDED", "FAILED"]
+
+
+def substitute(
+    command: List[str], defaults: Dict[str, str], parameters: Dict[str, str]
+) -> List[str]:
+    """Replace the ``Ref::<name>`` placeholders of a job definition command
+    with the parameters of the job or their default values.
+
+    Examples:
+        >>> substitute(
+        ...     ["--input_url", "Ref::input_url", "--name", "Ref::name"],
+        ...     {"input_url": "null", "name": "null"},
+        ...     {"input_url": "s3://bucket/a.mp4"},
+        ... )
+        ['--input_url', 's3://bucket/a.mp4', '--name', 'null']
+    """
+    values = {**defaults, **parameters}
+    return [
+        values[arg[5:]] if arg.startswith("Ref::") and arg[5:] in values else arg
+        for arg in command
+    ]
+
+
+def compute_environment_name(compute: str) -> str:
+    """Return the compute environment name of a compute family in the stack.
+
+    Examples:
+        >>> compute_environment_name("fargate")
+        'batch-ffmpeg-fargate'
+        >>> compute_environment_name("arm")
+        'batch-ffmpeg-ec2-arm'
+    """
+    if PROCESSOR_CONFIGS[compute]["container_type"] == "FARGATE":
+        return f"batch-ffmpeg-{compute}"
+    return f"batch-ffmpeg-ec2-{compute}"
+
+
+def select(runnable: List[Dict], vcpus: int, memory: int, policy: str) -> List[Dict]:
+    """Select the runnable jobs to start on the free vCPUs and memory.
+
+    Examples:
+        >>> jobs = [{"vcpus": 8, "memory": 1}, {"vcpus": 2, "memory": 1}]
+        >>> len(select(jobs, 4, 100, "fifo"))
+        0
+        >>> [j["vcpus"] for j in select(jobs, 4, 100, "first-fit")]
+        [2]
+        >>> [j["vcpus"] for j in select(jobs, 10, 100, "smallest-first")]
+        [2, 8]
+    """
+    if policy == "smallest-first":
+        runnable = sorted(runnable, key=lambda job: job["vcpus"])
+    selected = []
+    for job in runnable:
+        if job["vcpus"] <= vcpus and job["memory"] <= memory:
+            selected.append(job)
+            vcpus -= job["vcpus"]
+            memory -= job["memory"]
+        elif policy == "fifo":
+            break
+    return selected
+
+
+class BatchEmulator:
+    """A vCPU and memory budget shared by the job queues of the stack.
+
+    Args:
+        vcpus (int): vCPUs of the emulated fleet.
+        memory (int): Memory of the emulated fleet in MiB.
+        policy (str): Scheduling policy, one of ``POLICIES``.
+        environment (dict): Environment of all the jobs, e.g. ``S3_BUCKET``.
+        workdir (str): Directory of the job logs and working directories.
+        runner (callable): Returns the process arguments of a job, the
+            wrapper by default.
+    """
+
+    def __init__(
+        self,
+        vcpus: int,
+        memory: int,
+        policy: str = "first-fit",
+        environment: Optional[Dict[str, str]] = None,
+        workdir: Optional[str] = None,
+        runner: Optional[Callable[[Dict], List[str]]] = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy}, expected one of {POLICIES}")
+        self.vcpus = vcpus
+        self.memory = memory
+        self.policy = policy
+        self.environment = environment or {}
+        self.workdir = workdir or tempfile.mkdtemp(prefix="batch-emulator-")
+        self.runner = runner or self.wrapper_command
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._schedule, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def wrapper_command(job: Dict[str, Any]) -> List[str]:
+        command = substitute(
+            FFMPEG_SCRIPT_COMMAND, FFMPEG_SCRIPT_DEFAULT_VALUES, job["parameters"]
+        )
+        return [sys.executable, os.path.abspath(WRAPPER), *command]
+
+    def submit_job(
+        self,
+        jobName: str,
+        jobQueue: str,
+        jobDefinition: str,
+        parameters: Optional[Dict[str, str]] = None,
+        containerOverrides: Optional[Dict[str, Any]] = None,
+        duration: Optional[float] = None,
+        **kwargs,
+    ) -> Dict[str, str]:
+        """Submit a job, with the arguments of the AWS Batch API.
+
+        ``duration`` is the run time of the job with the sleep runner.
+        """
+        compute = jobQueue.rsplit("/", 1)[-1].replace(QUEUE_PREFIX, "")
+        if compute not in PROCESSOR_CONFIGS:
+            raise ValueError(f"Unknown job queue {jobQueue}")
+        overrides = containerOverrides or {}
+        resources = {
+            r["type"]: int(r["value"])
+            for r in overrides.get("resourceRequirements", [])
+        }
+        job = {
+            "jobId": str(uuid.uuid4()),
+            "jobName": jobName,
+            "jobQueue": f"{QUEUE_PREFIX}{compute}",
+            "jobDefinition": jobDefinition,
+            "compute": compute,
+            "status": "RUNNABLE",
+            "parameters": parameters or {},
+            "vcpus": resources.get("VCPU", JOB_DEF_CPU),
+            "memory": resources.get("MEMORY", JOB_DEF_MEMORY),
+            "environment": {
+                e["name"]: e["value"] for e in overrides.get("environment", [])
+            },
+            "duration": duration,
+            "createdAt": time.time(),
+            "startedAt": None,
+            "stoppedAt": None,
+            "exitCode": None,
+            "statusReason": None,
+        }
+        if job["vcpus"] > self.vcpus or job["memory"] > self.memory:
+            # A job larger than the fleet stays RUNNABLE forever on AWS Batch
+            raise ValueError(f"Job {jobName} does not fit in the emulated fleet")
+        with self._lock:
+            self.jobs[job["jobId"]] = job
+        return {"jobId": job["jobId"], "jobName": jobName}
+
+    def describe_jobs(self, jobs: List[str]) -> Dict[str, List[Dict]]:
+        with self._lock:
+            return {"jobs": [dict(self.jobs[j]) for j in jobs if j in self.jobs]}
+
+    def list_jobs(self, jobQueue: str, jobStatus: str = "RUNNING") -> Dict:
+        with self._lock:
+            return {
+                "jobSummaryList": [
+                    {"jobId": job["jobId"], "jobName": job["jobName"]}
+                    for job in self.jobs.values()
+                    if job["jobQueue"] == jobQueue and job["status"] == jobStatus
+                ]
+            }
+
+    def terminate_job(self, jobId: str, reason: str):
+        with self._lock:
+            job = self.jobs[jobId]
+            if job["status"] == "RUNNABLE":
+                job.update(
+                    {
+                        "status": "FAILED",
+                        "statusReason": reason,
+                        "stoppedAt": time.time(),
+                    }
+                )
+            elif jobId in self._processes:
+                job["statusReason"] = reason
+                self._processes[jobId].terminate()
+
+    def _environment(self, job: Dict[str, Any]) -> Dict[str, str]:
+        return {
+            **os.environ,
+            "AWS_XRAY_SDK_ENABLED": "false",
+            "RESOURCE_SAMPLER_INTERVAL": str(RESOURCE_SAMPLER_INTERVAL),
+            **PROCESSOR_CONFIGS[job["compute"]].get("environment", {}),
+            **self.environment,
+            "FFMPEG_THREADS": str(job["vcpus"]),
+            **job["environment"],
+            "AWS_BATCH_JOB_ID": job["jobId"],
+            "AWS_BATCH_JQ_NAME": job["jobQueue"],
+            "AWS_BATCH_CE_NAME": compute_environment_name(job["compute"]),
+        }
+
+    def _start(self, job: Dict[str, Any]):
+        workdir = os.path.join(self.workdir, job["jobId"])
+        os.makedirs(workdir)
+        with open(os.path.join(workdir, "output.log"), "wb") as log:
+            self._processes[job["jobId"]] = subprocess.Popen(  # nosec B603
+                self.runner(job),
+                cwd=workdir,
+                env={**self._environment(job), "TMPDIR": workdir},
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+        job.update({"status": "RUNNING", "startedAt": time.time()})
+
+    def _schedule(self):
+        while not self._stop.wait(0.05):
+            with self._lock:
+                for job_id, process in list(self._processes.items()):
+                    if process.poll() is None:
+                        continue
+                    succeeded = process.returncode == 0
+                    self.jobs[job_id].update(
+                        {
+                            "status": "SUCCEEDED" if succeeded else "FAILED",
+                            "exitCode": process.returncode,
+                            "stoppedAt": time.time(),
+                        }
+                    )
+                    del self._processes[job_id]
+                running = [self.jobs[job_id] for job_id in self._processes]
+                runnable = sorted(
+                    (job for job in self.jobs.values() if job["status"] == "RUNNABLE"),
+                    key=lambda job: job["createdAt"],
+                )
+                free_vcpus = self.vcpus - sum(job["vcpus"] for job in running)
+                free_memory = self.memory - sum(job["memory"] for job in running)
+                for job in select(runnable, free_vcpus, free_memory, self.policy):
+                    self._start(job)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until all the submitted jobs are finished."""
+        deadline = time.time() + timeout if timeout else None
+        while not deadline or time.time() < deadline:
+            with self._lock:
+                if all(job["status"] in FINAL_STATUSES for job in self.jobs.values()):
+                    return True
+            time.sleep(0.1)
+        return False
+
+    def shutdown(self):
+        """Stop the scheduler and terminate the running jobs."""
+        self._stop.set()
+        self._thread.join()
+        for process in self._processes.values():
+            process.terminate()
+
+    def statistics(self) -> Dict[str, Any]:
+        """Return the queueing, run time and throughput statistics of the
+        finished jobs."""
+        with self._lock:
+            jobs = [j for j in self.jobs.values() if j["status"] in FINAL_STATUSES]
+        started = [j for j in jobs if j["startedAt"]]
+        if not started:
+            return {"jobs": len(jobs)}
+        waits = [j["startedAt"] - j["createdAt"] for j in started]
+        runs = [j["stoppedAt"] - j["startedAt"] for j in started]
+        makespan = max(j["stoppedAt"] for j in jobs) - min(j["createdAt"] for j in jobs)
+        busy = sum(j["vcpus"] * (j["stoppedAt"] - j["startedAt"]) for j in started)
+        return {
+            "policy": self.policy,
+            "vcpus": self.vcpus,
+            "jobs": len(jobs),
+            "succeeded": sum(j["status"] == "SUCCEEDED" for j in jobs),
+            "failed": sum(j["status"] == "FAILED" for j in jobs),
+            "makespan_seconds": round(makespan, 2),
+            "jobs_per_minute": round(len(jobs) / makespan * 60, 2),
+            "vcpu_utilization": round(busy / (self.vcpus * makespan), 3),
+            "queue_wait_seconds": {
+                f"p{q}": round(benchmark.percentile(waits, q), 2) for q in [50, 95, 99]
+            },
+            "run_seconds": {
+                f"p{q}": round(benchmark.percentile(runs, q), 2) for q in [50, 95, 99]
+            },
+        }
+
+
+def sleep_command(job: Dict[str, Any]) -> List[str]:
+    """Run a job as a sleep of its ``duration``."""
+    return ["sleep", str(job["duration"] or 1)]
+
+
+@click.group()
+def main():
+    """Emulate the AWS Batch job queues of the stack on this host."""
+
+
+@main.command()
+@click.argument("jobs_file", type=click.File())
+@click.option("--vcpus", default=os.cpu_count(), help="vCPUs of the emulated fleet")
+@click.option("--memory", default=None, type=int, help="Memory in MiB (host memory)")
+@click.option("--policy", default="first-fit", type=click.Choice(POLICIES))
+@click.option("--endpoint-url", default=None, help="Local S3 endpoint of the jobs")
+@click.option("--bucket", default=None, help="S3_BUCKET of the jobs")
+@click.option("--speed", default=1.0, help="Submission speed-up of the replay")
+@click.option("--sleep", is_flag=True, help="Sleep for the job duration, no ffmpeg")
+def replay(jobs_file, vcpus, memory, policy, endpoint_url, bucket, speed, sleep):
+    """Replay a job mix (JSON lines) and print the statistics."""
+    mix = [json.loads(line) for line in jobs_file if line.strip()]
+    environment = {}
+    if endpoint_url:
+        environment["AWS_ENDPOINT_URL_S3"] = endpoint_url
+    if bucket:
+        environment["S3_BUCKET"] = bucket
+    if not memory:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024**2
+    emulator = BatchEmulator(
+        vcpus, memory, policy, environment, runner=sleep_command if sleep else None
+    )
+    click.echo(f"Logs and working directories: {emulator.workdir}", err=True)
+    start = time.time()
+    try:
+        for i, item in enumerate(sorted(mix, key=lambda j: j.get("submit_offset", 0))):
+            delay = start + item.get("submit_offset", 0) / speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            resources = [
+                {"type": t, "value": str(item[k])}
+                for t, k in [("VCPU", "vcpus"), ("MEMORY", "memory")]
+                if k in item
+            ]
+            emulator.submit_job(
+                jobName=item.get("name", f"replay-{i}"),
+                jobQueue=f"{QUEUE_PREFIX}{item['compute']}",
+                jobDefinition=f"{DEFINITION_PREFIX}{item['compute']}",
+                parameters=item.get("parameters"),
+                containerOverrides={
+                    "resourceRequirements": resources,
+                    "environment": [
+                        {"name": k, "value": v}
+                        for k, v in item.get("environment", {}).items()
+                    ],
+                },
+                duration=item.get("duration", 1) / speed,
+            )
+        emulator.wait()
+    finally:
+        emulator.shutdown()
+    click.echo(json.dumps(emulator.statistics(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,683 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Load test the job submission paths and report the latency per stage.
+
+Jobs of a mix are submitted at a target rate, then tracked with describe
+calls until they are finished. From the ``src`` directory:
+
+    # REST API of the stack, AWS Batch jobs
+    python -m benchmarks.load_generator jobs.jsonl --backend api \\
+        --endpoint https://xxxx.execute-api.us-east-1.amazonaws.com/prod/ \\
+        --rate 10000 --count 2000 --slo starting:p95=900
+    # REST API of the stack, Step Functions executions
+    python -m benchmarks.load_generator executions.jsonl --backend api --target sfn ...
+    # AWS SDK, without the REST API
+    python -m benchmarks.load_generator jobs.jsonl --backend sdk --rate 10000
+    # Local AWS Batch emulator, each job sleeps for its duration
+    python -m benchmarks.load_generator jobs.jsonl --backend emulator --vcpus 64
+
+Each line of the job mix is a job, as in the batch emulator replay:
+``compute``, ``parameters`` (as in ``SubmitJob``), optional ``vcpus``,
+``memory``, ``environment``, ``instance_type`` (REST API), ``duration``
+(emulator) and ``weight`` (1). With ``--target sfn``, a line is the body of
+``/state/execute`` (``input``, ``output``, ``global``, ``compute``) in
+``input``. The jobs are drawn from the mix by weight.
+
+Stages of an AWS Batch job: ``submit`` (submission request, with its
+retries), ``runnable`` (response to ``RUNNABLE``), ``starting`` (queue wait
+and scale-out), ``running`` (container start) and ``succeeded`` (run time).
+Stages of an execution: ``submit``, ``running`` and ``succeeded``. A stage
+is timed when its status is first seen, with the resolution of
+``--poll-interval``; the statuses skipped between two polls take the time
+of the next one.
+
+Throttled and server errors are retried with exponential backoff and full
+jitter, the clients do not retry themselves. The REST API maps all the
+responses of AWS Batch and Step Functions to HTTP 200: a response without
+job ID or execution ARN is an ``IntegrationError``, retried when its message
+reports a rate limit.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import boto3
+import click
+import requests
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from benchmarks.batch_emulator import (
+    DEFINITION_PREFIX,
+    POLICIES,
+    QUEUE_PREFIX,
+    BatchEmulator,
+    sleep_command,
+)
+from shared_libraries import benchmark
+
+STATE_MACHINE_NAME = "batch-ffmpeg-state-machine"
+STATUSES = {
+    "batch": ["SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING", "SUCCEEDED"],
+    "sfn": ["RUNNING", "SUCCEEDED"],
+}
+# Statuses reported as stages, the others are folded in the next stage
+STAGES = {
+    "batch": ["RUNNABLE", "STARTING", "RUNNING", "SUCCEEDED"],
+    "sfn": ["RUNNING", "SUCCEEDED"],
+}
+FAILED_STATUSES = ["FAILED", "TIMED_OUT", "ABORTED"]
+THROTTLING_CODES = [
+    "429",
+    "TooManyRequestsException",
+    "ThrottlingException",
+    "Throttling",
+    "RequestLimitExceeded",
+]
+SERVER_CODES = ["ServerException", "ServiceUnavailable", "InternalFailure"]
+QUANTILES = [50, 90, 95, 99]
+NO_RETRY = Config(retries={"total_max_attempts": 1, "mode": "standard"})
+
+
+class SubmitError(Exception):
+    """A submission or describe request was rejected.
+
+    Args:
+        code (str): Error code of the service, or HTTP status code.
+        message (str): Error message.
+    """
+
+    def __init__(self, code: str, message: str = ""):
+        super().__init__(f"{code}: {message}")
+        self.code = code
+        self.message = message
+
+    @property
+    def throttled(self) -> bool:
+        return self.code in THROTTLING_CODES
+
+    @property
+    def retryable(self) -> bool:
+        return self.throttled or self.code in SERVER_CODES or self.code[:1] == "5"
+
+    @classmethod
+    def from_client_error(cls, e: ClientError) -> "SubmitError":
+        return cls(e.response["Error"]["Code"], e.response["Error"].get("Message", ""))
+
+    @classmethod
+    def from_integration(cls, body: Dict[str, Any]) -> "SubmitError":
+        """Error of a REST API response without job ID or execution ARN.
+
+        Examples:
+            >>> SubmitError.from_integration({"message": "Too Many Requests"}).code
+            'TooManyRequestsException'
+            >>> SubmitError.from_integration({"executionArn": ""}).code
+            'IntegrationError'
+        """
+        message = str(body.get("message") or body.get("Message") or "")
+        if "too many requests" in message.lower() or "rate" in message.lower():
+            return cls("TooManyRequestsException", message)
+        return cls("IntegrationError", message or json.dumps(body))
+
+
+def submit_job_arguments(item: Dict[str, Any], name: str) -> Dict[str, Any]:
+    """Return the ``SubmitJob`` arguments of a job of the mix.
+
+    Examples:
+        >>> args = submit_job_arguments({"compute": "arm", "vcpus": 2}, "load-1")
+        >>> args["jobQueue"], args["containerOverrides"]["resourceRequirements"]
+        ('batch-ffmpeg-job-queue-arm', [{'type': 'VCPU', 'value': '2'}])
+    """
+    return {
+        "jobName": name,
+        "jobQueue": f"{QUEUE_PREFIX}{item['compute']}",
+        "jobDefinition": f"{DEFINITION_PREFIX}{item['compute']}",
+        "parameters": item.get("parameters", {}),
+        "containerOverrides": {
+            "resourceRequirements": [
+                {"type": t, "value": str(item[k])}
+                for t, k in [("VCPU", "vcpus"), ("MEMORY", "memory")]
+                if k in item
+            ],
+            "environment": [
+                {"name": k, "value": v} for k, v in item.get("environment", {}).items()
+            ],
+        },
+    }
+
+
+class Backend:
+    """Submit the jobs of the mix and describe their status.
+
+    ``describe_size`` is the number of IDs of a describe request.
+    """
+
+    target = "batch"
+    describe_size = 1
+
+    def submit(self, item: Dict[str, Any], name: str) -> str:
+        raise NotImplementedError
+
+    def describe(self, ids: List[str]) -> Dict[str, str]:
+        raise NotImplementedError
+
+
+class BatchBackend(Backend):
+    """AWS Batch API of the AWS SDK, or of the local emulator."""
+
+    describe_size = 100
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def submit(self, item: Dict[str, Any], name: str) -> str:
+        try:
+            return self.client.submit_job(**submit_job_arguments(item, name))["jobId"]
+        except ClientError as e:
+            raise SubmitError.from_client_error(e)
+
+    def describe(self, ids: List[str]) -> Dict[str, str]:
+        try:
+            jobs = self.client.describe_jobs(jobs=ids)["jobs"]
+        except ClientError as e:
+            raise SubmitError.from_client_error(e)
+        return {job["jobId"]: job["status"] for job in jobs}
+
+
+class EmulatorBackend(BatchBackend):
+    """Local AWS Batch emulator, the jobs sleep for their ``duration``."""
+
+    def submit(self, item: Dict[str, Any], name: str) -> str:
+        try:
+            return self.client.submit_job(
+                **submit_job_arguments(item, name), duration=item.get("duration", 1)
+            )["jobId"]
+        except ValueError as e:
+            raise SubmitError("ClientException", str(e))
+
+
+class StepFunctionsBackend(Backend):
+    """AWS Step Functions API of the AWS SDK."""
+
+    target = "sfn"
+
+    def __init__(self, client: Any, state_machine_arn: str):
+        self.client = client
+        self.state_machine_arn = state_machine_arn
+
+    def submit(self, item: Dict[str, Any], name: str) -> str:
+        try:
+            return self.client.start_execution(
+                stateMachineArn=self.state_machine_arn,
+                name=name,
+                input=json.dumps(item["input"]),
+            )["executionArn"]
+        except ClientError as e:
+            raise SubmitError.from_client_error(e)
+
+    def describe(self, ids: List[str]) -> Dict[str, str]:
+        try:
+            return {
+                arn: self.client.describe_execution(executionArn=arn)["status"]
+                for arn in ids
+            }
+        except ClientError as e:
+            raise SubmitError.from_client_error(e)
+
+
+class ApiBackend(Backend):
+    """REST API of the stack, requests signed with AWS Signature Version 4.
+
+    Args:
+        endpoint (str): Endpoint of the API, e.g. the ``<API_ENDPOINT>`` output.
+        region (str): Region of the API.
+        target (str): ``batch`` (``/batch/execute/<compute>``) or ``sfn``
+            (``/state/execute``).
+    """
+
+    def __init__(self, endpoint: str, region: str, target: str = "batch"):
+        self.endpoint = endpoint.rstrip("/")
+        self.region = region
+        self.target = target
+        self.credentials = boto3.session.Session().get_credentials()
+        self._local = threading.local()
+
+    def post(self, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        url = f"{self.endpoint}/{path}"
+        request = AWSRequest(
+            method="POST",
+            url=url,
+            data=json.dumps(body),
+            headers={"Content-Type": "application/json"},
+        )
+        SigV4Auth(self.credentials, "execute-api", self.region).add_auth(request)
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        try:
+            response = self._local.session.post(
+                url, data=request.body, headers=dict(request.headers), timeout=30
+            )
+        except requests.RequestException as e:
+            raise SubmitError(type(e).__name__, str(e))
+        if response.status_code != 200:
+            raise SubmitError(str(response.status_code), response.text[:200])
+        return response.json()
+
+    def submit(self, item: Dict[str, Any], name: str) -> str:
+        if self.target == "sfn":
+            body = self.post("state/execute", item["input"])
+            key = "executionArn"
+        else:
+            body = dict(item.get("parameters", {}))
+            if item.get("instance_type"):
+                body["instance_type"] = item["instance_type"]
+            body = self.post(f"batch/execute/{item['compute']}", body)
+            key = "jobId"
+        if not body.get(key):
+            raise SubmitError.from_integration(body)
+        return body[key]
+
+    def describe(self, ids: List[str]) -> Dict[str, str]:
+        statuses = {}
+        for job_id in ids:
+            if self.target == "sfn":
+                body = self.post("state/describe", {"executionArn": job_id})
+            else:
+                body = self.post("batch/describe", {"jobId": job_id})
+            if body.get("status"):
+                statuses[job_id] = body["status"]
+        return statuses
+
+
+def observe(seen: Dict[str, float], status: str, now: float, statuses: List[str]):
+    """Record the first time a status is seen. The statuses skipped since
+    the previous poll take the same time.
+
+    Examples:
+        >>> seen = {}
+        >>> observe(seen, "RUNNABLE", 10.0, STATUSES["batch"])
+        >>> observe(seen, "RUNNING", 20.0, STATUSES["batch"])
+        >>> seen
+        {'SUBMITTED': 10.0, 'PENDING': 10.0, 'RUNNABLE': 10.0, 'STARTING': 20.0, 'RUNNING': 20.0}
+    """
+    if status in statuses:
+        for skipped in statuses[: statuses.index(status) + 1]:
+            seen.setdefault(skipped, now)
+    else:
+        seen.setdefault(status, now)
+
+
+def stage_seconds(job: Dict[str, Any], target: str) -> Dict[str, float]:
+    """Return the duration of the stages a job went through.
+
+    Examples:
+        >>> job = {"start": 0.0, "submitted": 0.5, "seen": {"RUNNING": 2.0}}
+        >>> stage_seconds(job, "sfn")
+        {'submit': 0.5, 'running': 1.5}
+    """
+    if job.get("submitted") is None:
+        return {}
+    stages = {"submit": job["submitted"] - job["start"]}
+    previous = job["submitted"]
+    for status in STAGES[target]:
+        if status not in job["seen"]:
+            break
+        stages[status.lower()] = job["seen"][status] - previous
+        previous = job["seen"][status]
+    return stages
+
+
+def final_status(job: Dict[str, Any], target: str) -> str:
+    if job.get("error"):
+        return "SUBMIT_FAILED"
+    for status in [STATUSES[target][-1], *FAILED_STATUSES]:
+        if status in job["seen"]:
+            return status
+    return "UNFINISHED"
+
+
+def distribution(values: List[float]) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {"count": len(values)}
+    for q in QUANTILES:
+        value = benchmark.percentile(values, q)
+        summary[f"p{q}"] = None if value is None else round(value, 3)
+    summary["max"] = round(max(values), 3) if values else None
+    return summary
+
+
+class LoadGenerator:
+    """Submit the jobs of a mix at a target rate and track them.
+
+    Args:
+        backend (Backend): Submission and describe backend.
+        mix (list): Jobs of the mix.
+        rate (float): Submissions per hour.
+        concurrency (int): Maximum concurrent submission requests.
+        poll_interval (float): Seconds between two describe rounds.
+        max_retries (int): Retries of a throttled or failed submission.
+        seed (int): Seed of the draws of the mix.
+    """
+
+    def __init__(
+        self,
+        backend: Backend,
+        mix: List[Dict[str, Any]],
+        rate: float,
+        concurrency: int = 32,
+        poll_interval: float = 5.0,
+        max_retries: int = 8,
+        seed: Optional[int] = None,
+    ):
+        self.backend = backend
+        self.mix = mix
+        self.rate = rate
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_retries = max_retries
+        self.random = random.Random(seed)
+        self.jobs: List[Dict[str, Any]] = []
+        self.describe_errors: Counter = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _submit(self, job: Dict[str, Any]):
+        job["start"] = time.monotonic()
+        job["lag"] = job["start"] - job["scheduled"]
+        for attempt in range(self.max_retries + 1):
+            try:
+                job_id = self.backend.submit(job["item"], job["name"])
+            except SubmitError as e:
+                job["errors"].append(e.code)
+                if not e.retryable or attempt == self.max_retries:
+                    job["error"] = e.code
+                    return
+                # Exponential backoff with full jitter, capped at 20 seconds
+                time.sleep(self.random.uniform(0, min(20, 0.1 * 2**attempt)))
+                continue
+            with self._lock:
+                job.update({"id": job_id, "submitted": time.monotonic()})
+            return
+
+    def _track(self):
+        statuses = STATUSES[self.backend.target]
+        final = [statuses[-1], *FAILED_STATUSES]
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                tracked = {
+                    job["id"]: job
+                    for job in self.jobs
+                    if job.get("id") and not any(s in job["seen"] for s in final)
+                }
+            ids = list(tracked)
+            for i in range(0, len(ids), self.backend.describe_size):
+                try:
+                    response = self.backend.describe(
+                        ids[i : i + self.backend.describe_size]
+                    )
+                except SubmitError as e:
+                    self.describe_errors[e.code] += 1
+                    continue
+                now = time.monotonic()
+                for job_id, status in response.items():
+                    observe(tracked[job_id]["seen"], status, now, statuses)
+
+    def finished(self) -> bool:
+        with self._lock:
+            return all(
+                final_status(job, self.backend.target) != "UNFINISHED"
+                for job in self.jobs
+            )
+
+    def run(self, count: int, drain_timeout: float) -> Dict[str, Any]:
+        """Submit ``count`` jobs, wait for them and return the report."""
+        tracker = threading.Thread(target=self._track, daemon=True)
+        tracker.start()
+        weights = [item.get("weight", 1) for item in self.mix]
+        prefix = f"load-{time.strftime('%Y%m%d-%H%M%S')}"
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for i in range(count):
+                item = self.random.choices(self.mix, weights)[0]
+                job = {
+                    "name": f"{prefix}-{i}",
+                    "item": item,
+                    "label": item.get("name") or item.get("compute", "sfn"),
+                    "scheduled": start + i * 3600 / self.rate,
+                    "errors": [],
+                    "seen": {},
+                }
+                delay = job["scheduled"] - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                with self._lock:
+                    self.jobs.append(job)
+                executor.submit(self._submit, job)
+        submitted = time.monotonic()
+        deadline = submitted + drain_timeout
+        while not self.finished() and time.monotonic() < deadline:
+            time.sleep(min(1, self.poll_interval))
+        self._stop.set()
+        tracker.join()
+        return self.report(submitted - start)
+
+    def report(self, seconds: float) -> Dict[str, Any]:
+        """Return the latency distributions, statuses, errors and retries."""
+        target = self.backend.target
+        stages: Dict[str, List[float]] = {}
+        labels: Dict[str, Counter] = {}
+        for job in self.jobs:
+            for stage, value in stage_seconds(job, target).items():
+                stages.setdefault(stage, []).append(value)
+            labels.setdefault(job["label"], Counter())[final_status(job, target)] += 1
+        errors = Counter(code for job in self.jobs for code in job["errors"])
+        retries = sum(len(job["errors"]) - bool(job.get("error")) for job in self.jobs)
+        return {
+            "target": target,
+            "backend": type(self.backend).__name__,
+            "jobs": len(self.jobs),
+            "target_rate_per_hour": self.rate,
+            "achieved_rate_per_hour": (
+                round(len(self.jobs) / seconds * 3600, 1) if seconds else None
+            ),
+            "schedule_lag_seconds": distribution([j["lag"] for j in self.jobs]),
+            "statuses": dict(Counter(final_status(j, target) for j in self.jobs)),
+            "statuses_by_mix": {label: dict(c) for label, c in labels.items()},
+            "stages": {stage: distribution(v) for stage, v in stages.items()},
+            "errors": {
+                "submit": dict(errors),
+                "submit_failed": dict(
+                    Counter(job["error"] for job in self.jobs if job.get("error"))
+                ),
+                "describe": dict(self.describe_errors),
+            },
+            "retries": {
+                "total": retries,
+                "throttled": sum(errors[code] for code in THROTTLING_CODES),
+                "jobs_retried": sum(
+                    1
+                    for job in self.jobs
+                    if len(job["errors"]) > bool(job.get("error"))
+                ),
+            },
+        }
+
+
+def check_slos(report: Dict[str, Any], slos: List[str]) -> List[str]:
+    """Return the SLOs breached by a report. An SLO is
+    ``<stage>:p<quantile>=<seconds>`` or ``failed=<ratio>`` (share of the
+    jobs not succeeded).
+
+    Examples:
+        >>> report = {
+        ...     "jobs": 10,
+        ...     "statuses": {"SUCCEEDED": 9, "FAILED": 1},
+        ...     "stages": {"starting": {"p95": 700.0}},
+        ... }
+        >>> check_slos(report, ["starting:p95=600", "failed=0.2"])
+        ['starting:p95 700.0 > 600.0']
+    """
+    breaches = []
+    for slo in slos:
+        name, _, threshold = slo.partition("=")
+        if name == "failed":
+            succeeded = report["statuses"].get("SUCCEEDED", 0)
+            value = round(1 - succeeded / report["jobs"], 4) if report["jobs"] else 0
+        else:
+            stage, _, quantile = name.partition(":")
+            value = report["stages"].get(stage, {}).get(quantile)
+            if value is None:
+                breaches.append(f"{name} not measured")
+                continue
+        if value > float(threshold):
+            breaches.append(f"{name} {value} > {float(threshold)}")
+    return breaches
+
+
+def to_markdown(report: Dict[str, Any]) -> str:
+    """Format the stages, statuses and errors of a report."""
+    rows = [{"stage": stage, **values} for stage, values in report["stages"].items()]
+    lines = [
+        f"# Load test: {report['jobs']} jobs, {report['backend']}",
+        "",
+        f"Rate per hour: {report['achieved_rate_per_hour']}"
+        f" (target {report['target_rate_per_hour']})",
+        "",
+        "## Latency per stage (seconds)",
+        "",
+        benchmark.to_markdown(rows),
+        "",
+        "## Statuses",
+        "",
+        benchmark.to_markdown(
+            [{"status": k, "jobs": v} for k, v in report["statuses"].items()]
+        ),
+        "",
+        "## Errors and retries",
+        "",
+        "Retries: {total}, throttled: {throttled}, jobs retried: {jobs_retried}".format(
+            **report["retries"]
+        ),
+        "",
+        benchmark.to_markdown(
+            [
+                {"request": request, "code": code, "count": count}
+                for request, codes in report["errors"].items()
+                for code, count in codes.items()
+            ]
+        ),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def make_backend(
+    backend, target, endpoint, state_machine_arn, vcpus, memory, policy
+) -> Backend:
+    session = boto3.session.Session()
+    if backend == "api":
+        if not endpoint:
+            raise click.ClickException("--endpoint is required with --backend api")
+        return ApiBackend(endpoint, session.region_name, target)
+    if backend == "emulator":
+        if target != "batch":
+            raise click.ClickException("The emulator only runs AWS Batch jobs")
+        if not memory:
+            memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024**2
+        return EmulatorBackend(
+            BatchEmulator(vcpus, memory, policy, runner=sleep_command)
+        )
+    if target == "sfn":
+        if not state_machine_arn:
+            account = session.client("sts").get_caller_identity()["Account"]
+            state_machine_arn = (
+                f"arn:aws:states:{session.region_name}:{account}"
+                f":stateMachine:{STATE_MACHINE_NAME}"
+            )
+        return StepFunctionsBackend(
+            session.client("stepfunctions", config=NO_RETRY), state_machine_arn
+        )
+    return BatchBackend(session.client("batch", config=NO_RETRY))
+
+
+@click.command()
+@click.argument("mix_file", type=click.File())
+@click.option(
+    "--backend",
+    default="emulator",
+    type=click.Choice(["api", "sdk", "emulator"]),
+    help="REST API of the stack, AWS SDK or local emulator",
+)
+@click.option("--target", default="batch", type=click.Choice(list(STATUSES)))
+@click.option("--endpoint", default=None, help="Endpoint of the REST API")
+@click.option("--state-machine-arn", default=None, help="State machine of the SDK")
+@click.option("--rate", default=10000.0, help="Submissions per hour")
+@click.option("--count", default=1000, help="Number of submissions")
+@click.option("--concurrency", default=32, help="Concurrent submission requests")
+@click.option("--poll-interval", default=5.0, help="Seconds between describe rounds")
+@click.option("--max-retries", default=8, help="Retries of a submission")
+@click.option("--drain-timeout", default=3600.0, help="Seconds to wait for the jobs")
+@click.option("--seed", default=None, type=int, help="Seed of the mix draws")
+@click.option("--vcpus", default=os.cpu_count(), help="vCPUs of the emulator")
+@click.option("--memory", default=None, type=int, help="Memory of the emulator, MiB")
+@click.option("--policy", default="first-fit", type=click.Choice(POLICIES))
+@click.option("--slo", "slos", multiple=True, help="e.g. starting:p95=600, failed=0.01")
+@click.option("--report", default=None, help="Prefix of the JSON and Markdown reports")
+def main(
+    mix_file,
+    backend,
+    target,
+    endpoint,
+    state_machine_arn,
+    rate,
+    count,
+    concurrency,
+    poll_interval,
+    max_retries,
+    drain_timeout,
+    seed,
+    vcpus,
+    memory,
+    policy,
+    slos,
+    report,
+):
+    mix = [json.loads(line) for line in mix_file if line.strip()]
+    submitter = make_backend(
+        backend, target, endpoint, state_machine_arn, vcpus, memory, policy
+    )
+    generator = LoadGenerator(
+        submitter,
+        mix,
+        rate,
+        concurrency,
+        poll_interval,
+        max_retries,
+        seed,
+    )
+    try:
+        document = generator.run(count, drain_timeout)
+    finally:
+        if isinstance(submitter, EmulatorBackend):
+            submitter.client.shutdown()
+    document["slo_breaches"] = check_slos(document, slos)
+    click.echo(json.dumps(document, indent=2))
+    if report:
+        with open(f"{report}.json", "w") as f:
+            json.dump(document, f, indent=2)
+        with open(f"{report}.md", "w") as f:
+            f.write(to_markdown(document))
+    for breach in document["slo_breaches"]:
+        click.echo(f"SLO breached: {breach}", err=True)
+    sys.exit(1 if document["slo_breaches"] else 0)
+
+
+if __name__ == "__main__":
+    main()
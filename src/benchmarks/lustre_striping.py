@@ -0,0 +1,151 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Compare the read/write throughput of FSx for Lustre layouts.
+
+Run from an instance mounting the file system, in the ``src`` directory:
+
+    python -m benchmarks.lustre_striping --directory /fsx-lustre/benchmarks
+
+For each layout, a large file is written and read back in 4 MiB blocks,
+then a directory of small segments is written, listed and read. The results
+are printed as JSON.
+"""
+
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Dict, Optional
+
+import click
+
+from shared_libraries import lustre
+
+BLOCK_SIZE = 4 * 1024**2
+
+
+def _drop_cache(path: str):
+    # Drop the client page cache of the file to read it from the servers
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def write_file(path: str, size: int) -> float:
+    """Write ``size`` bytes and return the duration in seconds."""
+    block = os.urandom(BLOCK_SIZE)
+    start = time.perf_counter()
+    with open(path, "wb") as f:
+        for _ in range(size // BLOCK_SIZE):
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    return time.perf_counter() - start
+
+
+def read_file(path: str) -> float:
+    """Read a file and return the duration in seconds."""
+    _drop_cache(path)
+    start = time.perf_counter()
+    with open(path, "rb", buffering=0) as f:
+        while f.read(BLOCK_SIZE):
+            pass
+    return time.perf_counter() - start
+
+
+def mb_per_second(size: int, seconds: float) -> float:
+    """Convert a throughput to MiB per second.
+
+    Examples:
+        >>> mb_per_second(200 * 1024**2, 2)
+        100.0
+    """
+    return round(size / 1024**2 / seconds, 1)
+
+
+def bench_large_file(directory: str, options: Optional[str], size: int) -> Dict:
+    path = os.path.join(directory, f"large-{uuid.uuid4().hex}.bin")
+    if options:
+        lustre.setstripe(path, options)
+    write_seconds = write_file(path, size)
+    read_seconds = read_file(path)
+    layout = lustre.getstripe(path)
+    os.remove(path)
+    return {
+        "size_mib": size // 1024**2,
+        "write_mb_s": mb_per_second(size, write_seconds),
+        "read_mb_s": mb_per_second(size, read_seconds),
+        "stripe_count": layout.count("l_ost_idx"),
+    }
+
+
+def bench_segments(
+    directory: str, options: Optional[str], count: int, size: int
+) -> Dict:
+    path = os.path.join(directory, f"segments-{uuid.uuid4().hex}")
+    os.makedirs(path)
+    if options:
+        lustre.setstripe(path, options)
+    block = os.urandom(size)
+    start = time.perf_counter()
+    for i in range(count):
+        with open(os.path.join(path, f"segment_{i:05d}.ts"), "wb") as f:
+            f.write(block)
+            os.fsync(f.fileno())
+    write_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    files = [entry.path for entry in os.scandir(path) if entry.stat().st_size]
+    stat_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for file in files:
+        _drop_cache(file)
+        with open(file, "rb") as f:
+            f.read()
+    read_seconds = time.perf_counter() - start
+    shutil.rmtree(path)
+    return {
+        "files": count,
+        "size_kib": size // 1024,
+        "write_files_s": round(count / write_seconds, 1),
+        "stat_files_s": round(count / stat_seconds, 1),
+        "read_files_s": round(count / read_seconds, 1),
+        "write_mb_s": mb_per_second(count * size, write_seconds),
+        "read_mb_s": mb_per_second(count * size, read_seconds),
+    }
+
+
+@click.command()
+@click.option("--directory", required=True, help="Directory on the Lustre file system")
+@click.option("--size-mib", default=4096, help="Size of the large file in MiB")
+@click.option("--segments", default=1000, help="Number of segments")
+@click.option("--segment-kib", default=2048, help="Size of a segment in KiB")
+@click.option("--repeat", default=3, help="Runs per layout")
+@click.option(
+    "--striping",
+    default=None,
+    help="JSON layouts, as the LUSTRE_STRIPING environment variable of the jobs",
+)
+def main(directory, size_mib, segments, segment_kib, repeat, striping):
+    striping = json.loads(
+        striping or os.getenv("LUSTRE_STRIPING") or json.dumps(lustre.DEFAULT_STRIPING)
+    )
+    os.makedirs(directory, exist_ok=True)
+    layouts = {"default": None, **striping["layouts"]}
+    results = {"large_file": {}, "segments": {}}
+    for name, options in layouts.items():
+        results["large_file"][name] = [
+            bench_large_file(directory, options, size_mib * 1024**2)
+            for _ in range(repeat)
+        ]
+        results["segments"][name] = [
+            bench_segments(directory, options, segments, segment_kib * 1024)
+            for _ in range(repeat)
+        ]
+    print(json.dumps({"layouts": layouts, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Run the compute-family benchmark matrix.
+
+From the ``src`` directory:
+
+    # Generate the reference assets with lavfi and upload them
+    python -m benchmarks.matrix assets --bucket <bucket>
+    # Start the benchmark state machine on AWS Batch
+    python -m benchmarks.matrix run
+    # Run the matrix with the host ffmpeg on lavfi sources
+    python -m benchmarks.matrix local --duration 10
+
+The matrix is ``benchmarks/matrix.json`` unless ``--matrix`` is set. In
+local mode, the commands run one after the other on the host, the compute
+family is ``local`` and the VMAF is computed when ffmpeg is built with
+libvmaf.
+"""
+
+import json
+import os
+import re
+import shlex
+import subprocess  # nosec B404
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import boto3
+import click
+
+from shared_libraries import benchmark
+
+FFMPEG = os.environ.get("FFMPEG_PATH", "ffmpeg")
+DEFAULT_MATRIX = os.path.join(os.path.dirname(__file__), "matrix.json")
+
+
+def ffmpeg(arguments: List[str]) -> subprocess.CompletedProcess:
+    return subprocess.run(  # nosec B603
+        [FFMPEG, "-y", "-hide_banner", "-nostdin", *arguments],
+        capture_output=True,
+        text=True,
+    )
+
+
+def ffmpeg_version() -> str:
+    """Return the version of the host ffmpeg, e.g. ``7.0.2``."""
+    result = subprocess.run(  # nosec B603
+        [FFMPEG, "-version"], capture_output=True, text=True
+    )
+    return result.stdout.split()[2] if result.returncode == 0 else "unknown"
+
+
+def make_reference(asset: Dict, path: str):
+    """Render a lavfi source in a lossless reference file."""
+    result = ffmpeg(
+        [
+            *["-f", "lavfi", "-i", asset["lavfi"]],
+            *["-t", str(asset["duration"])],
+            *["-c:v", "ffv1", "-pix_fmt", "yuv420p", path],
+        ]
+    )
+    if result.returncode != 0:
+        raise click.ClickException(f"Reference not rendered: {result.stderr}")
+
+
+def vmaf(distorted: str, reference: str) -> Optional[float]:
+    """Return the VMAF of an output, or None without libvmaf."""
+    result = ffmpeg(
+        [
+            *["-i", distorted, "-i", reference],
+            *["-lavfi", "[0:v][1:v]libvmaf", "-f", "null", "-"],
+        ]
+    )
+    match = re.search(r"VMAF score: ([\d.]+)", result.stderr)
+    return float(match.group(1)) if match else None
+
+
+def run_local(item: Dict, reference: str, directory: str, version: str) -> Dict:
+    """Run the command of an item on a reference asset."""
+    output = os.path.join(directory, os.path.basename(item["output_url"]))
+    arguments = []
+    for options in [item["global_options"], item["input_file_options"]]:
+        if options != "null":
+            arguments += shlex.split(options)
+    arguments += ["-i", reference, *shlex.split(item["output_file_options"]), output]
+    start = time.perf_counter()
+    result = ffmpeg(arguments)
+    seconds = time.perf_counter() - start
+    succeeded = result.returncode == 0
+    if not succeeded:
+        click.echo(f"{item['name']} failed: {result.stderr.strip()[-300:]}", err=True)
+    return {
+        **item,
+        "ffmpeg_version": version,
+        "status": "SUCCEEDED" if succeeded else "FAILED",
+        "ffmpeg_seconds": seconds if succeeded else None,
+        "job_seconds": seconds if succeeded else None,
+        "vmaf": vmaf(output, reference) if succeeded else None,
+    }
+
+
+def load_matrix(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+@click.group()
+def main():
+    """Benchmark ffmpeg commands across compute families and versions."""
+
+
+@main.command()
+@click.option("--matrix", "matrix_path", default=DEFAULT_MATRIX, help="Matrix file")
+@click.option("--duration", type=float, help="Seconds of each asset, shorter locally")
+@click.option("--command", "commands", multiple=True, help="Commands to run (all)")
+@click.option("--vcpu-hour", type=float, help="Price of a vCPU hour of the host, USD")
+@click.option("--report", help="Prefix of the JSON, Markdown and CSV reports")
+def local(matrix_path, duration, commands, vcpu_hour, report):
+    """Run the matrix with the host ffmpeg on lavfi sources."""
+    matrix = load_matrix(matrix_path)
+    matrix.update(
+        {
+            "output": "",
+            "computes": ["local"],
+            "ffmpeg_versions": [None],
+            "vcpus": os.cpu_count(),
+            "memory": 0,
+            "commands": {
+                name: {**command, "computes": None}
+                for name, command in matrix["commands"].items()
+                if not commands or name in commands
+            },
+        }
+    )
+    for asset in matrix["assets"].values():
+        asset["duration"] = duration or asset["duration"]
+    version = ffmpeg_version()
+    items = benchmark.expand(matrix, f"local-{time.strftime('%Y%m%d-%H%M%S')}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        references = {}
+        for name, asset in matrix["assets"].items():
+            references[name] = os.path.join(directory, f"{name}.mkv")
+            make_reference(asset, references[name])
+        for item in items:
+            click.echo(f"{item['name']}...", err=True)
+            reference = references[item["asset"]]
+            results.append(run_local(item, reference, directory, version))
+
+    prices = {"local": {"vcpu_hour": vcpu_hour}} if vcpu_hour else {}
+    rows = benchmark.summarize(results, prices)
+    if report:
+        with open(f"{report}.json", "w") as f:
+            json.dump({"matrix": matrix, "summary": rows, "results": results}, f)
+        with open(f"{report}.md", "w") as f:
+            f.write(benchmark.to_markdown(rows) + "\n")
+        with open(f"{report}.csv", "w") as f:
+            f.write(benchmark.to_csv(rows))
+    click.echo(benchmark.to_markdown(rows))
+
+
+@main.command()
+@click.option("--matrix", "matrix_path", default=DEFAULT_MATRIX, help="Matrix file")
+@click.option("--bucket", required=True, help="S3 bucket of the stack")
+def assets(matrix_path, bucket):
+    """Render the reference assets with lavfi and upload them to S3."""
+    s3 = boto3.client("s3")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, asset in load_matrix(matrix_path)["assets"].items():
+            url = asset["url"].replace("%BUCKET%", bucket)
+            path = os.path.join(directory, f"{name}.mkv")
+            make_reference(asset, path)
+            key = url.split("/", 3)[3]
+            s3.upload_file(path, bucket, key)
+            click.echo(f"{name}: {url}")
+
+
+@main.command()
+@click.option("--matrix", "matrix_path", default=DEFAULT_MATRIX, help="Matrix file")
+@click.option("--run-id", default=None, help="Name of the run (timestamp)")
+def run(matrix_path, run_id):
+    """Start the benchmark state machine on AWS Batch."""
+    session = boto3.session.Session()
+    account = session.client("sts").get_caller_identity()["Account"]
+    arn = (
+        f"arn:aws:states:{session.region_name}:{account}"
+        ":stateMachine:batch-ffmpeg-benchmark-state-machine"
+    )
+    response = session.client("stepfunctions").start_execution(
+        stateMachineArn=arn,
+        name=run_id or f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}",
+        input=json.dumps({"matrix": load_matrix(matrix_path)}),
+    )
+    click.echo(response["executionArn"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Measure the S3 transfer functions of ``shared_libraries.aws_s3`` and the
+input cache of ``shared_libraries.input_cache``.
+
+The functions used by the jobs (``download_s3_files``, ``upload_file_to_s3``,
+``sync_dir_to_s3`` and ``InputCache.fetch``, a miss then a hit) run against
+a local S3 stand-in: an in-process moto server
+(``pip install -r benchmarks/requirements.txt``) or any S3 endpoint, e.g.
+MinIO, with ``--endpoint-url``. From the ``src`` directory:
+
+    python -m benchmarks.s3_io --scale 0.01 --save-baseline /tmp/s3_io.json
+    python -m benchmarks.s3_io --scale 0.01 --baseline /tmp/s3_io.json
+
+Each scenario is a synthetic set of files: one large object, many small
+segments, or a mix of both. For each operation, the throughput, the number
+of S3 requests per file and the p50/p99 latency per file are reported as
+JSON. Compared with a baseline, a throughput drop larger than
+``--tolerance`` or more requests per file fail the run. Moto keeps the
+objects in memory: use MinIO for the full scale sets (20 GiB object).
+"""
+
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+# The transfers are measured outside of an X-Ray segment
+os.environ.setdefault("AWS_XRAY_SDK_ENABLED", "false")
+
+import boto3  # noqa: E402
+import click  # noqa: E402
+
+from shared_libraries import aws_s3, benchmark, input_cache  # noqa: E402
+
+BLOCK_SIZE = 4 * 1024**2
+MiB = 1024**2
+
+# Scenario: list of (number of files, size of a file in bytes) at scale 1
+SCENARIOS = {
+    "large-object": [(1, 20 * 1024**3)],
+    "segments": [(10000, 512 * 1024)],
+    "mixed": [(1, 1024**3), (100, 10 * MiB), (1000, 100 * 1024)],
+}
+
+
+def write_files(directory: str, files: List[tuple], scale: float) -> List[str]:
+    """Write the synthetic files of a scenario and return their paths."""
+    block = os.urandom(BLOCK_SIZE)
+    paths = []
+    for group, (count, size) in enumerate(files):
+        size = max(1, int(size * scale))
+        for i in range(max(1, round(count * scale))):
+            path = os.path.join(directory, f"group{group}", f"file_{i:05d}.bin")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                for offset in range(0, size, BLOCK_SIZE):
+                    f.write(block[: min(BLOCK_SIZE, size - offset)])
+            paths.append(path)
+    return paths
+
+
+class RequestCounter:
+    """Count the HTTP requests sent by a boto3 client."""
+
+    def __init__(self, client):
+        self.count = 0
+        client.meta.events.register("before-send.s3", self._count)
+
+    def _count(self, **kwargs):
+        self.count += 1
+
+
+def measure(
+    name: str,
+    run: Callable[[], None],
+    counter: RequestCounter,
+    files: int,
+    size: int,
+    latencies: List[float],
+) -> Dict:
+    """Run an operation and return its throughput, requests and latency."""
+    requests = counter.count
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    requests = counter.count - requests
+    result = {
+        "files": files,
+        "bytes": size,
+        "seconds": round(seconds, 3),
+        "mb_s": round(size / MiB / seconds, 2),
+        "requests": requests,
+        "requests_per_file": round(requests / files, 2),
+        "p50_ms": round(benchmark.percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(benchmark.percentile(latencies, 99) * 1000, 1),
+    }
+    click.echo(f"{name}: {result}", err=True)
+    return result
+
+
+def timed(function: Callable, latencies: List[float]) -> Callable:
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    return wrapper
+
+
+def bench_scenario(s3, bucket: str, paths: List[str], directory: str) -> Dict:
+    """Upload, upload again (objects found, skipped) and download a set."""
+    counter = RequestCounter(s3)
+    size = sum(os.path.getsize(path) for path in paths)
+    prefix = f"benchmark/{os.path.basename(directory)}"
+    results = {}
+    upload_file_to_s3 = aws_s3.upload_file_to_s3
+    try:
+        for name in ["sync_dir_to_s3", "sync_dir_to_s3_existing"]:
+            latencies: List[float] = []
+            # sync_dir_to_s3 calls upload_file_to_s3 for each file
+            aws_s3.upload_file_to_s3 = timed(upload_file_to_s3, latencies)
+            results[name] = measure(
+                name,
+                lambda: aws_s3.sync_dir_to_s3(s3, directory, bucket, prefix),
+                counter,
+                len(paths),
+                size,
+                latencies,
+            )
+    finally:
+        aws_s3.upload_file_to_s3 = upload_file_to_s3
+
+    latencies = []
+    urls = [
+        f"s3://{bucket}/{prefix}/{os.path.relpath(path, directory)}" for path in paths
+    ]
+    with tempfile.TemporaryDirectory() as destination:
+        download = timed(aws_s3.download_s3_files, latencies)
+        results["download_s3_files"] = measure(
+            "download_s3_files",
+            lambda: [download(s3, [url], destination) for url in urls],
+            counter,
+            len(paths),
+            size,
+            latencies,
+        )
+
+    # Input cache: a first fetch downloads the files, a second one reads them
+    # from the cache
+    with tempfile.TemporaryDirectory() as root:
+        cache = input_cache.InputCache(root, 2 * size)
+        for name in ["input_cache_miss", "input_cache_hit"]:
+            latencies = []
+            fetch = timed(cache.fetch, latencies)
+            results[name] = measure(
+                name,
+                lambda: [fetch(s3, url) for url in urls],
+                counter,
+                len(paths),
+                size,
+                latencies,
+            )
+        stats = cache.close()["job"]
+        if stats["misses"] != len(paths) or stats["hits"] != len(paths):
+            raise click.ClickException(f"Unexpected input cache statistics {stats}")
+
+    latencies = []
+    key = f"{prefix}-single/{os.path.basename(paths[0])}"
+    upload = timed(aws_s3.upload_file_to_s3, latencies)
+    results["upload_file_to_s3"] = measure(
+        "upload_file_to_s3",
+        lambda: upload(s3, paths[0], bucket, key),
+        counter,
+        1,
+        os.path.getsize(paths[0]),
+        latencies,
+    )
+    delete_prefix(s3, bucket, prefix)
+    return results
+
+
+def delete_prefix(s3, bucket: str, prefix: str):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects = [{"Key": item["Key"]} for item in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+
+
+def start_moto() -> str:
+    """Start an in-process moto server and return its endpoint."""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise click.ClickException(
+            "moto is not installed (pip install -r benchmarks/requirements.txt), "
+            "set --endpoint-url to use another S3 endpoint"
+        )
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False).start()
+    for key in ["AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
+        os.environ.setdefault(key, "testing")
+    return f"http://127.0.0.1:{port}"
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return the regressions of the results against a baseline.
+
+    Examples:
+        >>> base = {"segments": {"download_s3_files": {"mb_s": 100.0, "requests_per_file": 2}}}
+        >>> new = {"segments": {"download_s3_files": {"mb_s": 70.0, "requests_per_file": 3}}}
+        >>> compare(new, base, 0.2)
+        ['segments/download_s3_files: 70.0 MiB/s < 100.0', 'segments/download_s3_files: 3 requests/file > 2']
+    """
+    regressions = []
+    for scenario, operations in results.items():
+        for operation, result in operations.items():
+            reference = baseline.get(scenario, {}).get(operation)
+            if not reference:
+                continue
+            name = f"{scenario}/{operation}"
+            if result["mb_s"] < reference["mb_s"] * (1 - tolerance):
+                regressions.append(
+                    f"{name}: {result['mb_s']} MiB/s < {reference['mb_s']}"
+                )
+            if result["requests_per_file"] > reference["requests_per_file"]:
+                regressions.append(
+                    f"{name}: {result['requests_per_file']} requests/file"
+                    f" > {reference['requests_per_file']}"
+                )
+    return regressions
+
+
+@click.command()
+@click.option("--endpoint-url", default=None, help="S3 endpoint (in-process moto)")
+@click.option("--bucket", default="batch-ffmpeg-benchmark", help="Bucket, created")
+@click.option(
+    "--scenario",
+    "scenarios",
+    multiple=True,
+    type=click.Choice(list(SCENARIOS)),
+    help="Scenarios to run (all)",
+)
+@click.option("--scale", default=1.0, help="Factor of the sizes and numbers of files")
+@click.option("--directory", default=None, help="Directory of the synthetic files")
+@click.option("--save-baseline", default=None, help="Save the results as baseline")
+@click.option("--baseline", default=None, help="Compare the results to a baseline")
+@click.option("--tolerance", default=0.2, help="Tolerated throughput drop")
+def main(
+    endpoint_url,
+    bucket,
+    scenarios,
+    scale,
+    directory,
+    save_baseline,
+    baseline,
+    tolerance,
+):
+    endpoint_url = endpoint_url or start_moto()
+    s3 = boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        region_name=os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+    )
+    try:
+        s3.create_bucket(Bucket=bucket)
+    except s3.exceptions.BucketAlreadyOwnedByYou:
+        pass
+
+    results = {}
+    for scenario in scenarios or SCENARIOS:
+        workdir = tempfile.mkdtemp(prefix=f"{scenario}-", dir=directory)
+        try:
+            paths = write_files(workdir, SCENARIOS[scenario], scale)
+            results[scenario] = bench_scenario(s3, bucket, paths, workdir)
+        finally:
+            shutil.rmtree(workdir)
+
+    document = {"endpoint": endpoint_url, "scale": scale, "results": results}
+    click.echo(json.dumps(document, indent=2))
+    if save_baseline:
+        with open(save_baseline, "w") as f:
+            json.dump(document, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            reference = json.load(f)
+        if reference["scale"] != scale:
+            raise click.ClickException(
+                f"Baseline measured at scale {reference['scale']}"
+            )
+        regressions = compare(results, reference["results"], tolerance)
+        for regression in regressions:
+            click.echo(f"Regression {regression}", err=True)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Admission control of the job submissions of the state machine.
+
+This Lambda function is invoked by the maps of the AWS Step Functions state
+machine `batch-ffmpeg-state-machine` before each job submission:
+
+1. Reads the RUNNABLE depth of the job queue of the item, cached in the
+   DynamoDB table `batch-ffmpeg-admission` for `DEPTH_TTL_SECONDS`. One
+   invocation at a time refreshes it with `ListJobs`; the jobs admitted
+   since the last read are added to it.
+2. Rejects the item while its jobs (one, or the `size` of an array job) do
+   not fit in `MAX_RUNNABLE`, with an exponential backoff.
+3. Takes a token of the account-wide token bucket of the AWS Batch API
+   (`SUBMIT_RATE` per second, `BURST`), reserved ahead of time when the
+   bucket is empty: the item then waits for its token and is admitted on
+   its next invocation.
+4. Publishes the admissions, reservations, rejections, wait time and queue
+   depth as CloudWatch metrics (embedded metric format, namespace `BatchFFmpeg`).
+
+The state machine waits `wait_seconds` and invokes the function again with
+the previous result (`admission`) until the item is admitted.
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from shared_libraries import admission
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+TABLE_NAME: str = os.environ.get("TABLE_NAME", "batch-ffmpeg-admission")
+SUBMIT_RATE: float = float(
+    os.environ.get("SUBMIT_RATE", str(admission.DEFAULT_SUBMIT_RATE))
+)
+BURST: float = float(os.environ.get("BURST", str(admission.DEFAULT_BURST)))
+MAX_RUNNABLE: int = int(
+    os.environ.get("MAX_RUNNABLE", str(admission.DEFAULT_MAX_RUNNABLE))
+)
+DEPTH_TTL_SECONDS: float = float(
+    os.environ.get("DEPTH_TTL_SECONDS", str(admission.DEFAULT_DEPTH_TTL_SECONDS))
+)
+MAX_WAIT_SECONDS: float = float(
+    os.environ.get("MAX_WAIT_SECONDS", str(admission.DEFAULT_MAX_WAIT_SECONDS))
+)
+QUEUE_PREFIX: str = "batch-ffmpeg-job-queue-"
+BUCKET_ID: str = "batch-api"
+METRICS_NAMESPACE: str = "BatchFFmpeg"
+# Contended updates of the token bucket before backing off
+MAX_CONFLICTS: int = 5
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+dynamodb: Any = boto3.client("dynamodb")
+batch: Any = boto3.client("batch")
+
+
+def get_item(item_id: str) -> Dict[str, Any]:
+    """Return the numeric attributes of an item of the table."""
+    response = dynamodb.get_item(
+        TableName=TABLE_NAME, Key={"id": {"S": item_id}}, ConsistentRead=True
+    )
+    return {
+        key: float(value["N"])
+        for key, value in response.get("Item", {}).items()
+        if "N" in value
+    }
+
+
+def count_runnable(queue: str) -> int:
+    """Count the RUNNABLE jobs of a queue, up to MAX_RUNNABLE + 1."""
+    count, kwargs = 0, {}
+    while count <= MAX_RUNNABLE:
+        response = batch.list_jobs(
+            jobQueue=queue,
+            jobStatus="RUNNABLE",
+            maxResults=min(1000, MAX_RUNNABLE + 1 - count),
+            **kwargs,
+        )
+        count += len(response["jobSummaryList"])
+        if not response.get("nextToken"):
+            break
+        kwargs["nextToken"] = response["nextToken"]
+    return count
+
+
+def runnable_depth(queue: str, now: float) -> int:
+    """Return the RUNNABLE depth of a queue plus the jobs admitted since it
+    was read."""
+    item = get_item(queue)
+    cached = int(item.get("depth", 0) + item.get("admitted", 0))
+    if item and now - item.get("checked_at", 0) < DEPTH_TTL_SECONDS:
+        return cached
+    # Lease of the refresh, the other invocations use the cached depth
+    try:
+        dynamodb.update_item(
+            TableName=TABLE_NAME,
+            Key={"id": {"S": queue}},
+            UpdateExpression="SET refreshing_at = :now",
+            ConditionExpression="attribute_not_exists(refreshing_at) OR refreshing_at < :lease",
+            ExpressionAttributeValues={
+                ":now": {"N": str(now)},
+                ":lease": {"N": str(now - DEPTH_TTL_SECONDS)},
+            },
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        return cached
+    depth = count_runnable(queue)
+    dynamodb.put_item(
+        TableName=TABLE_NAME,
+        Item={
+            "id": {"S": queue},
+            "depth": {"N": str(depth)},
+            "admitted": {"N": "0"},
+            "checked_at": {"N": str(now)},
+        },
+    )
+    return depth
+
+
+def record_admission(queue: str, jobs: int):
+    """Add the jobs of an admitted item to the depth of its queue."""
+    dynamodb.update_item(
+        TableName=TABLE_NAME,
+        Key={"id": {"S": queue}},
+        UpdateExpression="ADD admitted :jobs",
+        ExpressionAttributeValues={":jobs": {"N": str(jobs)}},
+    )
+
+
+def take_token() -> Optional[float]:
+    """Take a token of the AWS Batch API bucket and return the wait before
+    it is available, or None if the bucket is too far behind or too
+    contended."""
+    for _ in range(MAX_CONFLICTS):
+        now = time.time()
+        item = get_item(BUCKET_ID)
+        tokens = admission.refill(
+            item.get("tokens", BURST),
+            item.get("updated_at", now),
+            now,
+            SUBMIT_RATE,
+            BURST,
+        )
+        left, wait = admission.reserve(tokens, SUBMIT_RATE, MAX_WAIT_SECONDS)
+        if wait is None:
+            return None
+        condition = "attribute_not_exists(updated_at)"
+        values = {":tokens": {"N": str(left)}, ":now": {"N": str(now)}}
+        if "updated_at" in item:
+            condition = "updated_at = :previous"
+            values[":previous"] = {"N": str(item["updated_at"])}
+        try:
+            dynamodb.update_item(
+                TableName=TABLE_NAME,
+                Key={"id": {"S": BUCKET_ID}},
+                UpdateExpression="SET tokens = :tokens, updated_at = :now",
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values,
+            )
+            return wait
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    return None
+
+
+def put_metrics(queue: str, result: Dict[str, Any], depth: Optional[int]):
+    """Print the metrics of an admission in CloudWatch embedded metric
+    format."""
+    metrics = {
+        "Admitted": (int(result["admitted"]), "Count"),
+        "Reserved": (int(result["reason"] == "reserved"), "Count"),
+        "Rejected": (int(result["reason"] in ["depth", "rate"]), "Count"),
+    }
+    if result["admitted"]:
+        metrics["AdmissionWaitSeconds"] = (result["waited_seconds"], "Seconds")
+        metrics["AdmissionAttempts"] = (result["attempts"], "Count")
+    if depth is not None:
+        metrics["RunnableDepth"] = (depth, "Count")
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Queue"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": unit}
+                        for name, (_, unit) in metrics.items()
+                    ],
+                }
+            ],
+        },
+        "Queue": queue,
+        "Reason": result["reason"],
+        **{name: value for name, (value, _) in metrics.items()},
+    }
+    print(json.dumps(document))
+
+
+def handler(event, context):
+    """Admit an item of the state machine or return its wait.
+
+    The event is the item, with its `compute`, the `size` of an array job,
+    and the result of the previous invocation (`admission`).
+    """
+    now = time.time()
+    previous = event.get("admission") or {}
+    since = previous.get("since", now)
+    attempts = previous.get("attempts", 0) + 1
+    queue = f"{QUEUE_PREFIX}{event['compute']}"
+    jobs = max(1, int(event.get("size") or 1))
+    depth = None
+    wait = 0
+
+    if previous.get("reason") == "reserved":
+        # The token was reserved by the previous invocation
+        reason = "admitted"
+    else:
+        depth = runnable_depth(queue, now)
+        if not admission.check_depth(depth, jobs, MAX_RUNNABLE):
+            reason = "depth"
+            wait = admission.backoff_seconds(
+                DEPTH_TTL_SECONDS, MAX_WAIT_SECONDS, attempts
+            )
+        else:
+            token_wait = take_token()
+            if token_wait is None:
+                reason = "rate"
+                wait = admission.backoff_seconds(
+                    MAX_WAIT_SECONDS / 2, MAX_WAIT_SECONDS, attempts
+                )
+            elif token_wait > 0:
+                reason = "reserved"
+                wait = math.ceil(token_wait)
+            else:
+                reason = "admitted"
+            if reason in ["admitted", "reserved"]:
+                record_admission(queue, jobs)
+
+    result = {
+        "admitted": reason == "admitted",
+        "reason": reason,
+        "wait_seconds": wait,
+        "since": since,
+        "attempts": attempts,
+        "waited_seconds": round(now - since, 3),
+    }
+    logger.info(f"{queue} - {jobs} jobs - depth {depth} - {result}")
+    put_metrics(queue, result, depth)
+    return result
@@ -0,0 +1,259 @@
+"""Compute-family benchmark matrix orchestration.
+
+This Lambda function is invoked by the AWS Step Functions state machine
+`batch-ffmpeg-benchmark-state-machine`:
+
+1. `expand`: expands the matrix of the execution input in one item per job
+   (`benchmarks/runs/<run_id>/items.json`), read by the distributed map.
+   For each ffmpeg version other than the one of the job definition, the
+   job definition of the compute family is cloned with the container image
+   of this version, because `SubmitJob` cannot override the image.
+2. `aggregate`: once the jobs are done, joins the X-Ray segments of the jobs
+   (annotation `BENCHMARK_RUN_ID`) with their quality metrics
+   (`metrics/ffqm/`), and writes the report of the run in JSON, Markdown and
+   CSV (`benchmarks/runs/<run_id>/report.*`).
+
+X-Ray indexes the traces a few minutes after the end of the jobs. While
+traces are missing, `aggregate` raises `TracesNotIndexed`, retried by the
+state machine, unless `partial` is set.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+from shared_libraries import benchmark
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+S3_BUCKET: str = os.environ.get("S3_BUCKET", "")
+RUNS_PREFIX: str = "benchmarks/runs/"
+XRAY_WINDOW: timedelta = timedelta(hours=6)
+JOB_DEFINITION_KEYS: List[str] = [
+    "type",
+    "parameters",
+    "schedulingPriority",
+    "containerProperties",
+    "retryStrategy",
+    "propagateTags",
+    "timeout",
+    "tags",
+    "platformCapabilities",
+]
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+s3: Any = boto3.client("s3")
+batch: Any = boto3.client("batch")
+xray: Any = boto3.client("xray")
+
+
+class TracesNotIndexed(Exception):
+    """X-Ray segments are still missing for some jobs of the run."""
+
+
+def put_json(key: str, document: Any):
+    s3.put_object(Bucket=S3_BUCKET, Key=key, Body=json.dumps(document, default=str))
+
+
+def get_json(key: str) -> Optional[Any]:
+    try:
+        return json.loads(s3.get_object(Bucket=S3_BUCKET, Key=key)["Body"].read())
+    except ClientError as e:
+        logger.info(f"{key} not found - {e}")
+        return None
+
+
+def register_version(compute: str, ffmpeg_version: str) -> str:
+    """Return the job definition running `ffmpeg_version` on a compute
+    family, registered from the job definition of the family if needed."""
+    base_name = benchmark.job_definition_name(compute)
+    response = batch.describe_job_definitions(
+        jobDefinitionName=base_name, status="ACTIVE"
+    )
+    base = max(response["jobDefinitions"], key=lambda d: d["revision"])
+    image = base["containerProperties"]["image"]
+    if benchmark.image_version(image) == ffmpeg_version:
+        return base_name
+
+    name = benchmark.job_definition_name(compute, ffmpeg_version)
+    definition = {k: base[k] for k in JOB_DEFINITION_KEYS if k in base}
+    definition["containerProperties"]["image"] = benchmark.image_for_version(
+        image, ffmpeg_version
+    )
+    definition["containerProperties"]["environment"] = [
+        variable
+        for variable in definition["containerProperties"].get("environment", [])
+        if variable["name"] != "FFMPEG_VERSION"
+    ] + [{"name": "FFMPEG_VERSION", "value": ffmpeg_version}]
+    batch.register_job_definition(jobDefinitionName=name, **definition)
+    logger.info(
+        f"Job definition {name} registered ({compute}, ffmpeg {ffmpeg_version})"
+    )
+    return name
+
+
+def expand(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Expand the matrix and save the items of the distributed map."""
+    run_id = benchmark.slug(event["run_id"])
+    matrix = json.loads(json.dumps(event["matrix"]).replace("%BUCKET%", S3_BUCKET))
+    items = benchmark.expand(matrix, run_id)
+
+    definitions = {}
+    for item in items:
+        if item["ffmpeg_version"]:
+            key = (item["compute"], item["ffmpeg_version"])
+            if key not in definitions:
+                definitions[key] = register_version(*key)
+            item["job_definition"] = definitions[key]
+
+    prefix = f"{RUNS_PREFIX}{run_id}/"
+    put_json(f"{prefix}matrix.json", {**matrix, "created": time.time()})
+    put_json(f"{prefix}items.json", items)
+    logger.info(f"Benchmark {run_id}: {len(items)} jobs")
+    return {
+        "run_id": run_id,
+        "bucket": S3_BUCKET,
+        "items_key": f"{prefix}items.json",
+        "jobs": len(items),
+    }
+
+
+def get_job_segments(run_id: str, start: datetime) -> Dict[str, Dict[str, Any]]:
+    """Return the last `batch-ffmpeg-job` segment of each job of the run,
+    by job name."""
+    trace_ids: List[str] = []
+    paginator: Any = xray.get_paginator("get_trace_summaries")
+    end = datetime.now(tz=timezone.utc)
+    while start < end:
+        for page in paginator.paginate(
+            StartTime=start,
+            EndTime=min(start + XRAY_WINDOW, end),
+            TimeRangeType="Event",
+            Sampling=False,
+            FilterExpression=f'annotation.BENCHMARK_RUN_ID = "{run_id}"',
+        ):
+            trace_ids.extend(summary["Id"] for summary in page["TraceSummaries"])
+        start += XRAY_WINDOW
+
+    segments: Dict[str, Dict[str, Any]] = {}
+    trace_ids = sorted(set(trace_ids))
+    for i in range(0, len(trace_ids), 5):
+        response = xray.batch_get_traces(TraceIds=trace_ids[i : i + 5])
+        for trace in response["Traces"]:
+            for segment in trace["Segments"]:
+                document = json.loads(segment["Document"])
+                if document.get("name") != "batch-ffmpeg-job":
+                    continue
+                name = document.get("annotations", {}).get("name")
+                previous = segments.get(name, {})
+                if document.get("end_time", 0) >= previous.get("end_time", 0):
+                    segments[name] = document
+    return segments
+
+
+def get_quality_metrics(annotations: Dict[str, Any], times: List[float]) -> Dict:
+    """Return the quality metrics saved by a job, partitioned by day."""
+    for timestamp in times:
+        day = time.strftime("year=%Y/month=%b/day=%d", time.gmtime(timestamp))
+        key = (
+            f"metrics/ffqm/{day}/{annotations['AWS_BATCH_JQ_NAME']}_"
+            f"{annotations['AWS_BATCH_CE_NAME']}_{annotations['AWS_BATCH_JOB_ID']}.json"
+        )
+        document = get_json(key)
+        if document is not None:
+            return document
+    return {}
+
+
+def job_result(item: Dict[str, Any], segment: Optional[Dict[str, Any]]) -> Dict:
+    """Join an item with the timings of its X-Ray segment and its VMAF."""
+    result = {
+        **item,
+        "status": "MISSING",
+        "job_id": None,
+        "ffmpeg_seconds": None,
+        "job_seconds": None,
+        "vmaf": None,
+    }
+    if not segment:
+        return result
+    annotations = segment.get("annotations", {})
+    execution = [
+        s for s in segment.get("subsegments", []) if s["name"] == "cmd-execution"
+    ]
+    failed = segment.get("fault") or segment.get("error") or not execution
+    result.update(
+        {
+            "status": "FAILED" if failed else "SUCCEEDED",
+            "job_id": annotations.get("AWS_BATCH_JOB_ID"),
+            "job_seconds": segment["end_time"] - segment["start_time"],
+        }
+    )
+    if execution:
+        result["ffmpeg_seconds"] = execution[0]["end_time"] - execution[0]["start_time"]
+    if not failed:
+        metrics = get_quality_metrics(
+            annotations, [segment["end_time"], segment["start_time"]]
+        )
+        result["vmaf"] = benchmark.vmaf_score(metrics)
+    return result
+
+
+def aggregate(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregate the results of the jobs in the report of the run."""
+    run_id = event["run_id"]
+    prefix = f"{RUNS_PREFIX}{run_id}/"
+    matrix = get_json(f"{prefix}matrix.json")
+    items = get_json(f"{prefix}items.json")
+    if matrix is None or items is None:
+        raise ValueError(f"Benchmark run {run_id} not found")
+
+    start = datetime.fromtimestamp(matrix["created"], tz=timezone.utc)
+    segments = get_job_segments(run_id, start)
+    results = [job_result(item, segments.get(item["name"])) for item in items]
+    missing = [r["name"] for r in results if r["status"] == "MISSING"]
+    if missing and not event.get("partial"):
+        raise TracesNotIndexed(f"{len(missing)}/{len(results)} jobs without traces")
+
+    rows = benchmark.summarize(results, matrix.get("prices", {}))
+    put_json(
+        f"{prefix}report.json",
+        {"run_id": run_id, "matrix": matrix, "summary": rows, "results": results},
+    )
+    s3.put_object(
+        Bucket=S3_BUCKET,
+        Key=f"{prefix}report.md",
+        Body=f"# Benchmark {run_id}\n\n{benchmark.to_markdown(rows)}\n",
+    )
+    s3.put_object(
+        Bucket=S3_BUCKET, Key=f"{prefix}report.csv", Body=benchmark.to_csv(rows)
+    )
+    logger.info(
+        f"Benchmark {run_id}: {len(rows)} configurations, {len(missing)} missing"
+    )
+    return {
+        "run_id": run_id,
+        "report": f"s3://{S3_BUCKET}/{prefix}report.md",
+        "configurations": len(rows),
+        "missing": len(missing),
+    }
+
+
+def handler(event, context):
+    """Expand a benchmark matrix or aggregate its results."""
+    if event["action"] == "expand":
+        return expand(event)
+    if event["action"] == "aggregate":
+        return aggregate(event)
+    raise ValueError(f"Unknown action {event['action']}")
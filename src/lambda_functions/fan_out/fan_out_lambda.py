@@ -0,0 +1,462 @@
+"""Item source and fan-out of the state machine.
+
+This Lambda function is invoked by the AWS Step Functions state machine
+`batch-ffmpeg-state-machine` at the start of each execution, except for the
+`map` mode on a prefix without filters, listed by the distributed map
+itself (`s3:listObjectsV2` item reader):
+
+1. Reads the objects of the execution: the objects under `input.s3_prefix`,
+   or the objects of `input.manifest_url`, a CSV or JSON manifest or the
+   `manifest.json` of an S3 Inventory report (`input.manifest_format` to
+   override the format guessed from the url). The objects are filtered up
+   front with the `input.include` and `input.exclude` key globs and the
+   `input.min_size` and `input.max_size` bounds in bytes (see
+   `shared_libraries.item_source`).
+2. `map` (default): builds one item per object, with the parameters of its
+   job (`name`, `compute`, `input_url`, `input_file_options`,
+   `global_options`, `output_url`, `output_file_options`), and writes the
+   items as a JSON list under
+   `batch-ffmpeg-state-machine/manifests/<execution>/`, read by the
+   distributed map with one job per item.
+3. `array`: splits the items in arrays of at most 10,000 children
+   (`array_size` in the input to lower it) and writes the manifest of each
+   array. Each manifest is submitted as one AWS Batch array job: the
+   children resolve their item with `AWS_BATCH_JOB_ARRAY_INDEX`.
+4. `pack`: packs the items by estimated duration in multi-command jobs
+   (`commands_url`) of about `pack.target_seconds` (300) each, and writes
+   the commands of each job and the list of jobs read by the distributed
+   map. At most 100,000 objects are packed per execution. The duration of an item is the average duration of the jobs of the
+   sizing profile `pack.profile` when known (`metrics/sizing/profiles.json`),
+   otherwise estimated from its size (`pack.bytes_per_second`). With
+   `pack.gpus`, each packed job reserves this number of GPUs, to spread
+   its commands over the GPUs of an instance.
+5. `redrive`: instead of reading objects, reads the results of a previous
+   map run (`input.redrive_url`, the `manifest.json` of its `ResultWriter`
+   or the ARN of the execution) and writes the items of the failed, timed
+   out or aborted child executions (`input.redrive_statuses`) as in the
+   `map` mode, with their original parameters, on `compute` if given. The
+   failed packed jobs are expanded in one item per command, and the failed
+   array jobs in one item per failed child (see
+   `shared_libraries.redrive`).
+
+The maps of the `map`, `array` and `pack` modes tolerate up to
+`tolerated_failure_percentage` (0 by default) failed items.
+"""
+
+import codecs
+import gzip
+import itertools
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+from urllib.parse import urlparse
+
+import boto3
+from botocore.exceptions import ClientError
+
+from shared_libraries import array_manifest
+from shared_libraries import item_source
+from shared_libraries import packing
+from shared_libraries import redrive
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+S3_BUCKET: str = os.environ.get("S3_BUCKET", "")
+JOB_DEF_CPU: int = int(os.environ.get("JOB_DEF_CPU", "2"))
+MANIFESTS_PREFIX: str = "batch-ffmpeg-state-machine/manifests/"
+PROFILES_KEY: str = "metrics/sizing/profiles.json"
+# Concurrent HEAD requests for the size filters of the manifests without size
+HEAD_WORKERS: int = 32
+HEAD_BATCH_SIZE: int = 1000
+# Objects of the packed jobs, packed in memory
+MAX_PACK_ITEMS: int = 100000
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+s3: Any = boto3.client("s3")
+states: Any = boto3.client("stepfunctions")
+batch: Any = boto3.client("batch")
+
+
+def list_objects(bucket: str, prefix: str) -> Iterator[Dict[str, Any]]:
+    """Return the objects under a prefix."""
+    paginator: Any = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get("Contents", []):
+            yield {"bucket": bucket, "key": item["Key"], "size": item["Size"]}
+
+
+def read_lines(url: str) -> Iterator[str]:
+    """Return the lines of an S3 object, decompressed if gzipped."""
+    parsed = urlparse(url)
+    body = s3.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))["Body"]
+    if parsed.path.endswith(".gz"):
+        yield from codecs.getreader("utf-8")(gzip.GzipFile(fileobj=body))
+    else:
+        for line in body.iter_lines():
+            yield line.decode("utf-8")
+
+
+def read_manifest(request: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Return the objects of the manifest or S3 Inventory report of the
+    input."""
+    source = request["input"]
+    url = source["manifest_url"]
+    manifest_format = item_source.manifest_format(url, source.get("manifest_format"))
+    logger.info(f"Reading the {manifest_format} manifest {url}")
+    if manifest_format == "csv":
+        yield from item_source.parse_csv(read_lines(url), source["s3_bucket"])
+    elif manifest_format == "json":
+        document = json.loads("".join(read_lines(url)))
+        yield from item_source.parse_json(document, source["s3_bucket"])
+    else:
+        manifest = json.loads("".join(read_lines(url)))
+        columns = item_source.inventory_columns(manifest)
+        destination = urlparse(url).netloc
+        for data_file in manifest["files"]:
+            yield from item_source.parse_inventory(
+                read_lines(f"s3://{destination}/{data_file['key']}"), columns
+            )
+
+
+def head_size(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Return an object with its size read with a HEAD request."""
+    try:
+        head = s3.head_object(Bucket=item["bucket"], Key=item["key"])
+        return {**item, "size": head["ContentLength"]}
+    except ClientError as e:
+        logger.warning(f"s3://{item['bucket']}/{item['key']} skipped - {e}")
+        return {**item, "size": -1}
+
+
+def fill_sizes(objects: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Read the missing sizes of the objects, in batches of concurrent HEAD
+    requests."""
+    with ThreadPoolExecutor(max_workers=HEAD_WORKERS) as executor:
+        batch: List[Dict[str, Any]] = []
+        for item in objects:
+            batch.append(item)
+            if len(batch) >= HEAD_BATCH_SIZE:
+                yield from fill_batch(executor, batch)
+                batch = []
+        yield from fill_batch(executor, batch)
+
+
+def fill_batch(
+    executor: ThreadPoolExecutor, batch: List[Dict[str, Any]]
+) -> Iterator[Dict[str, Any]]:
+    """Read the missing sizes of a batch of objects."""
+    missing = [item for item in batch if item["size"] is None]
+    sizes = dict(zip(map(id, missing), executor.map(head_size, missing)))
+    for item in batch:
+        item = sizes.get(id(item), item)
+        # Objects not found are skipped
+        if item["size"] != -1:
+            yield item
+
+
+def count_objects(
+    objects: Iterator[Dict[str, Any]], stats: Dict[str, int]
+) -> Iterator[Dict[str, Any]]:
+    """Count the objects of the input in stats."""
+    for item in objects:
+        stats["objects"] += 1
+        yield item
+
+
+def select_objects(
+    request: Dict[str, Any], stats: Dict[str, int]
+) -> Iterator[Dict[str, Any]]:
+    """Return the objects of the input which pass its filters, and count
+    them in stats.
+
+    The key globs are evaluated first, so that the missing sizes of the
+    size filters and of the packed jobs are only read for the objects
+    selected by their key.
+    """
+    source = request["input"]
+    if source.get("manifest_url"):
+        objects = read_manifest(request)
+    else:
+        objects = list_objects(source["s3_bucket"], source.get("s3_prefix", ""))
+    filters = {
+        key: source.get(key) for key in ["include", "exclude", "min_size", "max_size"]
+    }
+    selected = (
+        item
+        for item in count_objects(objects, stats)
+        if item_source.matches(item["key"], None, filters)
+    )
+    if item_source.has_size_filter(filters) or request.get("fan_out") == "pack":
+        selected = fill_sizes(selected)
+    for item in selected:
+        if item_source.matches(item["key"], item["size"], filters):
+            stats["selected"] += 1
+            yield item
+
+
+def build_item(request: Dict[str, Any], bucket: str, key: str) -> Dict[str, str]:
+    """Return the parameters of the job of an object, as the `ItemSelector`
+    of the map mode."""
+    output = request["output"]
+    return {
+        "name": request["name"],
+        "compute": request["compute"],
+        "input_url": f"s3://{bucket}/{key}",
+        "input_file_options": request["input"].get("file_options", "null"),
+        "global_options": request.get("global", {}).get("options", "null"),
+        "output_url": (
+            f"s3://{output['s3_bucket']}/{output.get('s3_prefix', '')}{key}"
+            f"{output.get('s3_suffix', '')}"
+        ),
+        "output_file_options": output.get("file_options", "null"),
+    }
+
+
+def load_profile(name: str) -> Dict[str, Any]:
+    """Return the resource usage history of a sizing profile."""
+    try:
+        response = s3.get_object(Bucket=S3_BUCKET, Key=PROFILES_KEY)
+        return json.loads(response["Body"].read()).get(name, {})
+    except ClientError as e:
+        logger.info(f"No sizing profiles found ({PROFILES_KEY}) - {e}")
+        return {}
+
+
+def write_arrays(
+    request: Dict[str, Any], items: Iterator[Dict[str, str]], prefix: str
+) -> Dict[str, Any]:
+    """Write the manifests of the array jobs.
+
+    The items are streamed through the ephemeral storage of the function,
+    so that only the items of one array are held in memory.
+    """
+    max_size = min(
+        int(request.get("array_size", array_manifest.MAX_ARRAY_SIZE)),
+        array_manifest.MAX_ARRAY_SIZE,
+    )
+    count = 0
+    arrays = []
+    with tempfile.TemporaryFile("w+") as f:
+        for item in items:
+            f.write(json.dumps(item) + "\n")
+            count += 1
+        f.seek(0)
+        for i, size in enumerate(array_manifest.chunk_sizes(count, max_size)):
+            chunk = [json.loads(f.readline()) for _ in range(size)]
+            url = f"s3://{S3_BUCKET}/{prefix}{i:05d}.jsonl"
+            array_manifest.write(s3, url, chunk)
+            arrays.append({"index": i, "manifest_url": url, "size": size})
+    logger.info(f"{count} items in {len(arrays)} array jobs")
+    return {"items": count, "arrays": arrays}
+
+
+def write_packs(
+    request: Dict[str, Any],
+    items: List[Dict[str, str]],
+    sizes: List[int],
+    prefix: str,
+) -> Dict[str, Any]:
+    """Write the commands of the packed jobs and the list of the jobs.
+
+    The commands of a job run concurrently on the vCPUs of the job
+    definition, so a job holds `target_seconds` times `JOB_DEF_CPU` of
+    estimated work.
+    """
+    options = request.get("pack", {})
+    history = load_profile(options["profile"]) if options.get("profile") else {}
+    bytes_per_second = float(
+        options.get("bytes_per_second", packing.DEFAULT_BYTES_PER_SECOND)
+    )
+    seconds = [
+        packing.estimate_seconds(size, history, bytes_per_second) for size in sizes
+    ]
+    target = float(options.get("target_seconds", packing.DEFAULT_TARGET_SECONDS))
+    packs = packing.pack(
+        items,
+        seconds,
+        target * JOB_DEF_CPU,
+        int(options.get("max_commands", packing.DEFAULT_MAX_COMMANDS)),
+    )
+
+    jobs = []
+    for i, commands in enumerate(packs):
+        key = f"{prefix}packs/{i:05d}.json"
+        s3.put_object(Bucket=S3_BUCKET, Key=key, Body=json.dumps(commands))
+        jobs.append(
+            {
+                "name": f"{request['name']}-{i}",
+                "commands_url": f"s3://{S3_BUCKET}/{key}",
+                "commands": len(commands),
+                "gpus": int(options.get("gpus", 0)),
+            }
+        )
+    jobs_key = f"{prefix}packs.json"
+    s3.put_object(Bucket=S3_BUCKET, Key=jobs_key, Body=json.dumps(jobs))
+    logger.info(
+        f"{len(items)} items in {len(jobs)} packed jobs - {sum(seconds):.0f} s estimated"
+    )
+    return {
+        "items": len(items),
+        "packs": len(jobs),
+        "bucket": S3_BUCKET,
+        "key": jobs_key,
+    }
+
+
+def read_json(url: str) -> Any:
+    """Return a JSON document stored on S3."""
+    parsed = urlparse(url)
+    response = s3.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
+    return json.loads(response["Body"].read())
+
+
+def results_manifests(redrive_url: str) -> List[str]:
+    """Return the urls of the `ResultWriter` manifests to redrive: the
+    manifest or results folder of a map run, or the map runs of an
+    execution."""
+    if not redrive_url.startswith("arn:"):
+        if redrive_url.endswith(".json"):
+            return [redrive_url]
+        return [f"{redrive_url.rstrip('/')}/manifest.json"]
+    execution = states.describe_execution(executionArn=redrive_url)
+    bucket = json.loads(execution["input"])["input"]["s3_bucket"]
+    paginator: Any = states.get_paginator("list_map_runs")
+    return [
+        f"s3://{bucket}/{redrive.manifest_key(run['mapRunArn'])}"
+        for page in paginator.paginate(executionArn=redrive_url)
+        for run in page["mapRuns"]
+    ]
+
+
+def failed_children(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the items of the failed children of an array job, or all
+    the items of its manifest when they are not known: the job failed
+    before its children, or AWS Batch no longer lists them."""
+    children = array_manifest.read(s3, item["manifest_url"])
+    job_id = item.get("failed_job_id")
+    if not job_id or int(item["size"]) < 2:
+        return children
+    paginator: Any = batch.get_paginator("list_jobs")
+    indexes = sorted(
+        job["arrayProperties"]["index"]
+        for page in paginator.paginate(arrayJobId=job_id, jobStatus="FAILED")
+        for job in page["jobSummaryList"]
+    )
+    if not indexes:
+        logger.warning(f"Failed children of {job_id} not listed, array redriven")
+        return children
+    return [children[index] for index in indexes]
+
+
+def redrive_items(
+    request: Dict[str, Any], stats: Dict[str, int]
+) -> Iterator[Dict[str, Any]]:
+    """Return the items of the failed child executions of previous map
+    runs, the commands of the failed packed jobs expanded."""
+    statuses = request["input"].get("redrive_statuses")
+    compute = request.get("compute")
+    for url in results_manifests(request["input"]["redrive_url"]):
+        try:
+            manifest = read_json(url)
+        except ClientError as e:
+            # Map runs without results, e.g. aborted before their end
+            logger.info(f"No results to redrive in {url} - {e}")
+            continue
+        bucket = manifest.get("DestinationBucket") or urlparse(url).netloc
+        for key in redrive.result_files(manifest, statuses):
+            results = read_json(f"s3://{bucket}/{key}")
+            for item in redrive.failed_inputs(results, statuses, stats):
+                if "manifest_url" in item:
+                    for child in failed_children(item):
+                        stats["redriven"] += 1
+                        yield redrive.redrive_item(
+                            {**child, "compute": item["compute"]}, compute
+                        )
+                elif "commands_url" in item:
+                    commands = read_json(item["commands_url"])
+                    for command in commands:
+                        stats["redriven"] += 1
+                        yield redrive.redrive_item(
+                            {**command, "compute": item["compute"]}, compute
+                        )
+                else:
+                    stats["redriven"] += 1
+                    yield redrive.redrive_item(item, compute)
+
+
+def write_items(items: Iterator[Dict[str, Any]], prefix: str) -> Dict[str, Any]:
+    """Write the items read by the distributed map of the map mode,
+    streamed through the ephemeral storage of the function."""
+    key = f"{prefix}items.json"
+    count = 0
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+        f.write("[")
+        for item in items:
+            f.write(("," if count else "") + "\n")
+            f.write(json.dumps(item))
+            count += 1
+        f.write("\n]\n")
+        f.flush()
+        s3.upload_file(f.name, S3_BUCKET, key)
+    return {"items": count, "bucket": S3_BUCKET, "key": key}
+
+
+def handler(event, context):
+    """Select the objects of the execution, or the failed items of a
+    previous one, and write the list of items, the array job manifests or
+    the packed jobs.
+
+    The event has the name of the execution and its input (`request`).
+    """
+    request = event["request"]
+    prefix = f"{MANIFESTS_PREFIX}{event['execution']}/"
+    tolerated = float(request.get("tolerated_failure_percentage", 0))
+    if request.get("fan_out") == "redrive":
+        stats = {"results": 0, "missing": 0, "redriven": 0}
+        result = write_items(redrive_items(request, stats), prefix)
+        logger.info(f"{stats['redriven']} items redriven - {stats}")
+        return {
+            **result,
+            "skipped": stats["missing"],
+            "tolerated_failure_percentage": tolerated,
+        }
+
+    stats = {"objects": 0, "selected": 0}
+    objects = select_objects(request, stats)
+    if request.get("fan_out") == "array":
+        result = write_arrays(
+            request,
+            (build_item(request, item["bucket"], item["key"]) for item in objects),
+            prefix,
+        )
+    elif request.get("fan_out") == "pack":
+        # The packing sorts all the items by duration
+        objects = list(itertools.islice(objects, MAX_PACK_ITEMS + 1))
+        if len(objects) > MAX_PACK_ITEMS:
+            raise ValueError(
+                f"More than {MAX_PACK_ITEMS} objects to pack: split the input, "
+                "or use the array or map fan-out"
+            )
+        items = [build_item(request, item["bucket"], item["key"]) for item in objects]
+        result = write_packs(
+            request, items, [item["size"] or 0 for item in objects], prefix
+        )
+    else:
+        result = write_items(
+            (build_item(request, item["bucket"], item["key"]) for item in objects),
+            prefix,
+        )
+    logger.info(f"{stats['selected']}/{stats['objects']} objects selected")
+    return {
+        **result,
+        "skipped": stats["objects"] - stats["selected"],
+        "tolerated_failure_percentage": tolerated,
+    }
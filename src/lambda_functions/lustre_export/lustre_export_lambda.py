@@ -0,0 +1,210 @@
+"""Batched export of the FSx for Lustre job outputs to Amazon S3.
+
+In FSx for Lustre mode, the AWS Batch jobs write their outputs on the file
+system and record the path of each completed output in an Amazon SQS queue.
+This Lambda function, scheduled by Amazon EventBridge, coalesces the queued
+paths into `EXPORT_TO_REPOSITORY` data repository tasks:
+
+1. The tasks started by the previous runs are tracked with
+   `DescribeDataRepositoryTasks`. The paths of failed or canceled tasks, or
+   of tasks with failed files, are queued again.
+2. When fewer than `MAX_ACTIVE_TASKS` tasks are running and the queue
+   holds a full batch, or the last export is older than
+   `MAX_WAIT_SECONDS`, the queue is drained into tasks of at most
+   `MAX_PATHS_PER_TASK` paths.
+3. The messages are deleted once the task is created, so the paths of a
+   rejected task (e.g. task limit reached) are received again later.
+
+The tracking state and one summary per finished task are saved in the S3
+bucket under `lustre/export/`.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+S3_BUCKET: str = os.environ.get("S3_BUCKET", "")
+FILE_SYSTEM_ID: str = os.environ.get("FILE_SYSTEM_ID", "")
+QUEUE_URL: str = os.environ.get("QUEUE_URL", "")
+MAX_PATHS_PER_TASK: int = int(os.environ.get("MAX_PATHS_PER_TASK", "100"))
+MAX_ACTIVE_TASKS: int = int(os.environ.get("MAX_ACTIVE_TASKS", "2"))
+MAX_WAIT_SECONDS: int = int(os.environ.get("MAX_WAIT_SECONDS", "600"))
+STATE_KEY: str = "lustre/export/state.json"
+TASKS_PREFIX: str = "lustre/export/tasks/"
+REPORTS_PREFIX: str = "lustre/export/reports"
+ACTIVE_STATUSES: List[str] = ["PENDING", "EXECUTING", "CANCELING"]
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+s3: Any = boto3.client("s3")
+sqs: Any = boto3.client("sqs")
+fsx: Any = boto3.client("fsx")
+
+
+def load_state() -> Dict[str, Any]:
+    """Load the tasks started by the previous runs."""
+    try:
+        response = s3.get_object(Bucket=S3_BUCKET, Key=STATE_KEY)
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        logger.info(f"No export state found ({STATE_KEY}) - {e}")
+        return {"active": [], "last_export": 0}
+
+
+def save_state(state: Dict[str, Any]):
+    s3.put_object(Bucket=S3_BUCKET, Key=STATE_KEY, Body=json.dumps(state))
+
+
+def queue_paths(paths: List[str], reason: str):
+    """Send paths back to the queue."""
+    for i in range(0, len(paths), 10):
+        sqs.send_message_batch(
+            QueueUrl=QUEUE_URL,
+            Entries=[
+                {
+                    "Id": str(index),
+                    "MessageBody": json.dumps({"path": path, "retry": reason}),
+                }
+                for index, path in enumerate(paths[i : i + 10])
+            ],
+        )
+
+
+def track_tasks(task_ids: List[str]) -> List[str]:
+    """Check the export tasks started by the previous runs.
+
+    Returns:
+        List[str]: The identifiers of the tasks still running.
+    """
+    active = []
+    for i in range(0, len(task_ids), 50):
+        response = fsx.describe_data_repository_tasks(TaskIds=task_ids[i : i + 50])
+        for task in response["DataRepositoryTasks"]:
+            task_id, lifecycle = task["TaskId"], task["Lifecycle"]
+            if lifecycle in ACTIVE_STATUSES:
+                active.append(task_id)
+                continue
+            status = task.get("Status", {})
+            summary = {
+                "task_id": task_id,
+                "lifecycle": lifecycle,
+                "paths": task.get("Paths", []),
+                "total": status.get("TotalCount"),
+                "succeeded": status.get("SucceededCount"),
+                "failed": status.get("FailedCount"),
+                "creation_time": str(task.get("CreationTime")),
+                "end_time": str(task.get("EndTime")),
+                "failure": task.get("FailureDetails", {}).get("Message"),
+            }
+            logger.info(f"Export task finished: {summary}")
+            s3.put_object(
+                Bucket=S3_BUCKET,
+                Key=f"{TASKS_PREFIX}{task_id}.json",
+                Body=json.dumps(summary),
+            )
+            if lifecycle != "SUCCEEDED" or status.get("FailedCount"):
+                # Exporting an unchanged file again is a no-op
+                queue_paths(summary["paths"], task_id)
+    return active
+
+
+def pending_messages() -> int:
+    attributes = sqs.get_queue_attributes(
+        QueueUrl=QUEUE_URL, AttributeNames=["ApproximateNumberOfMessages"]
+    )
+    return int(attributes["Attributes"]["ApproximateNumberOfMessages"])
+
+
+def receive_paths(max_paths: int) -> tuple:
+    """Receive up to `max_paths` distinct paths from the queue.
+
+    Returns:
+        tuple: The paths and the receipt handles of their messages.
+    """
+    paths, receipts = [], []
+    while len(paths) < max_paths:
+        response = sqs.receive_message(
+            QueueUrl=QUEUE_URL,
+            MaxNumberOfMessages=min(10, max_paths - len(paths)),
+            WaitTimeSeconds=1,
+        )
+        messages = response.get("Messages", [])
+        if not messages:
+            break
+        for message in messages:
+            receipts.append(message["ReceiptHandle"])
+            path = json.loads(message["Body"])["path"].lstrip("/")
+            if path not in paths:
+                paths.append(path)
+    return paths, receipts
+
+
+def delete_messages(receipts: List[str]):
+    for i in range(0, len(receipts), 10):
+        sqs.delete_message_batch(
+            QueueUrl=QUEUE_URL,
+            Entries=[
+                {"Id": str(index), "ReceiptHandle": receipt}
+                for index, receipt in enumerate(receipts[i : i + 10])
+            ],
+        )
+
+
+def create_export_task(paths: List[str]) -> str:
+    response = fsx.create_data_repository_task(
+        Type="EXPORT_TO_REPOSITORY",
+        FileSystemId=FILE_SYSTEM_ID,
+        Paths=paths,
+        Report={
+            "Enabled": True,
+            "Path": f"s3://{S3_BUCKET}/{REPORTS_PREFIX}",
+            "Format": "REPORT_CSV_20191124",
+            "Scope": "FAILED_FILES_ONLY",
+        },
+    )
+    task_id = response["DataRepositoryTask"]["TaskId"]
+    logger.info(f"Export task {task_id} created for {len(paths)} files")
+    return task_id
+
+
+def handler(event, context):
+    """Track the running export tasks and start new ones from the queue."""
+    state = load_state()
+    state["active"] = track_tasks(state["active"])
+    created = []
+
+    pending = pending_messages()
+    waited = time.time() - state.get("last_export", 0)
+    if pending and pending < MAX_PATHS_PER_TASK and waited < MAX_WAIT_SECONDS:
+        logger.info(f"{pending} outputs queued, waiting for a fuller batch")
+    elif pending:
+        while len(state["active"]) < MAX_ACTIVE_TASKS:
+            paths, receipts = receive_paths(MAX_PATHS_PER_TASK)
+            if not paths:
+                break
+            try:
+                task_id = create_export_task(paths)
+            except ClientError as e:
+                # The messages become visible again after the visibility timeout
+                logger.warning(f"Export task not created: {e}")
+                break
+            delete_messages(receipts)
+            state["active"].append(task_id)
+            state["last_export"] = time.time()
+            created.append({"task_id": task_id, "files": len(paths)})
+
+    save_state(state)
+    result = {"active": state["active"], "created": created, "pending": pending}
+    logger.info(f"Lustre export: {result}")
+    return result
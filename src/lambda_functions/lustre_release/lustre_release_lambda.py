@@ -0,0 +1,263 @@
+"""Capacity-aware release of cold files from the FSx for Lustre file system.
+
+The AWS Batch jobs record the Lustre inputs and outputs they touch in the S3
+bucket (`lustre/access/jobs/`). This Lambda function, scheduled by Amazon
+EventBridge:
+
+1. Merges these records in an access index (`lustre/access/index.json`)
+   with the last access time of each path
+2. Reads the used storage capacity of the file system from the Amazon
+   CloudWatch metric `FreeDataStorageCapacity`
+3. Above `HIGH_WATER_MARK`, selects the least recently used paths, idle for
+   at least `MIN_IDLE_SECONDS` and already exported to S3, until
+   `LOW_WATER_MARK` is reached
+4. Releases them with `RELEASE_DATA_FROM_FILESYSTEM` data repository tasks.
+   The metadata stays on the file system and the content is restored from
+   S3 on the next read.
+
+An object in S3 does not tell that the Lustre file is archived and unchanged
+since its export: its HSM state is only readable on the file system. The
+release tasks skip the files not archived or modified (dirty), listed in
+their report (`lustre/release/reports/`). The next runs report the finished
+tasks and put the paths of the tasks with skipped files back in the index.
+"""
+
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+S3_BUCKET: str = os.environ.get("S3_BUCKET", "")
+FILE_SYSTEM_ID: str = os.environ.get("FILE_SYSTEM_ID", "")
+HIGH_WATER_MARK: float = float(os.environ.get("HIGH_WATER_MARK", "0.8"))
+LOW_WATER_MARK: float = float(os.environ.get("LOW_WATER_MARK", "0.6"))
+MIN_IDLE_SECONDS: int = int(os.environ.get("MIN_IDLE_SECONDS", "3600"))
+MAX_PATHS_PER_TASK: int = 100
+MAX_TASKS_PER_RUN: int = int(os.environ.get("MAX_TASKS_PER_RUN", "5"))
+ACCESS_PREFIX: str = "lustre/access/jobs/"
+INDEX_KEY: str = "lustre/access/index.json"
+RELEASE_PREFIX: str = "lustre/release/tasks/"
+REPORT_PREFIX: str = "lustre/release/reports"
+# Concurrent HEAD requests of the candidate paths
+HEAD_WORKERS: int = 32
+FINISHED_TASK_STATES: List[str] = ["SUCCEEDED", "FAILED", "CANCELED"]
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+s3: Any = boto3.client("s3")
+fsx: Any = boto3.client("fsx")
+cloudwatch: Any = boto3.client("cloudwatch")
+
+
+def load_index() -> Dict[str, float]:
+    """Load the last access time of each path."""
+    try:
+        response = s3.get_object(Bucket=S3_BUCKET, Key=INDEX_KEY)
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        logger.info(f"No access index found ({INDEX_KEY}) - {e}")
+        return {}
+
+
+def merge_access_records(index: Dict[str, float]) -> int:
+    """Merge the access records of the jobs in the index and delete them.
+
+    Returns:
+        int: The number of merged records.
+    """
+    merged = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=ACCESS_PREFIX):
+        for item in page.get("Contents", []):
+            response = s3.get_object(Bucket=S3_BUCKET, Key=item["Key"])
+            record = json.loads(response["Body"].read())
+            for path in record["paths"]:
+                index[path] = max(index.get(path, 0), record["time"])
+            merged.append({"Key": item["Key"]})
+    s3.put_object(Bucket=S3_BUCKET, Key=INDEX_KEY, Body=json.dumps(index))
+    for i in range(0, len(merged), 1000):
+        s3.delete_objects(
+            Bucket=S3_BUCKET, Delete={"Objects": merged[i : i + 1000], "Quiet": True}
+        )
+    return len(merged)
+
+
+def storage_usage() -> tuple:
+    """Return the used and total storage capacity of the file system in
+    bytes."""
+    file_system = fsx.describe_file_systems(FileSystemIds=[FILE_SYSTEM_ID])
+    capacity = file_system["FileSystems"][0]["StorageCapacity"] * 1024**3
+    now = datetime.now(tz=timezone.utc)
+    # Each storage target reports its free capacity every minute
+    response = cloudwatch.get_metric_statistics(
+        Namespace="AWS/FSx",
+        MetricName="FreeDataStorageCapacity",
+        Dimensions=[{"Name": "FileSystemId", "Value": FILE_SYSTEM_ID}],
+        StartTime=now - timedelta(minutes=10),
+        EndTime=now,
+        Period=60,
+        Statistics=["Sum"],
+    )
+    datapoints = sorted(response["Datapoints"], key=lambda d: d["Timestamp"])
+    if not datapoints:
+        raise RuntimeError(f"No FreeDataStorageCapacity metric for {FILE_SYSTEM_ID}")
+    return capacity - datapoints[-1]["Sum"], capacity
+
+
+def exported_bytes(path: str) -> Optional[int]:
+    """Return the size of a file or directory in the S3 data repository, or
+    None if it was not exported. The release task checks that the file was
+    not modified since."""
+    try:
+        return s3.head_object(Bucket=S3_BUCKET, Key=path)["ContentLength"]
+    except ClientError:
+        # A directory of segments or images
+        response = s3.list_objects_v2(Bucket=S3_BUCKET, Prefix=path.rstrip("/") + "/")
+        size = sum(item["Size"] for item in response.get("Contents", []))
+        return size or None
+
+
+def select_cold_paths(index: Dict[str, float], bytes_to_release: int) -> Dict[str, int]:
+    """Select the least recently used exported paths until enough bytes are
+    released.
+
+    Returns:
+        Dict[str, int]: The selected paths and their size in bytes.
+    """
+    now = time.time()
+    idle = [
+        path
+        for path, accessed in sorted(index.items(), key=lambda item: item[1])
+        if now - accessed >= MIN_IDLE_SECONDS
+    ]
+    selected: Dict[str, int] = {}
+    with ThreadPoolExecutor(max_workers=HEAD_WORKERS) as executor:
+        for i in range(0, len(idle), MAX_PATHS_PER_TASK):
+            batch = idle[i : i + MAX_PATHS_PER_TASK]
+            for path, size in zip(batch, executor.map(exported_bytes, batch)):
+                if sum(selected.values()) >= bytes_to_release:
+                    return selected
+                if len(selected) >= MAX_PATHS_PER_TASK * MAX_TASKS_PER_RUN:
+                    return selected
+                if size is None:
+                    logger.info(f"Not exported to S3, kept: {path}")
+                    continue
+                selected[path] = size
+    return selected
+
+
+def release(paths: List[str]) -> List[str]:
+    """Start the release tasks.
+
+    Returns:
+        List[str]: The released paths.
+    """
+    released = []
+    for i in range(0, len(paths), MAX_PATHS_PER_TASK):
+        batch = paths[i : i + MAX_PATHS_PER_TASK]
+        try:
+            response = fsx.create_data_repository_task(
+                Type="RELEASE_DATA_FROM_FILESYSTEM",
+                FileSystemId=FILE_SYSTEM_ID,
+                Paths=batch,
+                # Files skipped by the task: not archived, or dirty
+                Report={
+                    "Enabled": True,
+                    "Path": f"s3://{S3_BUCKET}/{REPORT_PREFIX}",
+                    "Format": "REPORT_CSV_20191124",
+                    "Scope": "FAILED_FILES_ONLY",
+                },
+                ReleaseConfiguration={
+                    "DurationSinceLastAccess": {"Unit": "DAYS", "Value": 0}
+                },
+            )
+        except ClientError as e:
+            logger.warning(f"Release task not created: {e}")
+            break
+        task_id = response["DataRepositoryTask"]["TaskId"]
+        logger.info(f"Release task {task_id} created for {len(batch)} paths")
+        s3.put_object(
+            Bucket=S3_BUCKET,
+            Key=f"{RELEASE_PREFIX}{task_id}.json",
+            Body=json.dumps({"task_id": task_id, "paths": batch, "time": time.time()}),
+        )
+        released.extend(batch)
+    return released
+
+
+def report_tasks(index: Dict[str, float]) -> Dict[str, int]:
+    """Report the finished release tasks and put the paths of the tasks
+    with skipped files back in the index, with the time of the task.
+
+    Returns:
+        Dict[str, int]: The finished tasks, their skipped files and their
+        released bytes.
+    """
+    records = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=RELEASE_PREFIX):
+        for item in page.get("Contents", []):
+            response = s3.get_object(Bucket=S3_BUCKET, Key=item["Key"])
+            record = json.loads(response["Body"].read())
+            records[record["task_id"]] = (item["Key"], record)
+    report = {"finished_tasks": 0, "skipped_files": 0, "released_capacity": 0}
+    task_ids = list(records)
+    for i in range(0, len(task_ids), 50):
+        response = fsx.describe_data_repository_tasks(TaskIds=task_ids[i : i + 50])
+        for task in response["DataRepositoryTasks"]:
+            if task["Lifecycle"] not in FINISHED_TASK_STATES:
+                continue
+            key, record = records[task["TaskId"]]
+            status = task.get("Status", {})
+            skipped = status.get("FailedCount", 0)
+            logger.info(
+                f"Release task {task['TaskId']} {task['Lifecycle']}: "
+                f"{status.get('SucceededCount', 0)} released, {skipped} skipped"
+            )
+            if skipped or task["Lifecycle"] != "SUCCEEDED":
+                for path in record["paths"]:
+                    index.setdefault(path, record["time"])
+            report["finished_tasks"] += 1
+            report["skipped_files"] += skipped
+            report["released_capacity"] += status.get("ReleasedCapacity", 0)
+            s3.delete_object(Bucket=S3_BUCKET, Key=key)
+    return report
+
+
+def handler(event, context):
+    """Release the least recently used files above the high-water mark."""
+    index = load_index()
+    records = merge_access_records(index)
+    tasks = report_tasks(index)
+    used, capacity = storage_usage()
+    result = {
+        "records": records,
+        **tasks,
+        "tracked_paths": len(index),
+        "usage": round(used / capacity, 3),
+        "released_paths": 0,
+        "released_bytes": 0,
+    }
+    if used / capacity >= HIGH_WATER_MARK:
+        bytes_to_release = int(used - LOW_WATER_MARK * capacity)
+        selected = select_cold_paths(index, bytes_to_release)
+        released = release(list(selected))
+        for path in released:
+            index.pop(path)
+        result["released_paths"] = len(released)
+        result["released_bytes"] = sum(selected[path] for path in released)
+    s3.put_object(Bucket=S3_BUCKET, Key=INDEX_KEY, Body=json.dumps(index))
+    logger.info(f"Lustre release: {result}")
+    return result
@@ -9,6 +9,7 @@ The script performs the following main operations:
 2. Processes and saves trace segments to S3
 3. Triggers and waits for a Glue crawler to run
 4. Updates Athena views based on the processed data
+5. Aggregates the resource usage per job profile for the job sizing
 
 Usage:
     This script is designed to be run as an AWS Lambda function, but can also
@@ -31,6 +32,19 @@ LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
 S3_BUCKET: str = os.environ.get("S3_BUCKET", "gma-test")
 ATHENA_RESULT_LOCATION: str = f"s3://{S3_BUCKET}/athena/queries/"
 CRAWLER_NAME: str = "batch_ffmpeg_crawler"
+SIZING_PROFILES_KEY: str = "metrics/sizing/profiles.json"
+SIZING_PROFILES_QUERY: str = """
+SELECT
+    profile,
+    count(*) AS jobs,
+    approx_percentile(peak_memory_bytes, 0.95) AS p95_peak_memory_bytes,
+    approx_percentile(avg_cpu_cores, 0.95) AS p95_cpu_cores,
+    avg(duration_seconds) AS avg_duration_seconds,
+    avg(CASE WHEN bound = 'cpu' THEN 1.0 ELSE 0.0 END) AS cpu_bound_ratio
+FROM batch_ffmpeg.batch_ffmpeg_resources_summary
+WHERE profile IS NOT NULL AND profile <> 'unknown'
+GROUP BY profile
+"""
 MAX_WORKERS: int = 10  # Adjust based on your Lambda function's resources
 
 # Setup logging
@@ -169,12 +183,15 @@ def process_traces(trace_ids: List[str]) -> None:
             future.result()
 
 
-def run_athena_query(query: str) -> None:
+def run_athena_query(query: str) -> str:
     """Execute an Athena query and wait for its completion.
 
     Args:
         query (str): The SQL query to execute.
 
+    Returns:
+        str: The query execution id.
+
     Raises:
         ClientError: If the query fails to execute successfully.
     """
@@ -200,6 +217,31 @@ def run_athena_query(query: str) -> None:
         )
         raise Exception(f"Query failed: {error_message}")
 
+    return query_execution_id
+
+
+def update_sizing_profiles() -> None:
+    """Aggregate the resource usage per job profile and save it to S3 for
+    the job sizing Lambda function."""
+    query_execution_id: str = run_athena_query(SIZING_PROFILES_QUERY)
+    paginator: Any = athena.get_paginator("get_query_results")
+
+    rows: List[List[Optional[str]]] = []
+    for page in paginator.paginate(QueryExecutionId=query_execution_id):
+        for row in page["ResultSet"]["Rows"]:
+            rows.append([column.get("VarCharValue") for column in row["Data"]])
+
+    header, values = rows[0], rows[1:]
+    profiles: Dict[str, Dict[str, float]] = {}
+    for row in values:
+        record = dict(zip(header, row))
+        profiles[record.pop("profile")] = {
+            k: float(v) for k, v in record.items() if v is not None
+        }
+
+    s3.put_object(Bucket=S3_BUCKET, Key=SIZING_PROFILES_KEY, Body=json.dumps(profiles))
+    logger.info(f"{len(profiles)} sizing profiles saved to {SIZING_PROFILES_KEY}")
+
 
 def update_athena_views() -> None:
     """Update Athena views by executing DDL statements from files."""
@@ -279,6 +321,12 @@ def export_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         logger.info("Updating Athena views")
         update_athena_views()
 
+        # Step 6: Aggregate the resource usage per job profile
+        try:
+            update_sizing_profiles()
+        except Exception as e:
+            logger.error(f"Sizing profiles not updated: {str(e)}")
+
         return {
             "statusCode": 200,
             "body": json.dumps({"message": f"{len(trace_ids)} traces exported"}),
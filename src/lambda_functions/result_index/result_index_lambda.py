@@ -0,0 +1,90 @@
+"""Result index lookup of the state machine items.
+
+This Lambda function is invoked by the maps `S3 prefix objects` and
+`S3 object keys` of the AWS Step Functions state machine
+`batch-ffmpeg-state-machine` before the admission of each item:
+
+1. Computes the fingerprint of the result of the item from the ETags of its
+   inputs, its ffmpeg options and output format, the ffmpeg version of its
+   compute family (`FFMPEG_VERSIONS`), the compute family and the settings
+   of the wrapper rewriting the ffmpeg arguments in the environment of the
+   compute family (`FFMPEG_REWRITES`).
+2. Looks the fingerprint up in the DynamoDB table `batch-ffmpeg-results`,
+   filled by the jobs, and checks that the indexed output is still in place
+   with the same ETag.
+3. Reuses the output, copied server-side when the item writes to another
+   url.
+
+The state machine skips the items with a result (`hit`); the jobs of the
+other items index their output. Errors are a miss: the job runs.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict
+
+import boto3
+from botocore.exceptions import ClientError
+
+from shared_libraries import result_cache
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+TABLE_NAME: str = os.environ.get("TABLE_NAME", "batch-ffmpeg-results")
+# ffmpeg version of the container image of each compute family
+FFMPEG_VERSIONS: Dict[str, str] = json.loads(os.environ.get("FFMPEG_VERSIONS", "{}"))
+# Rewrite settings in the job definition environment of each compute family
+FFMPEG_REWRITES: Dict[str, Dict[str, str]] = json.loads(
+    os.environ.get("FFMPEG_REWRITES", "{}")
+)
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+s3: Any = boto3.client("s3")
+dynamodb: Any = boto3.client("dynamodb")
+index: Any = result_cache.DynamoDbIndex(dynamodb, TABLE_NAME)
+
+
+def handler(event, context):
+    """Return whether the result of an item is indexed and reused.
+
+    The event is the item, with its `compute`, `input_url`, ffmpeg options
+    and `output_url`.
+    """
+    miss = {"hit": False, "reuse": None, "fingerprint": None, "output_url": None}
+    output_url = event.get("output_url")
+    version = FFMPEG_VERSIONS.get(event.get("compute"))
+    if not version or not result_cache.cacheable(output_url):
+        return miss
+    try:
+        etags = result_cache.input_etags(
+            s3, event["input_url"].replace(" ", "").split(",")
+        )
+        rewrites = result_cache.rewrite_settings(
+            FFMPEG_REWRITES.get(event["compute"], {})
+        )
+        key = result_cache.fingerprint(
+            etags, event, version, event["compute"], rewrites
+        )
+        result = result_cache.lookup(index, s3, key)
+        if not result:
+            logger.info(f"{output_url} - result {key} not indexed")
+            return {**miss, "fingerprint": key}
+        how = result_cache.reuse(s3, result, output_url)
+    except ClientError as e:
+        logger.warning(f"{output_url} - result index skipped : {e}")
+        return miss
+    logger.info(
+        f"{output_url} - result {key} reused ({how}) from {result['output_url']}"
+    )
+    return {
+        "hit": True,
+        "reuse": how,
+        "fingerprint": key,
+        "output_url": result["output_url"],
+    }
@@ -0,0 +1,405 @@
+"""Input-aware AWS Batch job right-sizing.
+
+This Lambda function recommends the vCPU, memory and ffmpeg thread count of
+an AWS Batch FFmpeg job from the input media and from the resource usage of
+previous jobs of the same profile.
+
+The function is used by:
+1. The AWS Step Functions map, which passes each item and applies the
+   recommendation as `ContainerOverrides` of the `SubmitJob` task
+2. The API resource `/batch/execute/<compute>/sized`, which sizes and
+   submits the job
+
+Sizing is enabled by setting the AWS SSM Parameter `/batch-ffmpeg/sizing` to
+`TRUE`. When disabled, the job definition defaults are returned.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import boto3
+from botocore.exceptions import ClientError
+
+from shared_libraries import ffprobe
+
+# Constants
+LOGLEVEL: str = os.environ.get("LOGLEVEL", "INFO").upper()
+S3_BUCKET: str = os.environ.get("S3_BUCKET", "")
+JOB_DEF_CPU: int = int(os.environ.get("JOB_DEF_CPU", "2"))
+JOB_DEF_MEMORY: int = int(os.environ.get("JOB_DEF_MEMORY", "8192"))
+SIZING_PARAMETER: str = "/batch-ffmpeg/sizing"
+PROFILES_KEY: str = "metrics/sizing/profiles.json"
+CACHE_TTL_SECONDS: int = 300
+MIN_HISTORY_JOBS: int = 5
+AUDIO_EXTENSIONS: List[str] = [".mp3", ".m4a", ".aac", ".wav", ".flac", ".ogg"]
+VIDEO_EXTENSIONS: List[str] = [
+    ".mp4",
+    ".mov",
+    ".mkv",
+    ".mxf",
+    ".ts",
+    ".m2ts",
+    ".webm",
+    ".avi",
+    ".m4v",
+]
+
+# Memory (MiB) of the AWS Fargate tasks by vCPU
+FARGATE_MEMORY: Dict[float, List[int]] = {
+    0.25: [512, 1024, 2048],
+    0.5: list(range(1024, 4097, 1024)),
+    1: list(range(2048, 8193, 1024)),
+    2: list(range(4096, 16385, 1024)),
+    4: list(range(8192, 30721, 1024)),
+    8: list(range(16384, 61441, 4096)),
+    16: list(range(32768, 122881, 8192)),
+}
+
+DEFAULT_SIZING_RULES: Dict[str, Any] = {
+    "resolution": {
+        "audio": {"vcpus": 1, "memory": 2048},
+        "sd": {"vcpus": 1, "memory": 4096},
+        "hd": {"vcpus": 2, "memory": 4096},
+        "fhd": {"vcpus": 2, "memory": 8192},
+        "uhd": {"vcpus": 8, "memory": 16384},
+        "unknown": {"vcpus": JOB_DEF_CPU, "memory": JOB_DEF_MEMORY},
+    },
+    "codec_vcpus_factor": {"avc": 1, "hevc": 2, "av1": 2, "vp9": 2, "copy": 0},
+    "min_vcpus": 1,
+    "max_vcpus": 16,
+    "min_memory": 2048,
+    "max_memory": 61440,
+    "memory_headroom": 1.25,
+    # Resolution class of a video not probed (no ffprobe), from its minimum
+    # object size in bytes
+    "size_classes": {
+        "sd": 0,
+        "hd": 256 * 1024**2,
+        "fhd": 1024**3,
+        "uhd": 8 * 1024**3,
+    },
+}
+
+# Setup logging
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger()
+logger.setLevel(LOGLEVEL)
+
+# Initialize AWS clients
+s3: Any = boto3.client("s3")
+ssm: Any = boto3.client("ssm")
+batch: Any = boto3.client("batch")
+
+_cache: Dict[str, Any] = {}
+
+
+def load_sizing_rules() -> Dict[str, Any]:
+    """Load the sizing rules from the `SIZING_RULES` environment variable.
+
+    Returns:
+        Dict[str, Any]: The sizing rules merged with the defaults.
+    """
+    rules = dict(DEFAULT_SIZING_RULES)
+    rules.update(json.loads(os.environ.get("SIZING_RULES") or "{}"))
+    return rules
+
+
+def cached(key: str, loader) -> Any:
+    """Return a value cached for `CACHE_TTL_SECONDS` across invocations."""
+    entry = _cache.get(key)
+    if entry and time.time() - entry[0] < CACHE_TTL_SECONDS:
+        return entry[1]
+    value = loader()
+    _cache[key] = (time.time(), value)
+    return value
+
+
+def sizing_enabled() -> bool:
+    """Check the AWS SSM Parameter `/batch-ffmpeg/sizing`."""
+
+    def load() -> bool:
+        try:
+            parameter = ssm.get_parameter(Name=SIZING_PARAMETER)
+            return parameter["Parameter"]["Value"] == "TRUE"
+        except ClientError as e:
+            logger.error(f"{SIZING_PARAMETER} not found in SSM Parameter - {e}")
+            return False
+
+    return cached("enabled", load)
+
+
+def load_profiles() -> Dict[str, Any]:
+    """Load the historical resource usage per job profile computed by the
+    metrics export Lambda function."""
+
+    def load() -> Dict[str, Any]:
+        try:
+            response = s3.get_object(Bucket=S3_BUCKET, Key=PROFILES_KEY)
+            return json.loads(response["Body"].read())
+        except ClientError as e:
+            logger.info(f"No sizing profiles found ({PROFILES_KEY}) - {e}")
+            return {}
+
+    return cached("profiles", load)
+
+
+def probe_input(input_url: str) -> Dict[str, Any]:
+    """Describe the first input of the job.
+
+    ffprobe reads the headers of the object through a presigned URL when the
+    binary is available (e.g. from a Lambda layer). Otherwise, only the
+    object size and extension are known (`probed` False).
+    """
+    parsed = urlparse(input_url.replace(" ", "").split(",")[0])
+    bucket, key = parsed.netloc, parsed.path.lstrip("/")
+    if shutil.which(ffprobe.FFPROBE):
+        url = s3.generate_presigned_url(
+            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=300
+        )
+        try:
+            return {
+                **ffprobe.media_summary(ffprobe.probe(url, timeout=20)),
+                "probed": True,
+            }
+        except Exception as e:
+            logger.warning(f"ffprobe failed on s3://{bucket}/{key} - {e}")
+    head = s3.head_object(Bucket=bucket, Key=key)
+    extension = os.path.splitext(key)[1].lower()
+    return {
+        "format_name": extension.lstrip("."),
+        "extension": extension,
+        "size": head["ContentLength"],
+        "duration": None,
+        "video": [],
+        "audio": [{"codec_name": None}] if extension in AUDIO_EXTENSIONS else [],
+        "probed": False,
+    }
+
+
+def size_class(size: int, size_classes: Dict[str, int]) -> str:
+    """Estimate the resolution class of a video from its object size.
+
+    Examples:
+        >>> size_class(3 * 1024**3, DEFAULT_SIZING_RULES["size_classes"])
+        'fhd'
+        >>> size_class(50 * 1024**2, DEFAULT_SIZING_RULES["size_classes"])
+        'sd'
+    """
+    resolution = "unknown"
+    for name, min_size in sorted(size_classes.items(), key=lambda item: item[1]):
+        if size >= min_size:
+            resolution = name
+    return resolution
+
+
+def output_codec_family(output_file_options: Optional[str]) -> str:
+    """Guess the video encoder family from the ffmpeg output options.
+
+    Examples:
+        >>> output_codec_family("-c:v libx265 -crf 28")
+        'hevc'
+        >>> output_codec_family("-c copy")
+        'copy'
+        >>> output_codec_family(None)
+        'avc'
+    """
+    tokens = (output_file_options or "").split()
+    for option, value in zip(tokens, tokens[1:]):
+        if option in ["-c:v", "-vcodec", "-codec:v", "-c", "-codec"]:
+            if value == "copy":
+                return "copy"
+            if "265" in value or "hevc" in value:
+                return "hevc"
+            if "av1" in value or "aom" in value:
+                return "av1"
+            if "vp9" in value:
+                return "vp9"
+    return "avc"
+
+
+def job_profile(
+    summary: Dict[str, Any],
+    output_file_options: Optional[str],
+    size_classes: Optional[Dict[str, int]] = None,
+) -> str:
+    """Name the profile used to group the job with similar ones.
+
+    When the input could not be probed, the resolution of a video file is
+    estimated from its size with `size_classes`.
+
+    Examples:
+        >>> job_profile({"video": [{"width": 1920, "height": 1080}]}, "-c:v libx265")
+        'fhd-hevc'
+        >>> job_profile({"video": [], "audio": [{}]}, "-c:a aac")
+        'audio'
+        >>> job_profile({"video": [], "audio": [], "probed": False, "extension": ".mxf",
+        ...              "size": 20 * 1024**3}, None, DEFAULT_SIZING_RULES["size_classes"])
+        'uhd-avc'
+    """
+    resolution = ffprobe.resolution_class(summary)
+    if (
+        resolution == "unknown"
+        and size_classes
+        and summary.get("probed") is False
+        and summary.get("extension") in VIDEO_EXTENSIONS
+    ):
+        resolution = size_class(summary["size"], size_classes)
+    if resolution in ["audio", "unknown"]:
+        return resolution
+    return f"{resolution}-{output_codec_family(output_file_options)}"
+
+
+def snap_fargate(vcpus: float, memory: int) -> tuple:
+    """Snap vCPU and memory to a valid AWS Fargate combination.
+
+    Examples:
+        >>> snap_fargate(3, 1024)
+        (4, 8192)
+        >>> snap_fargate(1, 20000)
+        (1, 8192)
+        >>> snap_fargate(0.25, 600)
+        (0.25, 1024)
+        >>> snap_fargate(4, 32768)
+        (4, 30720)
+        >>> snap_fargate(8, 17408)
+        (8, 20480)
+        >>> snap_fargate(16, 50000)
+        (16, 57344)
+    """
+    vcpus = next(v for v in FARGATE_MEMORY if v >= min(vcpus, 16))
+    choices = FARGATE_MEMORY[vcpus]
+    return vcpus, next((m for m in choices if m >= memory), choices[-1])
+
+
+def recommend(
+    profile: str, compute: str, rules: Dict[str, Any], profiles: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Recommend vCPU, memory (MiB) and ffmpeg threads for a job profile.
+
+    The static rules give the starting point. When at least
+    `MIN_HISTORY_JOBS` jobs of the same profile were sampled, the memory is
+    sized on the 95th percentile of their peak memory plus a headroom, and
+    the vCPU on the 95th percentile of their average CPU usage; CPU-bound
+    profiles get one more step of vCPU.
+    """
+    resolution, _, codec = profile.partition("-")
+    base = rules["resolution"].get(resolution, rules["resolution"]["unknown"])
+    factor = rules["codec_vcpus_factor"].get(codec or "avc", 1)
+    vcpus = base["vcpus"] * factor if factor else rules["min_vcpus"]
+    memory = base["memory"] if factor else rules["min_memory"]
+    source = "rules"
+
+    history = profiles.get(profile)
+    if history and history.get("jobs", 0) >= MIN_HISTORY_JOBS:
+        source = "history"
+        if history.get("p95_peak_memory_bytes"):
+            memory = (
+                math.ceil(
+                    history["p95_peak_memory_bytes"]
+                    * rules["memory_headroom"]
+                    / (256 * 1024 * 1024)
+                )
+                * 256
+            )
+        if history.get("p95_cpu_cores"):
+            vcpus = math.ceil(history["p95_cpu_cores"] * 1.1)
+        if history.get("cpu_bound_ratio", 0) > 0.5:
+            vcpus *= 2
+
+    vcpus = int(min(max(vcpus, rules["min_vcpus"]), rules["max_vcpus"]))
+    memory = int(min(max(memory, rules["min_memory"]), rules["max_memory"]))
+    if compute.startswith("fargate"):
+        vcpus, memory = snap_fargate(vcpus, memory)
+    return {
+        "vcpus": str(vcpus),
+        "memory": str(memory),
+        "threads": str(max(1, math.ceil(vcpus))),
+        "profile": profile,
+        "source": source,
+    }
+
+
+def size_job(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Size one job from its parameters (`input_url`, `output_file_options`,
+    `compute`)."""
+    compute = item.get("compute", "")
+    default = {
+        "vcpus": str(JOB_DEF_CPU),
+        "memory": str(JOB_DEF_MEMORY),
+        "threads": "0",
+        "profile": "unknown",
+        "source": "default",
+    }
+    if not sizing_enabled() or not item.get("input_url"):
+        return default
+    try:
+        rules = load_sizing_rules()
+        summary = probe_input(item["input_url"])
+        profile = job_profile(
+            summary, item.get("output_file_options"), rules.get("size_classes")
+        )
+        return recommend(profile, compute, rules, load_profiles())
+    except Exception as e:
+        logger.error(f"Sizing failed, using job definition defaults - {e}")
+        return default
+
+
+def container_overrides(sizing: Dict[str, Any]) -> Dict[str, Any]:
+    """Translate a sizing recommendation into AWS Batch container
+    overrides."""
+    return {
+        "resourceRequirements": [
+            {"type": "VCPU", "value": sizing["vcpus"]},
+            {"type": "MEMORY", "value": sizing["memory"]},
+        ],
+        "environment": [
+            {"name": "FFMPEG_THREADS", "value": sizing["threads"]},
+            {"name": "SIZING_PROFILE", "value": sizing["profile"]},
+        ],
+    }
+
+
+def submit_job(compute: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Size and submit an AWS Batch FFmpeg job."""
+    sizing = size_job({**parameters, "compute": compute})
+    job_name = f"api-{compute}-ffmpeg-sized-{time.strftime('%Y%m%d-%H%M%S')}"
+    response = batch.submit_job(
+        jobName=job_name,
+        jobQueue=f"batch-ffmpeg-job-queue-{compute}",
+        jobDefinition=f"batch-ffmpeg-job-definition-{compute}",
+        parameters={
+            k: str(v) for k, v in parameters.items() if k not in ["instance_type"]
+        },
+        containerOverrides=container_overrides(sizing),
+    )
+    logger.info(f"Job {response['jobId']} submitted with sizing {sizing}")
+    return {"jobId": response["jobId"], "jobName": job_name, "sizing": sizing}
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Lambda handler for both the Step Functions map and API Gateway.
+
+    Args:
+        event (Dict[str, Any]): A map item, or an API Gateway proxy event on
+            the resource `/batch/execute/<compute>/sized`.
+        context (Any): The context in which the Lambda function is running.
+
+    Returns:
+        Dict[str, Any]: The sizing recommendation, or the API response.
+    """
+    if "httpMethod" not in event:
+        return size_job(event)
+
+    try:
+        compute = event["resource"].rstrip("/").split("/")[-2]
+        parameters = json.loads(event.get("body") or "{}")
+        return {"statusCode": 200, "body": json.dumps(submit_job(compute, parameters))}
+    except Exception as e:
+        logger.error(f"Error during sized submission: {str(e)}", exc_info=True)
+        return {"statusCode": 500, "body": json.dumps({"message": str(e)})}
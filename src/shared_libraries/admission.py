@@ -0,0 +1,114 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Admission control of the job submissions of the state machine.
+
+The maps of the state machine submit up to thousands of jobs at once. When
+the job queues are saturated or the AWS Batch API throttles, blind retries
+with long backoffs stall the items for hours. Each item is admitted before
+its submission when:
+
+- the RUNNABLE depth of its job queue, plus the jobs admitted since the
+  depth was read, leaves room for its jobs (one, or the size of an array
+  job). An empty queue always admits, so an array larger than the limit
+  still runs.
+- it gets a token of the account-wide token bucket of the AWS Batch API.
+  When the bucket is empty, the token is reserved ahead of time and the
+  item waits for it, so the waiting items are submitted at the rate of the
+  bucket instead of retrying together.
+
+An item rejected by the queue depth waits, with jitter, for the queue to
+drain.
+"""
+
+import logging
+import os
+import random
+from typing import Optional, Tuple
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+# Default settings, see ADMISSION in infrastructure/config/batch_config.py
+DEFAULT_SUBMIT_RATE = 20.0
+DEFAULT_BURST = 50.0
+DEFAULT_MAX_RUNNABLE = 100
+DEFAULT_DEPTH_TTL_SECONDS = 10
+DEFAULT_MAX_WAIT_SECONDS = 60
+
+
+def refill(
+    tokens: float, updated_at: float, now: float, rate: float, burst: float
+) -> float:
+    """Return the tokens of a bucket refilled at ``rate`` tokens per
+    second, up to ``burst``.
+
+    Examples:
+        >>> refill(0, 100.0, 101.5, 10, 50)
+        15.0
+        >>> refill(45, 100.0, 110.0, 10, 50)
+        50
+    """
+    return min(burst, tokens + max(0.0, now - updated_at) * rate)
+
+
+def check_depth(depth: int, jobs: int, max_runnable: int) -> bool:
+    """Return True if ``jobs`` more jobs fit in the RUNNABLE backlog of a
+    queue.
+
+    Examples:
+        >>> check_depth(90, 1, 100)
+        True
+        >>> check_depth(100, 1, 100)
+        False
+        >>> check_depth(0, 5000, 100)
+        True
+    """
+    return depth == 0 or depth + jobs <= max_runnable
+
+
+def reserve(
+    tokens: float, rate: float, max_wait: float = DEFAULT_MAX_WAIT_SECONDS
+) -> Tuple[float, Optional[float]]:
+    """Take a token of a bucket, ahead of time when the bucket is empty.
+
+    Returns the tokens left and the wait before the token is available,
+    or None without taking the token when the wait would exceed
+    ``max_wait``. The waiting items are spread at the rate of the bucket
+    instead of retrying together.
+
+    Examples:
+        >>> reserve(3.5, 20)
+        (2.5, 0.0)
+        >>> reserve(-10.5, 20)
+        (-11.5, 0.575)
+        >>> reserve(-1200, 20, max_wait=60)
+        (-1200, None)
+    """
+    left = tokens - 1
+    wait = max(0.0, -left / rate)
+    if wait > max_wait:
+        return tokens, None
+    return left, round(wait, 3)
+
+
+def backoff_seconds(
+    depth_ttl: float = DEFAULT_DEPTH_TTL_SECONDS,
+    max_wait: float = DEFAULT_MAX_WAIT_SECONDS,
+    attempts: int = 1,
+    rng: Optional[random.Random] = None,
+) -> int:
+    """Return the wait of an item rejected by the queue depth: the next read
+    of the depth, with an exponential backoff over its attempts up to
+    ``max_wait`` and jitter on the second half.
+
+    Examples:
+        >>> rng = random.Random(1)
+        >>> 5 <= backoff_seconds(10, attempts=1, rng=rng) <= 10
+        True
+        >>> 30 <= backoff_seconds(10, max_wait=60, attempts=10, rng=rng) <= 60
+        True
+    """
+    rng = rng or random.Random()
+    base = min(depth_ttl * 2 ** min(attempts - 1, 6), max_wait)
+    return max(1, round(base / 2 + rng.uniform(0, base / 2)))
@@ -0,0 +1,105 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Manifests of the AWS Batch array jobs.
+
+An array job processes a list of items, one per child job: the wrapper
+parameters (``name``, ``input_url``, ``input_file_options``,
+``global_options``, ``output_url``, ``output_file_options``) of each item
+are stored as JSON lines in an S3 manifest, and each child resolves its item
+from its ``AWS_BATCH_JOB_ARRAY_INDEX``.
+
+To avoid downloading the whole manifest in each of the up to 10,000
+children, the manifest has an index object (``<manifest key>.index``) with
+the byte offset of each line in fixed-width records: a child reads its
+item with two ranged GET requests.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlparse
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+# Maximum number of child jobs of an AWS Batch array job
+MAX_ARRAY_SIZE = 10000
+OFFSET_WIDTH = 12
+RECORD_SIZE = OFFSET_WIDTH + 1
+
+
+def encode(items: List[Dict[str, Any]]) -> Tuple[bytes, bytes]:
+    """Return the manifest and index of a list of items.
+
+    Examples:
+        >>> manifest, index = encode([{"name": "a"}, {"name": "bb"}])
+        >>> manifest
+        b'{"name": "a"}\\n{"name": "bb"}\\n'
+        >>> index.split()
+        [b'000000000000', b'000000000014', b'000000000029']
+    """
+    lines = [json.dumps(item).encode() + b"\n" for item in items]
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    index = b"".join(b"%0*d\n" % (OFFSET_WIDTH, offset) for offset in offsets)
+    return b"".join(lines), index
+
+
+def chunk_sizes(count: int, max_size: int = MAX_ARRAY_SIZE) -> List[int]:
+    """Return the sizes of the fewest arrays of at most ``max_size`` items
+    holding ``count`` items, balanced so that no array has a single item
+    when there are several items.
+
+    Examples:
+        >>> chunk_sizes(10001)
+        [5001, 5000]
+        >>> chunk_sizes(3, 2)
+        [2, 1]
+        >>> chunk_sizes(0)
+        []
+    """
+    if not count:
+        return []
+    arrays = -(-count // max_size)
+    size, extra = divmod(count, arrays)
+    return [size + (1 if i < extra else 0) for i in range(arrays)]
+
+
+def write(s3_client, url: str, items: List[Dict[str, Any]]):
+    """Write the manifest of an array job and its index."""
+    parsed = urlparse(url)
+    manifest, index = encode(items)
+    key = parsed.path.lstrip("/")
+    s3_client.put_object(Bucket=parsed.netloc, Key=key, Body=manifest)
+    s3_client.put_object(Bucket=parsed.netloc, Key=f"{key}.index", Body=index)
+
+
+def read(s3_client, url: str) -> List[Dict[str, Any]]:
+    """Return all the items of the manifest of an array job."""
+    parsed = urlparse(url)
+    response = s3_client.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
+    return [json.loads(line) for line in response["Body"].read().splitlines()]
+
+
+def read_item(s3_client, url: str, array_index: int) -> Dict[str, Any]:
+    """Return the item of a child job from the manifest of its array job."""
+    parsed = urlparse(url)
+    key = parsed.path.lstrip("/")
+    start = array_index * RECORD_SIZE
+    response = s3_client.get_object(
+        Bucket=parsed.netloc,
+        Key=f"{key}.index",
+        Range=f"bytes={start}-{start + 2 * RECORD_SIZE - 1}",
+    )
+    offsets = [int(offset) for offset in response["Body"].read().split()]
+    if len(offsets) != 2:
+        raise IndexError(f"Item {array_index} not found in {url}")
+    response = s3_client.get_object(
+        Bucket=parsed.netloc, Key=key, Range=f"bytes={offsets[0]}-{offsets[1] - 1}"
+    )
+    item = json.loads(response["Body"].read())
+    logger.info(f"Item {array_index} of {url}: {item.get('name')}")
+    return item
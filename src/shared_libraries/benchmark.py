@@ -0,0 +1,298 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Compute-family benchmark matrix.
+
+A matrix (``src/benchmarks/matrix.json``) declares reference assets, ffmpeg
+commands, compute families and ffmpeg versions. It is expanded in one AWS
+Batch job per combination and repetition, and the timings and quality
+scores of the jobs are summarized per configuration with:
+
+- the realtime factor: duration of the asset divided by the ffmpeg
+  execution time;
+- the cost per output hour: price of the vCPU and memory reserved by the
+  job during its execution, for one hour of output;
+- the VMAF score of the output against the reference asset.
+"""
+
+import csv
+import io
+import logging
+import os
+import re
+import statistics
+from typing import Any, Dict, List, Optional
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+# AWS Batch job names: 128 letters, numbers, hyphens and underscores
+JOB_NAME_MAX_LENGTH = 128
+
+CONFIGURATION_KEYS = ["asset", "command", "compute", "ffmpeg_version"]
+
+
+def slug(text: str) -> str:
+    """Return a name usable in an AWS Batch job name or an S3 key.
+
+    Examples:
+        >>> slug("h264 CRF 23 / 1080p")
+        'h264-CRF-23-1080p'
+    """
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", text).strip("-")
+
+
+def job_definition_name(compute: str, ffmpeg_version: Optional[str] = None) -> str:
+    """Return the job definition of a compute family, or its clone for
+    another ffmpeg version.
+
+    Examples:
+        >>> job_definition_name("arm")
+        'batch-ffmpeg-job-definition-arm'
+        >>> job_definition_name("arm", "6.0")
+        'batch-ffmpeg-job-definition-arm-ffmpeg-6-0'
+    """
+    name = f"batch-ffmpeg-job-definition-{compute}"
+    if ffmpeg_version:
+        name += f"-ffmpeg-{slug(ffmpeg_version.replace('.', '-'))}"
+    return name
+
+
+def image_for_version(image: str, ffmpeg_version: str) -> str:
+    """Replace the ffmpeg version of a container image tag
+    (``<version>-<os>-<arch>``).
+
+    Examples:
+        >>> image_for_version("123.dkr.ecr.eu-west-1.amazonaws.com/ffmpeg:7.0-ubuntu2004-arm64", "6.0")
+        '123.dkr.ecr.eu-west-1.amazonaws.com/ffmpeg:6.0-ubuntu2004-arm64'
+    """
+    repository, tag = image.rsplit(":", 1)
+    return f"{repository}:{ffmpeg_version}-{tag.split('-', 1)[1]}"
+
+
+def image_version(image: str) -> str:
+    """Return the ffmpeg version of a container image tag.
+
+    Examples:
+        >>> image_version("ffmpeg:6.0-nvidia2004-amd64")
+        '6.0'
+    """
+    return image.rsplit(":", 1)[1].split("-", 1)[0]
+
+
+def expand(matrix: Dict[str, Any], run_id: str) -> List[Dict[str, Any]]:
+    """Expand a matrix in one item per job.
+
+    A command runs on the compute families listed in its ``computes`` key, or
+    on all of them. The ``ffmpeg_version`` of an item is ``None`` for the
+    version of the job definition.
+
+    Examples:
+        >>> matrix = {
+        ...     "output": "s3://bucket/benchmarks/",
+        ...     "assets": {"bbb": {"url": "s3://bucket/bbb.mp4", "duration": 60}},
+        ...     "commands": {
+        ...         "x264": {"output_file_options": "-c:v libx264", "extension": ".mp4"},
+        ...         "nvenc": {"output_file_options": "-c:v h264_nvenc", "computes": ["nvidia"]},
+        ...     },
+        ...     "computes": ["intel", "nvidia"],
+        ...     "ffmpeg_versions": [None, "6.0"],
+        ... }
+        >>> items = expand(matrix, "run1")
+        >>> len(items)
+        6
+        >>> items[0]["name"], items[0]["output_url"]
+        ('run1-bbb-x264-intel-default-1', 's3://bucket/benchmarks/run1/bbb/x264/intel-default-1.mp4')
+        >>> items[-1]["job_definition"]
+        'batch-ffmpeg-job-definition-nvidia-ffmpeg-6-0'
+    """
+    items = []
+    versions = matrix.get("ffmpeg_versions") or [None]
+    for asset in matrix["assets"]:
+        for command, options in matrix["commands"].items():
+            for compute in options.get("computes") or matrix["computes"]:
+                if compute not in matrix["computes"]:
+                    continue
+                for version in versions:
+                    for repeat in range(1, matrix.get("repeat", 1) + 1):
+                        item = _item(matrix, run_id, asset, command, compute)
+                        item.update(_label(item, version, repeat))
+                        items.append(item)
+    return items
+
+
+def _item(
+    matrix: Dict[str, Any],
+    run_id: str,
+    asset_name: str,
+    command_name: str,
+    compute: str,
+) -> Dict[str, Any]:
+    asset = matrix["assets"][asset_name]
+    command = matrix["commands"][command_name]
+    return {
+        "run_id": run_id,
+        "asset": asset_name,
+        "command": command_name,
+        "compute": compute,
+        "duration": asset["duration"],
+        "vcpus": str(command.get("vcpus", matrix.get("vcpus", 2))),
+        "memory": str(command.get("memory", matrix.get("memory", 8192))),
+        "input_url": asset["url"],
+        "input_file_options": asset.get("input_file_options", "null"),
+        "global_options": command.get("global_options", "null"),
+        "output_file_options": command["output_file_options"],
+        "output_url": f"{matrix['output']}{run_id}/{asset_name}/{command_name}/",
+        "extension": command.get("extension", ".mp4"),
+    }
+
+
+def _label(item: Dict[str, Any], version: Optional[str], repeat: int) -> Dict:
+    label = f"{item['compute']}-{version or 'default'}-{repeat}"
+    name = f"{item['run_id']}-{item['asset']}-{item['command']}-{label}"
+    return {
+        "name": slug(name)[:JOB_NAME_MAX_LENGTH],
+        "ffmpeg_version": version,
+        "repeat": repeat,
+        "job_definition": job_definition_name(item["compute"], version),
+        "output_url": f"{item['output_url']}{label}{item.pop('extension')}",
+    }
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Return the nearest-rank percentile of a list of values.
+
+    Examples:
+        >>> percentile(list(range(1, 101)), 50)
+        50
+        >>> percentile(list(range(1, 101)), 99)
+        99
+        >>> percentile([], 50) is None
+        True
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[int(max(1, -(-len(ordered) * q // 100))) - 1]
+
+
+def vmaf_score(document: Dict[str, Any]) -> Optional[float]:
+    """Return the mean VMAF of a quality metrics document (ffmpeg-quality-metrics
+    global statistics).
+
+    Examples:
+        >>> vmaf_score({"global": {"vmaf": {"vmaf": {"average": 95.123}}}})
+        95.123
+        >>> vmaf_score({}) is None
+        True
+    """
+    return document.get("global", {}).get("vmaf", {}).get("vmaf", {}).get("average")
+
+
+def cost_per_output_hour(
+    seconds: float, duration: float, vcpus: float, memory: float, price: Dict
+) -> Optional[float]:
+    """Return the cost of one hour of output, from the vCPU and memory (MiB)
+    reserved by the job and the price of the compute family
+    (``vcpu_hour`` and ``gb_hour`` in USD).
+
+    Examples:
+        >>> cost_per_output_hour(30, 60, 2, 4096, {"vcpu_hour": 0.04, "gb_hour": 0.005})
+        0.05
+        >>> cost_per_output_hour(30, 60, 2, 4096, {}) is None
+        True
+    """
+    if not price or not duration:
+        return None
+    hourly = vcpus * price.get("vcpu_hour", 0) + memory / 1024 * price.get("gb_hour", 0)
+    return round(hourly * seconds / duration, 4)
+
+
+def summarize(results: List[Dict[str, Any]], prices: Dict[str, Dict]) -> List[Dict]:
+    """Summarize the results of the jobs per configuration.
+
+    Each result holds the keys of its item and ``status``, ``ffmpeg_seconds``,
+    ``job_seconds`` and ``vmaf``. The medians of the successful runs are
+    reported.
+
+    Examples:
+        >>> results = [
+        ...     {"asset": "bbb", "command": "x264", "compute": "arm", "ffmpeg_version": None,
+        ...      "duration": 60, "vcpus": "2", "memory": "4096", "status": "SUCCEEDED",
+        ...      "ffmpeg_seconds": s, "job_seconds": s + 10, "vmaf": 95.0}
+        ...     for s in [20, 30, 40]
+        ... ]
+        >>> row = summarize(results, {"arm": {"vcpu_hour": 0.034}})[0]
+        >>> row["runs"], row["realtime_factor"], row["cost_per_output_hour"], row["vmaf"]
+        (3, 2.0, 0.0453, 95.0)
+    """
+    groups: Dict[tuple, List[Dict]] = {}
+    for result in results:
+        key = tuple(result[k] for k in CONFIGURATION_KEYS)
+        groups.setdefault(key, []).append(result)
+
+    rows = []
+    for key, runs in sorted(groups.items(), key=lambda item: str(item[0])):
+        succeeded = [
+            r for r in runs if r["status"] == "SUCCEEDED" and r["ffmpeg_seconds"]
+        ]
+        row = dict(zip(CONFIGURATION_KEYS, key))
+        row["ffmpeg_version"] = row["ffmpeg_version"] or "default"
+        row.update({"runs": len(runs), "failed": len(runs) - len(succeeded)})
+        row.update(
+            dict.fromkeys(
+                ["ffmpeg_seconds", "realtime_factor", "cost_per_output_hour", "vmaf"]
+            )
+        )
+        if succeeded:
+            first = succeeded[0]
+            ffmpeg_seconds = statistics.median(r["ffmpeg_seconds"] for r in succeeded)
+            job_seconds = statistics.median(
+                r.get("job_seconds") or r["ffmpeg_seconds"] for r in succeeded
+            )
+            scores = [r["vmaf"] for r in succeeded if r.get("vmaf") is not None]
+            row["ffmpeg_seconds"] = round(ffmpeg_seconds, 2)
+            row["realtime_factor"] = round(first["duration"] / ffmpeg_seconds, 2)
+            row["cost_per_output_hour"] = cost_per_output_hour(
+                job_seconds,
+                first["duration"],
+                float(first["vcpus"]),
+                float(first["memory"]),
+                prices.get(first["compute"], {}),
+            )
+            row["vmaf"] = round(statistics.median(scores), 2) if scores else None
+        rows.append(row)
+    return rows
+
+
+def to_markdown(rows: List[Dict]) -> str:
+    """Format the summary as a Markdown table.
+
+    Examples:
+        >>> print(to_markdown([{"compute": "arm", "vmaf": None}]))
+        | compute | vmaf |
+        | --- | --- |
+        | arm | - |
+    """
+    if not rows:
+        return ""
+    columns = list(rows[0])
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "| " + " | ".join("---" for _ in columns) + " |",
+    ]
+    for row in rows:
+        values = ["-" if row[c] is None else str(row[c]) for c in columns]
+        lines.append("| " + " | ".join(values) + " |")
+    return "\n".join(lines)
+
+
+def to_csv(rows: List[Dict]) -> str:
+    """Format the summary as CSV."""
+    if not rows:
+        return ""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
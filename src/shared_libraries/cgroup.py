@@ -0,0 +1,500 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Container resource accounting based on Linux control groups.
+
+This module reads CPU, memory, block I/O and network counters of the
+container (and therefore of the ffmpeg process tree running inside it)
+from cgroup v1 or cgroup v2 and samples them in a background thread.
+"""
+
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+SAMPLE_FIELDS = [
+    "t",
+    "phase",
+    "cpu_cores",
+    "nr_throttled",
+    "memory_bytes",
+    "io_read_bytes",
+    "io_write_bytes",
+    "net_rx_bytes",
+    "net_tx_bytes",
+]
+
+# cpu.shares and cpu.weight of a cgroup without CPU reservation
+DEFAULT_CPU_SHARES = 1024
+DEFAULT_CPU_WEIGHT = 100
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (OSError, ValueError):
+        return None
+
+
+def _read_int(path: str) -> Optional[int]:
+    value = _read(path)
+    if value is None or value == "max":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _read_flat_keyed(path: str) -> Dict[str, int]:
+    """Parse a cgroup "flat keyed" file (``key value`` per line)."""
+    content = _read(path)
+    values = {}
+    if not content:
+        return values
+    for line in content.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+class CgroupReader:
+    """Read resource counters of the current container from cgroup v1 or v2.
+
+    Examples:
+        >>> reader = CgroupReader(root="/nonexistent", proc_root="/nonexistent")
+        >>> reader.version
+        0
+        >>> reader.cpu_quota() is None
+        True
+    """
+
+    def __init__(self, root: str = "/sys/fs/cgroup", proc_root: str = "/proc"):
+        self.root = root
+        self.proc_root = proc_root
+        if os.path.isfile(os.path.join(root, "cgroup.controllers")):
+            self.version = 2
+        elif os.path.isdir(os.path.join(root, "memory")) or os.path.isdir(
+            os.path.join(root, "cpuacct")
+        ):
+            self.version = 1
+        else:
+            self.version = 0
+
+    def _v1(self, *candidates: str) -> str:
+        """Return the first existing cgroup v1 path among the candidates."""
+        for candidate in candidates:
+            path = os.path.join(self.root, candidate)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.root, candidates[0])
+
+    def cpu_usage_seconds(self) -> Optional[float]:
+        """Cumulative CPU time consumed by the container, in seconds."""
+        if self.version == 2:
+            usage = _read_flat_keyed(os.path.join(self.root, "cpu.stat")).get(
+                "usage_usec"
+            )
+            return usage / 1e6 if usage is not None else None
+        if self.version == 1:
+            usage = _read_int(
+                self._v1("cpuacct/cpuacct.usage", "cpu,cpuacct/cpuacct.usage")
+            )
+            return usage / 1e9 if usage is not None else None
+        return None
+
+    def cpu_throttling(self) -> Dict[str, float]:
+        """CFS bandwidth counters: periods, throttled periods and throttled
+        time in seconds."""
+        if self.version == 2:
+            stat = _read_flat_keyed(os.path.join(self.root, "cpu.stat"))
+            return {
+                "nr_periods": stat.get("nr_periods", 0),
+                "nr_throttled": stat.get("nr_throttled", 0),
+                "throttled_seconds": stat.get("throttled_usec", 0) / 1e6,
+            }
+        if self.version == 1:
+            stat = _read_flat_keyed(self._v1("cpu/cpu.stat", "cpu,cpuacct/cpu.stat"))
+            return {
+                "nr_periods": stat.get("nr_periods", 0),
+                "nr_throttled": stat.get("nr_throttled", 0),
+                "throttled_seconds": stat.get("throttled_time", 0) / 1e9,
+            }
+        return {"nr_periods": 0, "nr_throttled": 0, "throttled_seconds": 0.0}
+
+    def cpu_quota(self) -> Optional[float]:
+        """Effective CPU quota in cores, or None when the container is not
+        limited by CFS bandwidth control."""
+        if self.version == 2:
+            content = _read(os.path.join(self.root, "cpu.max"))
+            if not content:
+                return None
+            parts = content.split()
+            if parts[0] == "max" or len(parts) != 2:
+                return None
+            return int(parts[0]) / int(parts[1])
+        if self.version == 1:
+            quota = _read_int(
+                self._v1("cpu/cpu.cfs_quota_us", "cpu,cpuacct/cpu.cfs_quota_us")
+            )
+            period = _read_int(
+                self._v1("cpu/cpu.cfs_period_us", "cpu,cpuacct/cpu.cfs_period_us")
+            )
+            if not quota or quota < 0 or not period:
+                return None
+            return quota / period
+        return None
+
+    def cpu_shares_cores(
+        self, reserved_vcpus: Optional[float] = None
+    ) -> Optional[float]:
+        """CPU reservation expressed as cores from cpu.shares / cpu.weight.
+
+        ECS translates the job vCPU into 1024 shares per vCPU when no
+        hard limit is set, which is the case for AWS Batch on EC2. The
+        default shares and weight of a cgroup without reservation are
+        ignored, see ``shares_cores``.
+        """
+        if self.version == 1:
+            shares = _read_int(self._v1("cpu/cpu.shares", "cpu,cpuacct/cpu.shares"))
+            return shares_cores(shares, reserved_vcpus)
+        if self.version == 2:
+            weight = _read_int(os.path.join(self.root, "cpu.weight"))
+            if not weight or weight == DEFAULT_CPU_WEIGHT:
+                return None
+            # cgroup v2 maps shares to weight: weight = 1 + ((shares - 2) * 9999) / 262142
+            return (((weight - 1) * 262142) / 9999 + 2) / 1024
+        return None
+
+    def memory_current(self) -> Optional[int]:
+        """Current memory usage of the container, in bytes."""
+        if self.version == 2:
+            return _read_int(os.path.join(self.root, "memory.current"))
+        if self.version == 1:
+            return _read_int(self._v1("memory/memory.usage_in_bytes"))
+        return None
+
+    def memory_peak(self) -> Optional[int]:
+        """Peak memory usage reported by the kernel, in bytes."""
+        if self.version == 2:
+            return _read_int(os.path.join(self.root, "memory.peak"))
+        if self.version == 1:
+            return _read_int(self._v1("memory/memory.max_usage_in_bytes"))
+        return None
+
+    def memory_limit(self) -> Optional[int]:
+        """Memory limit of the container, in bytes."""
+        if self.version == 2:
+            return _read_int(os.path.join(self.root, "memory.max"))
+        if self.version == 1:
+            limit = _read_int(self._v1("memory/memory.limit_in_bytes"))
+            # An unlimited cgroup v1 reports a huge page-aligned value
+            if limit is not None and limit >= 2**60:
+                return None
+            return limit
+        return None
+
+    def io_bytes(self) -> Tuple[int, int]:
+        """Cumulative block device bytes read and written."""
+        read_bytes, write_bytes = 0, 0
+        if self.version == 2:
+            content = _read(os.path.join(self.root, "io.stat")) or ""
+            for line in content.splitlines():
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        read_bytes += int(value)
+                    elif key == "wbytes":
+                        write_bytes += int(value)
+        elif self.version == 1:
+            content = _read(self._v1("blkio/blkio.throttle.io_service_bytes")) or ""
+            for line in content.splitlines():
+                parts = line.split()
+                if len(parts) != 3:
+                    continue
+                if parts[1] == "Read":
+                    read_bytes += int(parts[2])
+                elif parts[1] == "Write":
+                    write_bytes += int(parts[2])
+        return read_bytes, write_bytes
+
+    def net_bytes(self) -> Tuple[int, int]:
+        """Cumulative bytes received and transmitted on the container network
+        namespace, loopback excluded."""
+        rx_bytes, tx_bytes = 0, 0
+        content = _read(os.path.join(self.proc_root, "net", "dev")) or ""
+        for line in content.splitlines()[2:]:
+            interface, _, counters = line.partition(":")
+            if interface.strip() == "lo":
+                continue
+            values = counters.split()
+            if len(values) >= 9:
+                rx_bytes += int(values[0])
+                tx_bytes += int(values[8])
+        return rx_bytes, tx_bytes
+
+
+def shares_cores(
+    shares: Optional[int], reserved_vcpus: Optional[float] = None
+) -> Optional[float]:
+    """Convert cgroup v1 CPU shares into cores.
+
+    1024 shares are both the default of a cgroup without reservation and
+    the reservation of a 1 vCPU job: they are only trusted when the vCPU
+    reservation of the job is known to be 1.
+
+    Examples:
+        >>> shares_cores(4096)
+        4.0
+        >>> shares_cores(1024) is None
+        True
+        >>> shares_cores(1024, reserved_vcpus=1)
+        1.0
+        >>> shares_cores(2) is None
+        True
+    """
+    if not shares or shares <= 2:
+        return None
+    if shares == DEFAULT_CPU_SHARES and reserved_vcpus != 1:
+        return None
+    return shares / 1024
+
+
+@functools.lru_cache(maxsize=None)
+def reserved_vcpus(timeout: float = 1.0) -> Optional[float]:
+    """vCPU reservation of the container, from the CPU units of the ECS
+    container metadata endpoint (AWS Batch on EC2), or None if unknown.
+    Requested once: the reservation does not change during the container
+    lifetime, where the worker mode sizes many jobs."""
+    uri = os.environ.get("ECS_CONTAINER_METADATA_URI_V4")
+    if not uri:
+        return None
+    try:
+        with urllib.request.urlopen(uri, timeout=timeout) as response:  # nosec B310
+            cpu = json.load(response).get("Limits", {}).get("CPU")
+    except (OSError, ValueError) as e:
+        logger.info(f"Container metadata not available: {e}")
+        return None
+    return cpu / 1024 if cpu else None
+
+
+def effective_cpus(reader: Optional[CgroupReader] = None) -> int:
+    """Number of CPUs the container can actually use.
+
+    The CFS quota is used when set (AWS Fargate, or `--cpus`), otherwise the
+    CPU shares reservation (AWS Batch on EC2) when it differs from the
+    default, or the vCPU reservation of the container metadata, bounded by
+    the CPUs the process is allowed to run on.
+    """
+    reader = reader or CgroupReader()
+    try:
+        host_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        host_cpus = os.cpu_count() or 1
+    reserved = reserved_vcpus()
+    allocation = (
+        reader.cpu_quota() or reader.cpu_shares_cores(reserved) or reserved or host_cpus
+    )
+    return max(1, min(host_cpus, int(math.ceil(allocation))))
+
+
+class ResourceSampler(threading.Thread):
+    """Background thread sampling container resource usage at a fixed
+    interval.
+
+    Each sample is stored as a compact list following ``SAMPLE_FIELDS``.
+    CPU usage is stored as the average number of cores used since the
+    previous sample, other counters are cumulative.
+
+    Args:
+        interval (float): Seconds between two samples.
+        reader (CgroupReader): Optional reader, mainly to inject a fake
+            cgroup tree.
+        max_samples (int): Upper bound of stored samples. When reached, the
+            series is decimated by two and the interval doubled so long jobs
+            keep a bounded document size.
+    """
+
+    def __init__(
+        self,
+        interval: float = 5.0,
+        reader: Optional[CgroupReader] = None,
+        max_samples: int = 720,
+    ):
+        super().__init__(name="resource-sampler", daemon=True)
+        self.interval = interval
+        self.reader = reader or CgroupReader()
+        self.max_samples = max_samples
+        self.samples: List[list] = []
+        self.phases: List[str] = []
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._last_cpu: Optional[Tuple[float, float]] = None
+        self._peak_memory = 0
+        self._throttling_start = self.reader.cpu_throttling()
+        self._throttling_end = self._throttling_start
+        self.phase("start")
+
+    def phase(self, name: str):
+        """Tag the next samples with a job phase (download, ffmpeg,
+        upload...)."""
+        with self._lock:
+            self.phases.append(name)
+
+    def sample(self):
+        """Take one sample of all counters."""
+        now = time.monotonic()
+        cpu_usage = self.reader.cpu_usage_seconds()
+        cpu_cores = None
+        if cpu_usage is not None:
+            if self._last_cpu and now > self._last_cpu[0]:
+                cpu_cores = round(
+                    (cpu_usage - self._last_cpu[1]) / (now - self._last_cpu[0]), 3
+                )
+            self._last_cpu = (now, cpu_usage)
+        throttling = self.reader.cpu_throttling()
+        memory = self.reader.memory_current()
+        if memory:
+            self._peak_memory = max(self._peak_memory, memory)
+        io_read, io_write = self.reader.io_bytes()
+        net_rx, net_tx = self.reader.net_bytes()
+        with self._lock:
+            self._throttling_end = throttling
+            self.samples.append(
+                [
+                    round(now - self._start_time, 2),
+                    len(self.phases) - 1,
+                    cpu_cores,
+                    throttling["nr_throttled"],
+                    memory,
+                    io_read,
+                    io_write,
+                    net_rx,
+                    net_tx,
+                ]
+            )
+            if len(self.samples) >= self.max_samples:
+                self.samples = self.samples[::2]
+                self.interval *= 2
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Resource sampling failed: {e}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> dict:
+        """Stop the sampler, take a last sample and return the summary."""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=self.interval + 1)
+        try:
+            self.sample()
+        except Exception as e:
+            logger.warning(f"Resource sampling failed: {e}")
+        return self.summary()
+
+    def summary(self) -> dict:
+        """Return peaks, totals and the time series of the sampled job."""
+        with self._lock:
+            samples = list(self.samples)
+            phases = list(self.phases)
+        cpu_values = [s[2] for s in samples if s[2] is not None]
+        duration = samples[-1][0] if samples else 0.0
+        cpu_limit = self.reader.cpu_quota() or self.reader.cpu_shares_cores()
+        memory_limit = self.reader.memory_limit()
+        memory_peak = max(self.reader.memory_peak() or 0, self._peak_memory)
+        first, last = (samples[0], samples[-1]) if samples else ([0] * 9, [0] * 9)
+
+        peaks = {
+            "cpu_cores": max(cpu_values) if cpu_values else None,
+            "memory_bytes": memory_peak or None,
+        }
+        totals = {
+            "duration_seconds": duration,
+            "cpu_cores_avg": (
+                round(sum(cpu_values) / len(cpu_values), 3) if cpu_values else None
+            ),
+            "nr_throttled": self._throttling_end["nr_throttled"]
+            - self._throttling_start["nr_throttled"],
+            "throttled_seconds": round(
+                self._throttling_end["throttled_seconds"]
+                - self._throttling_start["throttled_seconds"],
+                3,
+            ),
+            "io_read_bytes": last[5] - first[5],
+            "io_write_bytes": last[6] - first[6],
+            "net_rx_bytes": last[7] - first[7],
+            "net_tx_bytes": last[8] - first[8],
+        }
+        limits = {
+            "cpu_cores": cpu_limit,
+            "memory_bytes": memory_limit,
+            "host_cpus": os.cpu_count(),
+        }
+        return {
+            "cgroup_version": self.reader.version,
+            "interval": self.interval,
+            "limits": limits,
+            "peaks": peaks,
+            "totals": totals,
+            "bound": classify_bottleneck(peaks, totals, limits),
+            "phases": phases,
+            "fields": SAMPLE_FIELDS,
+            "samples": samples,
+        }
+
+
+def classify_bottleneck(peaks: dict, totals: dict, limits: dict) -> str:
+    """Give a coarse hint of the resource limiting the job.
+
+    Returns one of ``memory``, ``cpu``, ``io``, ``balanced`` or
+    ``unknown``. The job is
+    considered memory-bound above 90% of its memory limit, CPU-bound when
+    it averages 80% of its CPU allocation or spends more than 20% of its
+    duration throttled, and I/O-bound when it averages under 50% of its CPU
+    allocation (the job mostly waits for data).
+
+    Examples:
+        >>> classify_bottleneck({"memory_bytes": 95}, {"cpu_cores_avg": 1.0,
+        ...     "duration_seconds": 10, "throttled_seconds": 0},
+        ...     {"memory_bytes": 100, "cpu_cores": 2})
+        'memory'
+        >>> classify_bottleneck({"memory_bytes": 10}, {"cpu_cores_avg": 1.9,
+        ...     "duration_seconds": 10, "throttled_seconds": 0},
+        ...     {"memory_bytes": 100, "cpu_cores": 2})
+        'cpu'
+        >>> classify_bottleneck({"memory_bytes": 10}, {"cpu_cores_avg": 0.2,
+        ...     "duration_seconds": 10, "throttled_seconds": 0},
+        ...     {"memory_bytes": 100, "cpu_cores": 2})
+        'io'
+    """
+    memory_peak, memory_limit = peaks.get("memory_bytes"), limits.get("memory_bytes")
+    if memory_peak and memory_limit and memory_peak / memory_limit >= 0.9:
+        return "memory"
+    cpu_avg = totals.get("cpu_cores_avg")
+    cpu_limit = limits.get("cpu_cores") or limits.get("host_cpus")
+    duration = totals.get("duration_seconds") or 0
+    if duration and totals.get("throttled_seconds", 0) / duration > 0.2:
+        return "cpu"
+    if cpu_avg is None or not cpu_limit:
+        return "unknown"
+    if cpu_avg / cpu_limit >= 0.8:
+        return "cpu"
+    if cpu_avg / cpu_limit < 0.5:
+        return "io"
+    return "balanced"
@@ -0,0 +1,578 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Analysis and rewriting of ffmpeg command options.
+
+Options are handled as token lists (``shlex.split`` of the global, input
+and output options submitted to the wrapper). Every rewrite returns new
+lists and a dictionary describing what was changed, so the wrapper can log
+it and report it to AWS X-Ray.
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+VIDEO_CODEC_OPTIONS = ["-c:v", "-codec:v", "-vcodec", "-c", "-codec"]
+AUDIO_CODEC_OPTIONS = ["-c:a", "-codec:a", "-acodec", "-c", "-codec"]
+
+# Encoder private options controlling the encoder thread pool
+ENCODER_THREAD_PARAMS = {
+    "libx264": ("-x264-params", "threads"),
+    "libx265": ("-x265-params", "pools"),
+    "libsvtav1": ("-svtav1-params", "lp"),
+}
+
+
+def _matches(token: str, names: List[str]) -> bool:
+    """Check if a token is one of the option names, including stream
+    specifiers (``-c:v:0`` matches ``-c:v``, ``-c:a`` does not match
+    ``-c``)."""
+    for name in names:
+        if token == name:
+            return True
+        if token.startswith(name + ":"):
+            specifier = token[len(name) + 1 :]
+            if ":" in name or specifier[:1] not in "vVasdt":
+                return True
+    return False
+
+
+def option_values(tokens: List[str], names: List[str]) -> List[str]:
+    """Return the values of all occurrences of the options.
+
+    Examples:
+        >>> option_values(["-c:v", "libx264", "-c:a", "aac"], VIDEO_CODEC_OPTIONS)
+        ['libx264']
+        >>> option_values(["-c", "copy"], AUDIO_CODEC_OPTIONS)
+        ['copy']
+    """
+    return [
+        tokens[i + 1] for i, token in enumerate(tokens[:-1]) if _matches(token, names)
+    ]
+
+
+def has_option(tokens: List[str], *names: str) -> bool:
+    """Check if one of the options is set.
+
+    Examples:
+        >>> has_option(["-threads", "4"], "-threads")
+        True
+        >>> has_option(["-c:v", "libx264"], "-threads")
+        False
+    """
+    return any(_matches(token, list(names)) for token in tokens)
+
+
+def set_option(tokens: List[str], name: str, value: str) -> List[str]:
+    """Return the tokens with the option value replaced, or appended when
+    the option is not set."""
+    tokens = list(tokens)
+    for i, token in enumerate(tokens[:-1]):
+        if token == name:
+            tokens[i + 1] = value
+            return tokens
+    return tokens + [name, value]
+
+
+def video_encoders(tokens: List[str]) -> List[str]:
+    """Return the video encoders selected in the output options."""
+    return option_values(tokens, VIDEO_CODEC_OPTIONS)
+
+
+def audio_encoders(tokens: List[str]) -> List[str]:
+    """Return the audio encoders selected in the output options."""
+    return option_values(tokens, AUDIO_CODEC_OPTIONS)
+
+
+def merge_private_params(
+    tokens: List[str], option: str, key: str, value: str
+) -> Tuple[List[str], bool]:
+    """Add ``key=value`` to a ``key=value:key=value`` encoder private option
+    (``-x264-params``...) unless the key is already set.
+
+    Examples:
+        >>> merge_private_params(["-x264-params", "ref=4"], "-x264-params", "threads", "2")
+        (['-x264-params', 'ref=4:threads=2'], True)
+        >>> merge_private_params(["-x264-params", "threads=8"], "-x264-params", "threads", "2")
+        (['-x264-params', 'threads=8'], False)
+        >>> merge_private_params([], "-x265-params", "pools", "2")
+        (['-x265-params', 'pools=2'], True)
+    """
+    tokens = list(tokens)
+    for i, token in enumerate(tokens[:-1]):
+        if token == option:
+            params = [p for p in tokens[i + 1].split(":") if p]
+            if any(p.split("=")[0] == key for p in params):
+                return tokens, False
+            tokens[i + 1] = ":".join(params + [f"{key}={value}"])
+            return tokens, True
+    return tokens + [option, f"{key}={value}"], True
+
+
+def tune_threads(
+    global_tokens: List[str],
+    input_tokens: List[str],
+    output_tokens: List[str],
+    threads: int,
+) -> Tuple[List[str], List[str], List[str], Dict[str, str]]:
+    """Size ffmpeg decoder, filter and encoder threads to the CPU allocation
+    of the container instead of the host core count.
+
+    Options already set by the user are kept.
+
+    Examples:
+        >>> g, i, o, changes = tune_threads([], [], ["-c:v", "libx265"], 2)
+        >>> g, i, o
+        (['-filter_threads', '2'], ['-threads', '2'], ['-threads', '2', '-c:v', 'libx265', '-x265-params', 'pools=2'])
+        >>> tune_threads(["-filter_threads", "8"], ["-threads", "1"], ["-threads", "4"], 2)[3]
+        {}
+    """
+    changes = {}
+    value = str(threads)
+    if not has_option(global_tokens, "-filter_threads"):
+        global_tokens = global_tokens + ["-filter_threads", value]
+        changes["-filter_threads"] = value
+    if has_option(global_tokens + output_tokens, "-filter_complex") and not has_option(
+        global_tokens, "-filter_complex_threads"
+    ):
+        global_tokens = global_tokens + ["-filter_complex_threads", value]
+        changes["-filter_complex_threads"] = value
+    if not has_option(input_tokens, "-threads"):
+        input_tokens = ["-threads", value] + input_tokens
+        changes["input -threads"] = value
+    if not has_option(output_tokens, "-threads"):
+        output_tokens = ["-threads", value] + output_tokens
+        changes["output -threads"] = value
+    for encoder in video_encoders(output_tokens):
+        if encoder in ENCODER_THREAD_PARAMS:
+            option, key = ENCODER_THREAD_PARAMS[encoder]
+            output_tokens, changed = merge_private_params(
+                output_tokens, option, key, value
+            )
+            if changed:
+                changes[option] = f"{key}={value}"
+    return global_tokens, input_tokens, output_tokens, changes
+
+
+# CPU encoders with an NVENC equivalent
+NVENC_ENCODERS = {"libx264": "h264_nvenc", "libx265": "hevc_nvenc"}
+
+# x264/x265 presets to NVENC presets (p1 fastest, p7 slowest)
+NVENC_PRESETS = {
+    "ultrafast": "p1",
+    "superfast": "p1",
+    "veryfast": "p2",
+    "faster": "p3",
+    "fast": "p4",
+    "medium": "p4",
+    "slow": "p5",
+    "slower": "p6",
+    "veryslow": "p7",
+    "placebo": "p7",
+}
+
+# Filters accepting CUDA frames: CPU filter -> CUDA filter (None if unchanged)
+CUDA_FILTERS = {
+    "scale": "scale_cuda",
+    "yadif": "yadif_cuda",
+    "bwdif": "bwdif_cuda",
+    "fps": None,
+    "setpts": None,
+    "setsar": None,
+    "null": None,
+}
+
+# Named options of the CPU scale filter supported by scale_cuda and scale_npp
+CUDA_SCALE_OPTIONS = ["w", "h", "width", "height", "force_original_aspect_ratio"]
+GPU_SCALERS = ["scale_cuda", "scale_npp"]
+
+VIDEO_FILTER_OPTIONS = ["-vf", "-filter:v"]
+# Output options inserting CPU filters or changing the frames after them
+CPU_FRAME_OPTIONS = ["-s", "-aspect"]
+
+# Pixel formats decoded by NVDEC into CUDA frames, by input codec
+NVDEC_PIX_FMTS = {
+    "h264": ["yuv420p", "yuvj420p"],
+    "hevc": ["yuv420p", "yuvj420p", "yuv420p10le"],
+    "av1": ["yuv420p", "yuv420p10le"],
+    "vp9": ["yuv420p", "yuv420p10le"],
+    "vp8": ["yuv420p"],
+    "mpeg2video": ["yuv420p"],
+    "mpeg4": ["yuv420p"],
+    "vc1": ["yuv420p"],
+}
+# Pixel formats of CUDA frames encoded by NVENC, by encoder
+NVENC_PIX_FMTS = {
+    "h264_nvenc": ["yuv420p", "yuvj420p"],
+    "hevc_nvenc": ["yuv420p", "yuvj420p", "yuv420p10le"],
+}
+
+
+def cuda_filters(filtergraph: str, scaler: str = "scale_cuda") -> str:
+    """Translate a simple video filter chain to CUDA filters.
+
+    Raises:
+        ValueError: If a filter has no CUDA equivalent.
+
+    Examples:
+        >>> cuda_filters("yadif,scale=1280:-2")
+        'yadif_cuda,scale_cuda=1280:-2'
+        >>> cuda_filters("scale=w=640:h=360", scaler="scale_npp")
+        'scale_npp=w=640:h=360'
+        >>> cuda_filters("scale=1280:720:flags=lanczos")
+        Traceback (most recent call last):
+        ...
+        ValueError: scale option flags not supported on CUDA frames
+    """
+    if any(c in filtergraph for c in "[];'\\"):
+        raise ValueError(f"filtergraph {filtergraph} not supported on CUDA frames")
+    filters = []
+    for video_filter in filtergraph.split(","):
+        name, _, arguments = video_filter.partition("=")
+        if name not in CUDA_FILTERS:
+            raise ValueError(f"filter {name} not supported on CUDA frames")
+        if name == "scale":
+            for argument in arguments.split(":"):
+                key, equal, _ = argument.partition("=")
+                if equal and key not in CUDA_SCALE_OPTIONS:
+                    raise ValueError(f"scale option {key} not supported on CUDA frames")
+        cuda_name = scaler if name == "scale" else CUDA_FILTERS[name] or name
+        filters.append(f"{cuda_name}={arguments}" if arguments else cuda_name)
+    return ",".join(filters)
+
+
+def _nvenc_options(output_tokens: List[str]) -> Tuple[List[str], Dict[str, str]]:
+    """Map the CPU encoder options of the output to NVENC options."""
+    tokens, changes = [], {}
+    i = 0
+    while i < len(output_tokens):
+        token = output_tokens[i]
+        value = output_tokens[i + 1] if i + 1 < len(output_tokens) else None
+        if (
+            value is not None
+            and _matches(token, VIDEO_CODEC_OPTIONS)
+            and (value in NVENC_ENCODERS)
+        ):
+            tokens += [token, NVENC_ENCODERS[value]]
+            changes[token] = f"{value} -> {NVENC_ENCODERS[value]}"
+        elif (
+            value is not None
+            and _matches(token, ["-preset"])
+            and (value in NVENC_PRESETS)
+        ):
+            tokens += [token, NVENC_PRESETS[value]]
+            changes[token] = f"{value} -> {NVENC_PRESETS[value]}"
+        elif value is not None and _matches(token, ["-crf"]):
+            tokens += ["-rc", "vbr", "-cq", value, "-b:v", "0"]
+            changes[token] = f"{value} -> -rc vbr -cq {value} -b:v 0"
+        elif value is not None and token in ["-tune", "-x264-params", "-x265-params"]:
+            changes[token] = f"{value} -> removed"
+        else:
+            tokens.append(token)
+            i += 1
+            continue
+        i += 2
+    return tokens, changes
+
+
+def nvdec_fallback(media: Optional[dict], encoders: List[str]) -> Optional[str]:
+    """Return why the input must be decoded on the CPU, None if NVDEC decodes
+    it into CUDA frames the NVENC encoders accept or if it was not probed.
+
+    Examples:
+        >>> nvdec_fallback({"video": [{"codec_name": "h264", "pix_fmt": "yuv420p"}]}, ["h264_nvenc"])
+        >>> nvdec_fallback({"video": [{"codec_name": "h264", "pix_fmt": "yuv420p10le"}]}, ["hevc_nvenc"])
+        'h264 yuv420p10le not decoded by NVDEC'
+        >>> nvdec_fallback({"video": [{"codec_name": "hevc", "pix_fmt": "yuv420p10le"}]}, ["h264_nvenc"])
+        'yuv420p10le CUDA frames not encoded by h264_nvenc'
+        >>> nvdec_fallback({"video": [{"codec_name": "prores", "pix_fmt": "yuv422p10le"}]}, ["hevc_nvenc"])
+        'prores yuv422p10le not decoded by NVDEC'
+    """
+    video = (media or {}).get("video") or []
+    if not video:
+        return None
+    codec, pix_fmt = video[0].get("codec_name"), video[0].get("pix_fmt")
+    if pix_fmt not in NVDEC_PIX_FMTS.get(codec, []):
+        return f"{codec} {pix_fmt} not decoded by NVDEC"
+    for encoder in encoders:
+        if encoder in NVENC_PIX_FMTS and pix_fmt not in NVENC_PIX_FMTS[encoder]:
+            return f"{pix_fmt} CUDA frames not encoded by {encoder}"
+    return None
+
+
+def gpu_pipeline(
+    global_tokens: List[str],
+    input_tokens: List[str],
+    output_tokens: List[str],
+    scaler: str = "scale_cuda",
+    media: Optional[dict] = None,
+) -> Tuple[List[str], List[str], List[str], Dict[str, str]]:
+    """Rewrite a CPU command to decode, filter and encode on an NVIDIA GPU.
+
+    x264/x265 encoders and their presets are replaced with NVENC, and the
+    frames stay in GPU memory (``-hwaccel cuda -hwaccel_output_format
+    cuda``) when every video filter has a CUDA equivalent (the scale filter
+    is replaced with ``scaler``) and the probed input (``media``) is decoded
+    by NVDEC. Otherwise, the decoding and the filters stay on the CPU and
+    only the encoder moves to the GPU. Commands already using hardware
+    acceleration, or without x264 or x265 encoder, are not changed.
+
+    Examples:
+        >>> g, i, o, changes = gpu_pipeline(
+        ...     [], [], ["-vf", "scale=1280:720", "-c:v", "libx264", "-preset", "slow"])
+        >>> i, o
+        (['-hwaccel', 'cuda', '-hwaccel_output_format', 'cuda'], ['-vf', 'scale_cuda=1280:720', '-c:v', 'h264_nvenc', '-preset', 'p5'])
+        >>> changes["pipeline"]
+        'gpu'
+        >>> gpu_pipeline([], [], ["-vf", "drawtext=text=a", "-c:v", "libx265"], "scale_cuda")[2]
+        ['-vf', 'drawtext=text=a', '-c:v', 'hevc_nvenc']
+        >>> gpu_pipeline([], [], ["-s", "1280x720", "-c:v", "libx264"])[3]["pipeline"]
+        'cpu (-s not supported on CUDA frames)'
+        >>> media = {"video": [{"codec_name": "h264", "pix_fmt": "yuv420p10le"}]}
+        >>> gpu_pipeline([], [], ["-c:v", "libx265"], media=media)[3]["pipeline"]
+        'cpu (h264 yuv420p10le not decoded by NVDEC)'
+        >>> gpu_pipeline([], [], ["-c:v", "libsvtav1"])[3]
+        {}
+    """
+    if scaler not in GPU_SCALERS:
+        raise ValueError(f"GPU scaler {scaler} not in {GPU_SCALERS}")
+    changes = {}
+    if has_option(global_tokens + input_tokens, "-hwaccel") or not any(
+        encoder in NVENC_ENCODERS for encoder in video_encoders(output_tokens)
+    ):
+        return global_tokens, input_tokens, output_tokens, changes
+
+    output_tokens, changes = _nvenc_options(output_tokens)
+
+    fallback = None
+    if has_option(global_tokens + output_tokens, "-filter_complex", "-lavfi"):
+        fallback = "-filter_complex not supported on CUDA frames"
+    for option in ["-pix_fmt"] + CPU_FRAME_OPTIONS:
+        if not fallback and has_option(output_tokens, option):
+            fallback = f"{option} not supported on CUDA frames"
+    fallback = fallback or nvdec_fallback(media, video_encoders(output_tokens))
+    if not fallback:
+        filtered = []
+        for i, token in enumerate(output_tokens):
+            if i > 0 and output_tokens[i - 1] in VIDEO_FILTER_OPTIONS:
+                try:
+                    token = cuda_filters(token, scaler)
+                except ValueError as e:
+                    fallback = str(e)
+                    break
+                changes[output_tokens[i - 1]] = f"{output_tokens[i]} -> {token}"
+            filtered.append(token)
+        else:
+            output_tokens = filtered
+
+    if fallback:
+        logger.info(f"Decoding and filters kept on CPU: {fallback}")
+        for option in VIDEO_FILTER_OPTIONS:
+            changes.pop(option, None)
+        changes["pipeline"] = f"cpu ({fallback})"
+    else:
+        input_tokens = [
+            "-hwaccel",
+            "cuda",
+            "-hwaccel_output_format",
+            "cuda",
+        ] + input_tokens
+        changes["-hwaccel"] = "cuda"
+        changes["pipeline"] = "gpu"
+    return global_tokens, input_tokens, output_tokens, changes
+
+
+# Encoders producing a bitstream of the codec reported by ffprobe
+ENCODER_CODECS = {
+    "libx264": "h264",
+    "h264_nvenc": "h264",
+    "libx265": "hevc",
+    "hevc_nvenc": "hevc",
+    "libsvtav1": "av1",
+    "libaom-av1": "av1",
+    "av1_nvenc": "av1",
+    "libvpx-vp9": "vp9",
+    "aac": "aac",
+    "libfdk_aac": "aac",
+    "libmp3lame": "mp3",
+    "libopus": "opus",
+    "ac3": "ac3",
+    "eac3": "eac3",
+    "flac": "flac",
+}
+
+# Codecs accepted by the output containers, and their default encoders
+CONTAINER_CODECS = {
+    ".mp4": {
+        "video": ["h264", "hevc", "av1"],
+        "audio": ["aac", "mp3", "ac3", "eac3", "opus", "flac"],
+    },
+    ".m4v": {"video": ["h264", "hevc"], "audio": ["aac", "ac3", "eac3"]},
+    ".mov": {
+        "video": ["h264", "hevc", "prores"],
+        "audio": ["aac", "mp3", "ac3", "eac3", "pcm_s16le", "pcm_s24le"],
+    },
+    ".mkv": {
+        "video": ["h264", "hevc", "av1", "vp9", "prores"],
+        "audio": ["aac", "mp3", "ac3", "eac3", "opus", "flac", "vorbis"],
+    },
+    ".ts": {"video": ["h264", "hevc"], "audio": ["aac", "mp3", "ac3", "eac3"]},
+    ".webm": {"video": ["vp9", "av1"], "audio": ["opus", "vorbis"]},
+    ".m4a": {"video": [], "audio": ["aac", "alac"]},
+}
+CONTAINER_DEFAULT_CODECS = {
+    ".mp4": ("h264", "aac"),
+    ".m4v": ("h264", "aac"),
+    ".mov": ("h264", "aac"),
+    ".m4a": (None, "aac"),
+}
+
+# Output options without value
+FLAG_OPTIONS = ["-vn", "-an", "-sn", "-dn", "-y", "-n"]
+# Output options kept with a stream copy
+COPY_OPTIONS = [
+    "-map",
+    "-map_metadata",
+    "-map_chapters",
+    "-metadata",
+    "-movflags",
+    "-f",
+    "-disposition",
+    "-tag",
+]
+# Output options only changing the speed of the encoders, dropped with a
+# stream copy. Rate control (-crf, -b:v), GOP (-g, -bf) and codec parameters
+# (-x264-params...) change the bitstream and keep the re-encode.
+ENCODER_ONLY_OPTIONS = ["-preset", "-tune", "-threads"]
+# Global options kept with a stream copy, without value and with a value.
+# Options before the first input (-ss, -t, -r...) apply to the input and
+# would cut or retime the copied streams.
+GLOBAL_FLAG_OPTIONS = [
+    "-y",
+    "-n",
+    "-hide_banner",
+    "-nostdin",
+    "-stats",
+    "-nostats",
+    "-benchmark",
+    "-report",
+]
+GLOBAL_COPY_OPTIONS = ["-loglevel", "-v", "-progress", "-stats_period"]
+
+
+def _option_pairs(
+    tokens: List[str], flags: List[str] = FLAG_OPTIONS
+) -> List[Tuple[str, Optional[str]]]:
+    """Split option tokens into ``(option, value)`` pairs."""
+    pairs, i = [], 0
+    while i < len(tokens):
+        if tokens[i] in flags or i + 1 == len(tokens):
+            pairs.append((tokens[i], None))
+            i += 1
+        else:
+            pairs.append((tokens[i], tokens[i + 1]))
+            i += 2
+    return pairs
+
+
+def stream_copy(
+    global_tokens: List[str],
+    input_tokens: List[str],
+    output_tokens: List[str],
+    media: dict,
+    output_path: str,
+) -> Tuple[List[str], Dict[str, str]]:
+    """Replace a re-encode with a stream copy (remux) when the input streams
+    already have the requested codecs and parameters.
+
+    Args:
+        media (dict): ``ffprobe.media_summary`` of the single input.
+        output_path (str): Output file, its extension gives the container.
+
+    Returns:
+        Tuple[List[str], Dict[str, str]]: The output options, and the
+        changes (empty when the command is kept), with the reason in
+        ``"stream_copy"``.
+
+    Examples:
+        >>> media = {"video": [{"codec_name": "h264", "pix_fmt": "yuv420p"}],
+        ...          "audio": [{"codec_name": "aac"}], "subtitle": []}
+        >>> stream_copy([], [], ["-c:v", "libx264", "-preset", "slow", "-c:a", "aac"], media, "out.mp4")
+        (['-c', 'copy'], {'-c:v': 'libx264 -> copy', '-preset': 'slow -> removed', '-c:a': 'aac -> copy', 'stream_copy': 'yes'})
+        >>> stream_copy([], [], ["-c:v", "libx265"], media, "out.mp4")[1]
+        {'stream_copy': 'no (video h264 -> hevc)'}
+        >>> stream_copy([], [], ["-vf", "scale=640:-2"], media, "out.mp4")[1]
+        {'stream_copy': 'no (option -vf)'}
+        >>> stream_copy([], [], ["-c:v", "libx264", "-crf", "18", "-c:a", "aac"], media, "out.mp4")[1]
+        {'stream_copy': 'no (option -crf)'}
+        >>> stream_copy(["-y", "-loglevel", "error", "-ss", "10"], [], ["-c:v", "libx264"], media, "out.mp4")[1]
+        {'stream_copy': 'no (global option -ss)'}
+    """
+
+    def keep(reason: str) -> Tuple[List[str], Dict[str, str]]:
+        return output_tokens, {"stream_copy": f"no ({reason})"}
+
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in CONTAINER_CODECS or "%" in output_path:
+        return keep(f"output {extension or output_path}")
+    for option, _ in _option_pairs(global_tokens, GLOBAL_FLAG_OPTIONS):
+        if option not in GLOBAL_FLAG_OPTIONS + GLOBAL_COPY_OPTIONS:
+            return keep(f"global option {option}")
+    # Input seeking and rate options would cut or retime the copied streams
+    if any(option != "-threads" for option, _ in _option_pairs(input_tokens)):
+        return keep("input options")
+
+    default_video, default_audio = CONTAINER_DEFAULT_CODECS.get(extension, (None, None))
+    requested = {"video": default_video, "audio": default_audio}
+    kept, changes = [], {}
+    video, audio = True, True
+    for option, value in _option_pairs(output_tokens):
+        if option == "-vn":
+            video = False
+        elif option == "-an":
+            audio = False
+        name = option.split(":")[0]
+        if option in FLAG_OPTIONS or name in COPY_OPTIONS:
+            kept += [option] if value is None else [option, value]
+            continue
+        if name in ENCODER_ONLY_OPTIONS:
+            changes[option] = f"{value} -> removed"
+            continue
+        video_codec = _matches(option, VIDEO_CODEC_OPTIONS)
+        audio_codec = _matches(option, AUDIO_CODEC_OPTIONS)
+        if not (video_codec or audio_codec):
+            if name == "-pix_fmt" and all(
+                stream.get("pix_fmt") == value for stream in media.get("video", [])
+            ):
+                changes[option] = f"{value} -> removed"
+                continue
+            return keep(f"option {option}")
+        codec = "copy" if value == "copy" else ENCODER_CODECS.get(value)
+        if codec is None:
+            return keep(f"encoder {value}")
+        if video_codec:
+            requested["video"] = codec
+        if audio_codec:
+            requested["audio"] = codec
+        changes[option] = f"{value} -> copy"
+
+    for stream_type, enabled in [("video", video), ("audio", audio)]:
+        if not enabled:
+            continue
+        for stream in media.get(stream_type, []):
+            codec = stream.get("codec_name")
+            if requested[stream_type] is None:
+                return keep(f"{stream_type} encoder not set")
+            if requested[stream_type] not in ["copy", codec]:
+                return keep(f"{stream_type} {codec} -> {requested[stream_type]}")
+            if codec not in CONTAINER_CODECS[extension][stream_type]:
+                return keep(f"{stream_type} {codec} in {extension}")
+    if media.get("subtitle") and "-sn" not in output_tokens and extension != ".mkv":
+        return keep(f"subtitles in {extension}")
+
+    changes["stream_copy"] = "yes"
+    return kept + ["-c", "copy"], changes
@@ -0,0 +1,170 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Media inspection with ffprobe.
+
+This module runs ffprobe on a local path or an HTTP(S) URL (e.g. an S3
+presigned URL, so only the container headers are read) and summarizes
+the streams in a small dictionary used to take decisions before running
+ffmpeg.
+"""
+
+import json
+import logging
+import os
+import subprocess  # nosec B404
+from typing import Optional
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+FFPROBE = os.environ.get("FFPROBE_PATH", "ffprobe")
+
+
+def probe(source: str, ffprobe: str = FFPROBE, timeout: int = 60) -> dict:
+    """Run ffprobe and return its JSON output.
+
+    Args:
+        source (str): Local path or HTTP(S) URL of the media.
+        ffprobe (str): The ffprobe executable.
+        timeout (int): Timeout of the ffprobe execution in seconds.
+
+    Returns:
+        dict: The ``format`` and ``streams`` sections of ffprobe.
+
+    Raises:
+        subprocess.CalledProcessError: If ffprobe fails.
+    """
+    command_list = [
+        ffprobe,
+        "-v",
+        "error",
+        "-print_format",
+        "json",
+        "-show_format",
+        "-show_streams",
+        source,
+    ]
+    result = subprocess.run(  # nosec B603
+        command_list, capture_output=True, text=True, timeout=timeout
+    )
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(
+            returncode=result.returncode, cmd=command_list, stderr=result.stderr
+        )
+    return json.loads(result.stdout or "{}")
+
+
+def _int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate(value) -> Optional[float]:
+    """Convert an ffprobe rational (``30000/1001``) to a float."""
+    if not value or "/" not in value:
+        return _float(value)
+    num, _, den = value.partition("/")
+    try:
+        return round(int(num) / int(den), 3) if int(den) else None
+    except ValueError:
+        return None
+
+
+def media_summary(probe_result: dict) -> dict:
+    """Summarize an ffprobe result.
+
+    Examples:
+        >>> summary = media_summary({
+        ...     "format": {"format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+        ...                "duration": "60.0", "size": "1000"},
+        ...     "streams": [
+        ...         {"codec_type": "video", "codec_name": "h264", "width": 1920,
+        ...          "height": 1080, "avg_frame_rate": "30000/1001"},
+        ...         {"codec_type": "audio", "codec_name": "aac", "channels": 2},
+        ...     ]})
+        >>> summary["video"][0]["height"], summary["video"][0]["fps"]
+        (1080, 29.97)
+        >>> summary["audio"][0]["codec_name"], summary["duration"]
+        ('aac', 60.0)
+    """
+    media_format = probe_result.get("format", {})
+    summary = {
+        "format_name": media_format.get("format_name"),
+        "duration": _float(media_format.get("duration")),
+        "size": _int(media_format.get("size")),
+        "bit_rate": _int(media_format.get("bit_rate")),
+        "video": [],
+        "audio": [],
+        "subtitle": [],
+        "data": [],
+    }
+    for stream in probe_result.get("streams", []):
+        codec_type = stream.get("codec_type")
+        if codec_type == "video":
+            # Cover art is reported as a video stream
+            if stream.get("disposition", {}).get("attached_pic"):
+                continue
+            summary["video"].append(
+                {
+                    "index": stream.get("index"),
+                    "codec_name": stream.get("codec_name"),
+                    "profile": stream.get("profile"),
+                    "pix_fmt": stream.get("pix_fmt"),
+                    "width": _int(stream.get("width")),
+                    "height": _int(stream.get("height")),
+                    "fps": _rate(stream.get("avg_frame_rate"))
+                    or _rate(stream.get("r_frame_rate")),
+                    "bit_rate": _int(stream.get("bit_rate")),
+                    "codec_tag_string": stream.get("codec_tag_string"),
+                }
+            )
+        elif codec_type == "audio":
+            summary["audio"].append(
+                {
+                    "index": stream.get("index"),
+                    "codec_name": stream.get("codec_name"),
+                    "profile": stream.get("profile"),
+                    "channels": _int(stream.get("channels")),
+                    "sample_rate": _int(stream.get("sample_rate")),
+                    "bit_rate": _int(stream.get("bit_rate")),
+                }
+            )
+        elif codec_type in ["subtitle", "data"]:
+            summary[codec_type].append(
+                {"index": stream.get("index"), "codec_name": stream.get("codec_name")}
+            )
+    return summary
+
+
+def resolution_class(summary: dict) -> str:
+    """Classify the media by its largest video stream.
+
+    Examples:
+        >>> resolution_class({"video": [{"width": 3840, "height": 2160}]})
+        'uhd'
+        >>> resolution_class({"video": [], "audio": [{"codec_name": "aac"}]})
+        'audio'
+    """
+    if not summary.get("video"):
+        return "audio" if summary.get("audio") else "unknown"
+    pixels = max(
+        (stream.get("width") or 0) * (stream.get("height") or 0)
+        for stream in summary["video"]
+    )
+    if pixels > 2560 * 1440:
+        return "uhd"
+    if pixels > 1280 * 720:
+        return "fhd"
+    if pixels > 720 * 576:
+        return "hd"
+    return "sd"
@@ -0,0 +1,209 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Content-addressed cache of S3 inputs shared by the containers of a host.
+
+Objects are stored once per bucket, key and ETag in a directory mounted from
+the host, so jobs of the same instance processing the same source (several
+renditions, thumbnails, audio tracks...) download it only once.
+
+Concurrent jobs are coordinated with ``flock`` locks:
+
+- the first job requesting an object holds an exclusive lock on the entry
+  while downloading it, the others wait for it and reuse the file;
+- every job holds a shared "use" lock on the entries it reads until it
+  ends, so the eviction never removes a file being read;
+- the least recently used entries are evicted when the cache exceeds its
+  byte budget.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+from shared_libraries.aws_s3 import S3Url
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+STATS_FIELDS = [
+    "hits",
+    "misses",
+    "bytes_downloaded",
+    "bytes_from_cache",
+    "evicted_files",
+    "evicted_bytes",
+]
+
+
+def entry_id(bucket: str, key: str, etag: str) -> str:
+    """Return the cache entry identifier of an object version.
+
+    Examples:
+        >>> entry_id("bucket", "a/b.mp4", '"abc"') == entry_id("bucket", "a/b.mp4", "abc")
+        True
+        >>> entry_id("bucket", "a/b.mp4", "abc") == entry_id("bucket", "a/b.mp4", "abd")
+        False
+    """
+    version = f"{bucket}/{key}/{etag.strip(chr(34))}"
+    return hashlib.sha256(version.encode()).hexdigest()
+
+
+class InputCache:
+    """Host-level cache of S3 objects.
+
+    Args:
+        root (str): Cache directory, mounted from the host.
+        max_bytes (int): Byte budget of the cache.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = {field: 0 for field in STATS_FIELDS}
+        self._held = []
+        self._mutex = threading.Lock()
+        for directory in ["objects", "locks"]:
+            os.makedirs(os.path.join(root, directory), exist_ok=True)
+
+    def _paths(self, entry: str, key: str):
+        extension = os.path.splitext(key)[1]
+        return (
+            os.path.join(self.root, "objects", entry[:2], entry + extension),
+            os.path.join(self.root, "locks", entry + ".lock"),
+            os.path.join(self.root, "locks", entry + ".use"),
+        )
+
+    def _count(self, **increments):
+        with self._mutex:
+            for field, value in increments.items():
+                self.stats[field] += value
+
+    def fetch(self, s3_client, s3_url: str, head: Optional[dict] = None) -> str:
+        """Return the local path of an S3 object, downloading it if it is not
+        cached yet.
+
+        ``head`` is the HEAD response of the object (``ETag`` and
+        ``ContentLength``) if the caller already requested it. The entry
+        stays locked against eviction until ``close``.
+        """
+        parse = S3Url(s3_url)
+        head = head or s3_client.head_object(Bucket=parse.bucket, Key=parse.key)
+        etag, size = head["ETag"], head["ContentLength"]
+        entry = entry_id(parse.bucket, parse.key, etag)
+        path, lock_path, use_path = self._paths(entry, parse.key)
+
+        # Shared lock held while the job reads the file, against eviction
+        use = open(use_path, "a+")
+        try:
+            fcntl.flock(use, fcntl.LOCK_SH)
+            # Exclusive lock held while the file is checked or downloaded
+            with open(lock_path, "a+") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.isfile(path) and os.path.getsize(path) == size:
+                    logger.info(f"Input cache hit: {s3_url} ({path})")
+                    os.utime(path)
+                    self._count(hits=1, bytes_from_cache=size)
+                else:
+                    logger.info(f"Input cache miss: {s3_url}, downloading to {path}")
+                    self.evict(size)
+                    self._download(s3_client, parse, etag, path)
+                    self._count(misses=1, bytes_downloaded=size)
+        except BaseException:
+            use.close()
+            raise
+        self._held.append(use)
+        return path
+
+    @staticmethod
+    def _download(s3_client, parse: S3Url, etag: str, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            s3_client.download_file(parse.bucket, parse.key, part)
+            # The transfer manager does not accept IfMatch: the object must
+            # not have changed since the HEAD naming the entry
+            head = s3_client.head_object(Bucket=parse.bucket, Key=parse.key)
+            if head["ETag"] != etag:
+                raise ValueError(
+                    f"s3://{parse.bucket}/{parse.key} changed during the download"
+                )
+            os.replace(part, path)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+
+    def fetch_all(
+        self, s3_client, s3_urls: List[str], heads: Optional[List[dict]] = None
+    ) -> List[str]:
+        """Return the local paths of S3 objects, with their HEAD responses
+        if already requested."""
+        heads = heads or [None] * len(s3_urls)
+        return [
+            self.fetch(s3_client, s3_url, head) for s3_url, head in zip(s3_urls, heads)
+        ]
+
+    def evict(self, incoming: int = 0):
+        """Remove the least recently used entries not in use until the cache
+        and the incoming object fit in the byte budget."""
+        with open(os.path.join(self.root, "evict.lock"), "a+") as evict_lock:
+            fcntl.flock(evict_lock, fcntl.LOCK_EX)
+            entries = []
+            for directory, _, files in os.walk(os.path.join(self.root, "objects")):
+                for file in files:
+                    if file.endswith(".part"):
+                        continue
+                    path = os.path.join(directory, file)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total + incoming <= self.max_bytes:
+                    break
+                entry = os.path.splitext(os.path.basename(path))[0]
+                use_path = os.path.join(self.root, "locks", entry + ".use")
+                with open(use_path, "a+") as use:
+                    try:
+                        fcntl.flock(use, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        continue
+                    os.remove(path)
+                logger.info(f"Input cache eviction: {path} ({size} bytes)")
+                total -= size
+                self._count(evicted_files=1, evicted_bytes=size)
+
+    def close(self) -> dict:
+        """Release the entries used by the job and add its statistics to the
+        host statistics (``stats.json``).
+
+        Returns:
+            dict: Statistics of the job and of the host.
+        """
+        for use in self._held:
+            use.close()
+        self._held = []
+        stats_path = os.path.join(self.root, "stats.json")
+        with open(os.path.join(self.root, "evict.lock"), "a+") as evict_lock:
+            fcntl.flock(evict_lock, fcntl.LOCK_EX)
+            try:
+                with open(stats_path) as f:
+                    host = json.load(f)
+            except (OSError, ValueError):
+                host = {field: 0 for field in STATS_FIELDS}
+            for field in STATS_FIELDS:
+                host[field] = host.get(field, 0) + self.stats[field]
+            host["updated"] = time.time()
+            with open(stats_path + ".tmp", "w") as f:
+                json.dump(host, f)
+            os.replace(stats_path + ".tmp", stats_path)
+        lookups = host["hits"] + host["misses"]
+        host["hit_ratio"] = round(host["hits"] / lookups, 3) if lookups else None
+        return {"job": dict(self.stats), "host": host}
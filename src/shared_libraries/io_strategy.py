@@ -0,0 +1,156 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Choice of the I/O strategy of a job.
+
+The inputs of a job are read in one of four ways:
+
+- ``lustre``: from the FSx for Lustre file system, the output is written
+  on it and exported to S3 later;
+- ``nvme``: downloaded to the NVMe instance store;
+- ``tmpdir``: downloaded to the container storage;
+- ``stream``: read by ffmpeg over HTTPS with a presigned URL, without local
+  copy.
+
+The strategy is chosen from the size and container format of the inputs
+(HEAD requests), the free space of the local disks and the mounts available
+to the job.
+
+With a Lustre file system mounted, the output is written on it whatever the
+strategy of the inputs.
+"""
+
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ["stream", "tmpdir", "nvme", "lustre"]
+
+# Below this size, downloading the inputs is faster than the lazy load of
+# Lustre, which restores them from S3 on first read
+LUSTRE_MIN_BYTES = int(os.environ.get("IO_LUSTRE_MIN_BYTES", str(1024**3)))
+
+# Above this size, sequential containers are streamed instead of downloaded
+# so that ffmpeg starts right away
+STREAM_MIN_BYTES = int(os.environ.get("IO_STREAM_MIN_BYTES", str(8 * 1024**3)))
+
+# Streamed inputs are read during the whole ffmpeg run: large sequential
+# inputs are only streamed when their presigned urls stay valid this long
+STREAM_MIN_SECONDS = int(os.environ.get("IO_STREAM_MIN_SECONDS", str(2 * 3600)))
+
+# Input options of the streamed inputs: reconnect and resume at the current
+# offset on dropped connections and network errors
+STREAM_INPUT_OPTIONS = [
+    "-reconnect",
+    "1",
+    "-reconnect_streamed",
+    "1",
+    "-reconnect_on_network_error",
+    "1",
+    "-reconnect_delay_max",
+    "30",
+]
+
+# Containers read sequentially by ffmpeg, without seeking to an index
+SEQUENTIAL_FORMATS = [".ts", ".m2ts", ".mts", ".mpg", ".mpeg", ".mkv", ".webm", ".flv"]
+
+# Free space kept on a disk besides the inputs and the output
+DISK_RESERVE_BYTES = 1024**3
+
+
+def required_bytes(input_bytes: int, streamed: bool = False) -> int:
+    """Local space needed by a job: the inputs unless they are streamed, and
+    an output expected to be at most as large as the inputs.
+
+    Examples:
+        >>> required_bytes(2 * 1024**3) // 1024**3
+        5
+        >>> required_bytes(2 * 1024**3, streamed=True) // 1024**3
+        3
+    """
+    return input_bytes * (1 if streamed else 2) + DISK_RESERVE_BYTES
+
+
+def choose(
+    inputs: List[Dict],
+    free_bytes: Dict[str, int],
+    lustre_inputs: bool = False,
+    url_seconds: Optional[float] = None,
+) -> Tuple[str, str]:
+    """Choose the I/O strategy of a job.
+
+    Args:
+        inputs (list): Size (``size``) and key (``key``) of each input.
+        free_bytes (dict): Free space of the local disks available to the
+            job, ``nvme`` and/or ``tmpdir``.
+        lustre_inputs (bool): True if the inputs are on the mounted Lustre
+            file system.
+        url_seconds (float): Validity of the presigned urls of the streamed
+            inputs, bounded by the credentials signing them (no limit if
+            None).
+
+    Returns:
+        tuple: The strategy and the reason of the choice.
+
+    Examples:
+        >>> GiB = 1024**3
+        >>> choose([{"size": 100 * 1024**2, "key": "a.mp4"}], {"tmpdir": 20 * GiB}, True)
+        ('tmpdir', 'small inputs downloaded')
+        >>> choose([{"size": 5 * GiB, "key": "a.mov"}], {"tmpdir": 20 * GiB}, True)
+        ('lustre', 'inputs on Lustre')
+        >>> choose([{"size": 5 * GiB, "key": "a.mov"}], {"nvme": 100 * GiB, "tmpdir": 20 * GiB})
+        ('nvme', 'inputs downloaded')
+        >>> choose([{"size": 12 * GiB, "key": "a.ts"}], {"tmpdir": 200 * GiB})
+        ('stream', 'large sequential inputs')
+        >>> choose([{"size": 12 * GiB, "key": "a.ts"}], {"tmpdir": 200 * GiB}, url_seconds=900)
+        ('tmpdir', 'inputs downloaded')
+        >>> choose([{"size": 30 * GiB, "key": "a.mov"}], {"tmpdir": 20 * GiB})
+        ('stream', 'inputs larger than the free disk space')
+    """
+    total = sum(item["size"] for item in inputs)
+    sequential = all(
+        os.path.splitext(item["key"])[1].lower() in SEQUENTIAL_FORMATS
+        for item in inputs
+    )
+    if lustre_inputs and total >= LUSTRE_MIN_BYTES:
+        return "lustre", "inputs on Lustre"
+    streamable = url_seconds is None or url_seconds >= STREAM_MIN_SECONDS
+    if sequential and total >= STREAM_MIN_BYTES and streamable:
+        return "stream", "large sequential inputs"
+    for disk in ["nvme", "tmpdir"]:
+        if free_bytes.get(disk, 0) >= required_bytes(total):
+            reason = "small inputs downloaded" if lustre_inputs else "inputs downloaded"
+            return disk, reason
+    if lustre_inputs:
+        return "lustre", "inputs larger than the free disk space"
+    return "stream", "inputs larger than the free disk space"
+
+
+def output_disk(free_bytes: Dict[str, int]) -> Optional[str]:
+    """Return the local disk with the most free space for the output of a
+    streamed job.
+
+    Examples:
+        >>> output_disk({"nvme": 10, "tmpdir": 20})
+        'tmpdir'
+    """
+    if not free_bytes:
+        return None
+    return max(free_bytes, key=free_bytes.get)
+
+
+def throughput(size: int, seconds: float) -> Optional[float]:
+    """Return a throughput in MiB/s.
+
+    Examples:
+        >>> throughput(300 * 1024**2, 3)
+        100.0
+        >>> throughput(0, 0) is None
+        True
+    """
+    if not size or seconds <= 0:
+        return None
+    return round(size / 1024**2 / seconds, 1)
@@ -0,0 +1,169 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Objects processed by an execution of the state machine.
+
+The objects come from a prefix listing, a curated manifest or an Amazon S3
+Inventory report, and are filtered up front by key globs and size, so that
+sidecars, thumbnails and other non-media keys never reach the map.
+
+Manifests are:
+
+- CSV: ``bucket,key[,size]`` rows, keys URL-encoded as in the manifests of
+  S3 Batch Operations. An empty bucket is the input bucket.
+- JSON: a list of keys, ``s3://`` urls or objects with ``key`` and optional
+  ``bucket`` and ``size``.
+- S3 Inventory: the ``manifest.json`` of a CSV inventory report. Delete
+  markers and noncurrent versions are skipped.
+
+Globs are matched against the whole key with :mod:`fnmatch`, so ``*``
+spans ``/``.
+"""
+
+import csv
+import logging
+import os
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from urllib.parse import unquote_plus, urlparse
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+FORMATS = ["csv", "json", "inventory"]
+
+
+def manifest_format(url: str, declared: Optional[str] = None) -> str:
+    """Return the format of a manifest, from its extension by default.
+
+    Examples:
+        >>> manifest_format("s3://b/inventory/2024-01-01T00-00Z/manifest.json")
+        'inventory'
+        >>> manifest_format("s3://b/lists/batch.csv")
+        'csv'
+        >>> manifest_format("s3://b/lists/batch.json")
+        'json'
+    """
+    if declared:
+        if declared not in FORMATS:
+            raise ValueError(f"Unknown manifest format {declared}, expected {FORMATS}")
+        return declared
+    path = urlparse(url).path
+    if os.path.basename(path) == "manifest.json":
+        return "inventory"
+    return "csv" if path.endswith(".csv") else "json"
+
+
+def matches(key: str, size: Optional[int], filters: Dict[str, Any]) -> bool:
+    """Return True if an object passes the ``include`` and ``exclude`` globs
+    and the ``min_size`` and ``max_size`` bounds of the filters. An unknown
+    size passes the bounds.
+
+    Examples:
+        >>> filters = {"include": ["*.mp4", "*.mov"], "exclude": ["*/proxies/*"]}
+        >>> matches("shows/ep1.mp4", 10, filters)
+        True
+        >>> matches("shows/proxies/ep1.mp4", 10, filters)
+        False
+        >>> matches("shows/ep1.srt", 10, filters)
+        False
+        >>> matches("shows/ep1.mp4", 10, {"min_size": 1024})
+        False
+        >>> matches("shows/", 0, {})
+        False
+    """
+    if key.endswith("/"):
+        return False
+    include = filters.get("include") or []
+    if include and not any(fnmatchcase(key, glob) for glob in include):
+        return False
+    if any(fnmatchcase(key, glob) for glob in filters.get("exclude") or []):
+        return False
+    if size is not None:
+        if filters.get("min_size") is not None and size < filters["min_size"]:
+            return False
+        if filters.get("max_size") is not None and size > filters["max_size"]:
+            return False
+    return True
+
+
+def has_size_filter(filters: Dict[str, Any]) -> bool:
+    """Return True if the filters bound the size of the objects."""
+    return filters.get("min_size") is not None or filters.get("max_size") is not None
+
+
+def _object(bucket: str, key: str, size: Any = None) -> Dict[str, Any]:
+    return {
+        "bucket": bucket,
+        "key": key,
+        "size": int(size) if size not in [None, ""] else None,
+    }
+
+
+def parse_csv(lines: Iterable[str], default_bucket: str) -> Iterator[Dict[str, Any]]:
+    """Return the objects of a CSV manifest.
+
+    Examples:
+        >>> list(parse_csv(["media,shows/ep%201.mp4,2048", ",clip.mov", ""], "in"))
+        [{'bucket': 'media', 'key': 'shows/ep 1.mp4', 'size': 2048}, {'bucket': 'in', 'key': 'clip.mov', 'size': None}]
+    """
+    for row in csv.reader(lines):
+        if len(row) < 2:
+            continue
+        size = row[2] if len(row) > 2 and row[2].isdigit() else None
+        yield _object(row[0] or default_bucket, unquote_plus(row[1]), size)
+
+
+def parse_json(document: List[Any], default_bucket: str) -> Iterator[Dict[str, Any]]:
+    """Return the objects of a JSON manifest.
+
+    Examples:
+        >>> list(parse_json(["a.mp4", "s3://media/b.mp4", {"key": "c.mp4", "size": 5}], "in"))
+        [{'bucket': 'in', 'key': 'a.mp4', 'size': None}, {'bucket': 'media', 'key': 'b.mp4', 'size': None}, {'bucket': 'in', 'key': 'c.mp4', 'size': 5}]
+    """
+    for entry in document:
+        if isinstance(entry, dict):
+            yield _object(
+                entry.get("bucket") or default_bucket, entry["key"], entry.get("size")
+            )
+        elif entry.startswith("s3://"):
+            parsed = urlparse(entry)
+            yield _object(parsed.netloc, parsed.path.lstrip("/"))
+        else:
+            yield _object(default_bucket, entry)
+
+
+def inventory_columns(manifest: Dict[str, Any]) -> List[str]:
+    """Return the columns of the data files of an S3 Inventory report.
+
+    Examples:
+        >>> inventory_columns({"fileFormat": "CSV", "fileSchema": "Bucket, Key, Size"})
+        ['Bucket', 'Key', 'Size']
+    """
+    if manifest.get("fileFormat", "CSV").upper() != "CSV":
+        raise ValueError(
+            f"S3 Inventory format {manifest['fileFormat']} not supported, use CSV"
+        )
+    return [column.strip() for column in manifest["fileSchema"].split(",")]
+
+
+def parse_inventory(
+    lines: Iterable[str], columns: List[str]
+) -> Iterator[Dict[str, Any]]:
+    """Return the current objects of a data file of an S3 Inventory report.
+
+    Examples:
+        >>> columns = ["Bucket", "Key", "VersionId", "IsLatest", "IsDeleteMarker", "Size"]
+        >>> rows = ['"media","a+b.mp4","v2","true","false","10"',
+        ...         '"media","a+b.mp4","v1","false","false","12"',
+        ...         '"media","c.mp4","v3","true","true",""']
+        >>> list(parse_inventory(rows, columns))
+        [{'bucket': 'media', 'key': 'a b.mp4', 'size': 10}]
+    """
+    for values in csv.reader(lines):
+        row = dict(zip(columns, values))
+        if row.get("IsLatest", "true") != "true":
+            continue
+        if row.get("IsDeleteMarker", "false") == "true":
+            continue
+        yield _object(row["Bucket"], unquote_plus(row["Key"]), row.get("Size"))
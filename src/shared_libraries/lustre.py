@@ -0,0 +1,252 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Amazon FSx for Lustre helpers based on the ``lfs`` command.
+
+Files of a data repository association are imported lazily: the metadata is
+listed but the content is restored from Amazon S3 on first read. This module
+restores them ahead of time with the HSM commands.
+
+New files and directories get a layout (``lfs setstripe``) chosen from
+their expected size and type: large media files are striped over several
+storage targets with a progressive file layout (PFL), directories of
+segments keep a compact layout.
+
+The ``lfs`` executable can be replaced with the `LFS_PATH` environment
+variable, e.g. with a stub script to test without a Lustre file system.
+"""
+
+import logging
+import os
+import shlex
+import subprocess  # nosec B404
+import threading
+import time
+from typing import Dict, List, Optional
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+# Files per lfs invocation, to stay below the command line length limit
+LFS_BATCH_SIZE = 100
+
+# lfs setstripe options per layout. "large": one stripe for the first 64 MiB,
+# 4 stripes up to 1 GiB, then all the storage targets. "segments": one
+# stripe per file for the HLS/DASH segments and image sequences.
+DEFAULT_STRIPING = {
+    "large_file_bytes": 1024**3,
+    "layouts": {
+        "large": "-E 64M -c 1 -S 1M -E 1G -c 4 -S 4M -E -1 -c -1 -S 4M",
+        "segments": "-c 1 -S 1M",
+    },
+}
+
+
+def _lfs(args: List[str], timeout: int = 300) -> str:
+    """Run an lfs command and return its output."""
+    # Read at each call, to swap the executable in tests
+    command_list = [os.environ.get("LFS_PATH", "lfs")] + args
+    result = subprocess.run(  # nosec B603
+        command_list, capture_output=True, text=True, timeout=timeout
+    )
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(
+            returncode=result.returncode, cmd=command_list, stderr=result.stderr
+        )
+    return result.stdout
+
+
+def _batches(paths: List[str]) -> List[List[str]]:
+    return [paths[i : i + LFS_BATCH_SIZE] for i in range(0, len(paths), LFS_BATCH_SIZE)]
+
+
+def parse_hsm_state(output: str) -> Dict[str, List[str]]:
+    """Parse the output of ``lfs hsm_state``.
+
+    Examples:
+        >>> parse_hsm_state(
+        ...     "/fsx/a.mp4: (0x0000000d) released exists archived, archive_id:1\\n"
+        ...     "/fsx/b.mp4: (0x00000009) exists archived, archive_id:1\\n")
+        {'/fsx/a.mp4': ['released', 'exists', 'archived'], '/fsx/b.mp4': ['exists', 'archived']}
+    """
+    states = {}
+    for line in output.splitlines():
+        path, separator, state = line.rpartition(": (")
+        if not separator:
+            continue
+        flags = state.partition(")")[2].split(",")[0].split()
+        states[path] = flags
+    return states
+
+
+def hsm_state(paths: List[str]) -> Dict[str, List[str]]:
+    """Return the HSM flags of files (``released``, ``exists``,
+    ``archived``, ``dirty``...)."""
+    states = {}
+    for batch in _batches(paths):
+        states.update(parse_hsm_state(_lfs(["hsm_state"] + batch)))
+    return states
+
+
+def hsm_restore(paths: List[str]):
+    """Request the restore of files from the data repository."""
+    for batch in _batches(paths):
+        _lfs(["hsm_restore"] + batch)
+
+
+def released(paths: List[str]) -> List[str]:
+    """Return the files whose content is not on the file system."""
+    states = hsm_state(paths)
+    return [path for path in paths if "released" in states.get(path, [])]
+
+
+def setstripe(path: str, options: str):
+    """Set the layout of a new file, or the default layout of the new files
+    of a directory."""
+    _lfs(["setstripe"] + shlex.split(options) + [path])
+
+
+def getstripe(path: str) -> str:
+    """Describe the layout of a file or the default layout of a directory."""
+    return _lfs(["getstripe", "-y", path])
+
+
+def select_layout(
+    expected_size: int, segments: bool, striping: dict = DEFAULT_STRIPING
+) -> Optional[str]:
+    """Choose the layout of an output.
+
+    Examples:
+        >>> select_layout(4 * 1024**3, False)
+        'large'
+        >>> select_layout(4 * 1024**3, True)
+        'segments'
+        >>> select_layout(100 * 1024**2, False) is None
+        True
+    """
+    if segments:
+        layout = "segments"
+    elif expected_size >= striping["large_file_bytes"]:
+        layout = "large"
+    else:
+        return None
+    return layout if layout in striping["layouts"] else None
+
+
+def apply_layout(
+    path: str, expected_size: int, segments: bool, striping: dict = DEFAULT_STRIPING
+) -> Optional[str]:
+    """Set the layout of an output before ffmpeg writes it.
+
+    A file keeps the layout of its creation, so existing files are left
+    unchanged and the layout of a file is set by creating it empty: ffmpeg
+    must overwrite it. For a sequence of segments, the layout is set on the
+    directory and inherited by the segments.
+
+    Returns:
+        str: The name of the layout applied, None if the default is kept.
+
+    Examples:
+        >>> import os, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> stub = os.path.join(directory, "lfs")
+        >>> with open(stub, "w") as f:
+        ...     _ = f.write('#!/bin/sh\\n'
+        ...                 'echo "$@" >> "$0.log"\\n'
+        ...                 'for last; do :; done\\n'
+        ...                 'touch "$last"\\n')
+        >>> os.chmod(stub, 0o755)
+        >>> os.environ["LFS_PATH"] = stub
+        >>> output = os.path.join(directory, "out.mp4")
+        >>> apply_layout(output, 4 * 1024**3, False)
+        'large'
+        >>> apply_layout(output, 4 * 1024**3, False) is None
+        True
+        >>> apply_layout(os.path.join(directory, "hls"), 0, True)
+        'segments'
+        >>> print(open(stub + ".log").read().replace(directory, "/fsx"), end="")
+        setstripe -E 64M -c 1 -S 1M -E 1G -c 4 -S 4M -E -1 -c -1 -S 4M /fsx/out.mp4
+        setstripe -c 1 -S 1M /fsx/hls
+        >>> del os.environ["LFS_PATH"]
+    """
+    layout = select_layout(expected_size, segments, striping)
+    if not layout or (not segments and os.path.exists(path)):
+        return None
+    setstripe(path, striping["layouts"][layout])
+    logger.info(f"Lustre layout {layout} set on {path}")
+    return layout
+
+
+class HsmPrefetch(threading.Thread):
+    """Restore files from the data repository in the background.
+
+    The restore of all the released files is requested at once, then their
+    state is polled until they are all restored, so the job can start
+    reading them after a head start instead of restoring them one block at
+    a time on first read.
+
+    Args:
+        paths (list): Files to restore.
+        interval (float): Polling interval of ``lfs hsm_state`` in seconds.
+        timeout (float): Maximum polling duration in seconds.
+    """
+
+    def __init__(self, paths: List[str], interval: float = 1.0, timeout: float = 3600):
+        super().__init__(name="lustre-prefetch", daemon=True)
+        self.paths = list(paths)
+        self.interval = interval
+        self.timeout = timeout
+        self.pending: List[str] = []
+        self.restored: Dict[str, float] = {}
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._done = threading.Event()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            self.pending = released(self.paths)
+            if self.pending:
+                logger.info(f"Restoring {len(self.pending)} files from S3")
+                hsm_restore(self.pending)
+            while self.pending and not self._stop_event.is_set():
+                if time.time() - self.started_at > self.timeout:
+                    raise TimeoutError(f"{len(self.pending)} files not restored")
+                self._stop_event.wait(self.interval)
+                still_released = set(released(self.pending))
+                for path in self.pending:
+                    if path not in still_released:
+                        self.restored[path] = round(time.time() - self.started_at, 3)
+                        logger.info(f"Restored {path} in {self.restored[path]}s")
+                self.pending = [p for p in self.pending if p in still_released]
+        except Exception as e:
+            logger.error(f"Lustre prefetch error: {e}")
+            self.error = str(e)
+        finally:
+            self.finished_at = time.time()
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the restores, at most ``timeout`` seconds.
+
+        Returns:
+            bool: True if all the files are restored.
+        """
+        self._done.wait(timeout)
+        return self._done.is_set() and not self.pending and not self.error
+
+    def stop(self):
+        """Stop polling."""
+        self._stop_event.set()
+
+    def summary(self) -> dict:
+        """Describe the prefetch for the job metrics."""
+        end = self.finished_at or time.time()
+        return {
+            "files": len(self.paths),
+            "restored": self.restored,
+            "pending": self.pending,
+            "error": self.error,
+            "seconds": round(end - self.started_at, 3),
+        }
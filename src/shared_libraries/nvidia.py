@@ -0,0 +1,179 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""NVIDIA GPU discovery and NVENC session scheduling.
+
+GPUs visible to the container are listed with nvidia-smi. The executable
+can be replaced with the `NVIDIA_SMI` environment variable, e.g. with a
+script printing a fixed CSV to test the scheduling without a GPU.
+"""
+
+import logging
+import os
+import subprocess  # nosec B404
+import threading
+from typing import List, Optional
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+NVIDIA_SMI = os.environ.get("NVIDIA_SMI", "nvidia-smi")
+
+# Concurrent NVENC sessions per GPU. Data center GPUs (T4, A10G) have no
+# driver limit but a 1080p encode already uses a large share of the encoder.
+NVENC_SESSIONS_PER_GPU = int(os.environ.get("NVENC_SESSIONS_PER_GPU", "4"))
+
+GPU_QUERY_FIELDS = [
+    "index",
+    "name",
+    "uuid",
+    "memory.total",
+    "encoder.stats.sessionCount",
+]
+
+
+def list_gpus(nvidia_smi: str = NVIDIA_SMI) -> List[dict]:
+    """List the GPUs visible to the container.
+
+    The position in the list is the CUDA device ordinal used by
+    ``-hwaccel_device`` and the NVENC ``-gpu`` option.
+
+    Returns:
+        list: One dictionary per GPU, empty if nvidia-smi is not available.
+
+    Examples:
+        >>> import os, tempfile
+        >>> stub = os.path.join(tempfile.mkdtemp(), "nvidia-smi")
+        >>> with open(stub, "w") as f:
+        ...     _ = f.write("#!/bin/sh\\n"
+        ...                 "echo '0, Tesla T4, GPU-aaa, 15360, 3'\\n"
+        ...                 "echo '1, Tesla T4, GPU-bbb, 15360, 0'\\n")
+        >>> os.chmod(stub, 0o755)
+        >>> gpus = list_gpus(stub)
+        >>> [(gpu["device"], gpu["uuid"], gpu["sessions"]) for gpu in gpus]
+        [(0, 'GPU-aaa', 3), (1, 'GPU-bbb', 0)]
+        >>> scheduler = GpuScheduler(gpus, 4)
+        >>> scheduler.capacity, [scheduler.acquire() for _ in range(3)]
+        (5, [0, 1, 1])
+        >>> list_gpus(stub + "-missing")
+        []
+    """
+    try:
+        result = subprocess.run(  # nosec B603
+            [
+                nvidia_smi,
+                f"--query-gpu={','.join(GPU_QUERY_FIELDS)}",
+                "--format=csv,noheader,nounits",
+            ],
+            capture_output=True,
+            text=True,
+            timeout=30,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.info(f"No GPU found: {e}")
+        return []
+    if result.returncode != 0:
+        logger.info(f"No GPU found: {result.stderr}")
+        return []
+    return parse_gpus(result.stdout)
+
+
+def parse_gpus(output: str) -> List[dict]:
+    """Parse the CSV output of ``nvidia-smi --query-gpu``.
+
+    Examples:
+        >>> gpus = parse_gpus("0, Tesla T4, GPU-aaa, 15360, 1\\n1, Tesla T4, GPU-bbb, 15360, [N/A]\\n")
+        >>> [(g["device"], g["name"], g["sessions"]) for g in gpus]
+        [(0, 'Tesla T4', 1), (1, 'Tesla T4', 0)]
+    """
+    gpus = []
+    for line in output.strip().splitlines():
+        values = [value.strip() for value in line.split(",")]
+        if len(values) != len(GPU_QUERY_FIELDS):
+            continue
+        gpus.append(
+            {
+                "device": len(gpus),
+                "index": values[0],
+                "name": values[1],
+                "uuid": values[2],
+                "memory_mib": int(values[3]) if values[3].isdigit() else None,
+                "sessions": int(values[4]) if values[4].isdigit() else 0,
+            }
+        )
+    return gpus
+
+
+class GpuScheduler:
+    """Hand out NVENC session slots across GPUs in round-robin.
+
+    Each GPU accepts ``sessions_per_gpu`` concurrent encodes, minus the
+    sessions already open on it (e.g. by another container of the host).
+
+    Examples:
+        >>> scheduler = GpuScheduler([{"device": 0, "sessions": 0},
+        ...                           {"device": 1, "sessions": 1}], 2)
+        >>> scheduler.capacity
+        3
+        >>> [scheduler.acquire() for _ in range(3)]
+        [0, 1, 0]
+        >>> scheduler.release(1)
+        >>> scheduler.acquire()
+        1
+    """
+
+    def __init__(
+        self, gpus: List[dict], sessions_per_gpu: int = NVENC_SESSIONS_PER_GPU
+    ):
+        self.slots = {
+            gpu["device"]: max(0, sessions_per_gpu - gpu.get("sessions", 0))
+            for gpu in gpus
+        }
+        self.capacity = sum(self.slots.values())
+        self._devices = list(self.slots)
+        self._next = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """Wait for a free session slot and return its device ordinal."""
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: any(self.slots.values()), timeout=timeout
+            ):
+                raise TimeoutError("No NVENC session available")
+            for offset in range(len(self._devices)):
+                device = self._devices[(self._next + offset) % len(self._devices)]
+                if self.slots[device] > 0:
+                    self.slots[device] -= 1
+                    self._next = (self._devices.index(device) + 1) % len(self._devices)
+                    return device
+        raise RuntimeError("Inconsistent NVENC session slots")
+
+    def release(self, device: int):
+        """Give a session slot back."""
+        with self._condition:
+            self.slots[device] += 1
+            self._condition.notify()
+
+
+def assign_device(command_list: List[str], device: int) -> List[str]:
+    """Pin an ffmpeg command to one GPU.
+
+    ``-hwaccel_device`` is added before the inputs when hardware decoding is
+    requested, and ``-gpu`` before the output when an NVENC encoder is used,
+    unless the user already chose a device.
+
+    Examples:
+        >>> assign_device(["ffmpeg", "-hwaccel", "cuda", "-i", "in.mp4",
+        ...                "-c:v", "h264_nvenc", "out.mp4"], 1)
+        ['ffmpeg', '-hwaccel', 'cuda', '-hwaccel_device', '1', '-i', 'in.mp4', '-c:v', 'h264_nvenc', '-gpu', '1', 'out.mp4']
+    """
+    command_list = list(command_list)
+    if "-hwaccel" in command_list and "-hwaccel_device" not in command_list:
+        position = command_list.index("-i") if "-i" in command_list else 1
+        command_list[position:position] = ["-hwaccel_device", str(device)]
+    if any(token.endswith("_nvenc") for token in command_list) and (
+        "-gpu" not in command_list
+    ):
+        command_list[-1:-1] = ["-gpu", str(device)]
+    return command_list
@@ -0,0 +1,85 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Duration-aware packing of short jobs in multi-command jobs.
+
+Thumbnails, audio extracts or probes run for a few seconds: one AWS Batch
+job per object spends more time in scheduling and container start than in
+ffmpeg. The items are packed in multi-command jobs (``commands_url``) whose
+estimated duration fits a target window.
+
+The duration of an item is estimated from the average duration of the jobs
+of its sizing profile (``avg_duration_seconds`` of
+``metrics/sizing/profiles.json``) when known, otherwise from its input size.
+The commands of a job run concurrently on its vCPUs, so the capacity of a
+job is the target window times its parallelism.
+"""
+
+import heapq
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+# Input bytes processed per second by one command without history
+DEFAULT_BYTES_PER_SECOND = 20 * 1024**2
+MIN_SECONDS = 1.0
+DEFAULT_TARGET_SECONDS = 300
+DEFAULT_MAX_COMMANDS = 500
+
+
+def estimate_seconds(
+    size: int,
+    history: Optional[Dict[str, Any]] = None,
+    bytes_per_second: float = DEFAULT_BYTES_PER_SECOND,
+) -> float:
+    """Estimate the duration of a command.
+
+    Examples:
+        >>> estimate_seconds(100 * 1024**2)
+        5.0
+        >>> estimate_seconds(100 * 1024**2, {"avg_duration_seconds": 12.5})
+        12.5
+        >>> estimate_seconds(0)
+        1.0
+    """
+    if history and history.get("avg_duration_seconds"):
+        return max(MIN_SECONDS, float(history["avg_duration_seconds"]))
+    return max(MIN_SECONDS, size / bytes_per_second)
+
+
+def pack(
+    items: List[Any],
+    seconds: List[float],
+    capacity: float,
+    max_items: int = DEFAULT_MAX_COMMANDS,
+) -> List[List[Any]]:
+    """Pack items in the fewest bins of at most ``capacity`` seconds and
+    ``max_items`` items (worst-fit decreasing). An item longer than the
+    capacity has its own bin.
+
+    Examples:
+        >>> pack(["a", "b", "c", "d"], [50, 40, 30, 20], 70)
+        [['a', 'd'], ['b', 'c']]
+        >>> pack(["a", "b", "c"], [100, 1, 1], 10, max_items=1)
+        [['a'], ['b'], ['c']]
+        >>> pack([], [], 10)
+        []
+    """
+    bins: List[List[Any]] = []
+    # Open bins by remaining capacity: (-remaining, bin index)
+    heap: List[tuple] = []
+    for item, duration in sorted(zip(items, seconds), key=lambda x: -x[1]):
+        if heap and -heap[0][0] >= duration:
+            remaining, index = heapq.heappop(heap)
+            remaining += duration
+        else:
+            index = len(bins)
+            bins.append([])
+            remaining = duration - capacity
+        bins[index].append(item)
+        if len(bins[index]) < max_items and remaining < 0:
+            heapq.heappush(heap, (remaining, index))
+    return bins
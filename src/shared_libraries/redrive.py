@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Redrive of the failed items of a distributed map run.
+
+The distributed maps of the state machine write the result of each item
+with their ``ResultWriter`` under
+``batch-ffmpeg-state-machine/results-output/<map run id>/``: a
+``manifest.json`` lists the result files of each status (``FAILED_0.json``,
+``SUCCEEDED_0.json``...), JSON lists of the child executions with their
+``Status``, ``Input`` and, when failed, ``Cause``.
+
+A redrive reads the manifest of a map run and rebuilds the items of the
+failed, timed out or aborted child executions only, with their original
+parameters, and optionally another compute family. The items of a
+multi-command job (``commands_url``) are expanded into one item per
+command, so that the redrive of a pack does not depend on its size. The
+items of an array job (``manifest_url``) are narrowed to its failed
+children, listed from the AWS Batch job of the cause.
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+RESULTS_PREFIX = "batch-ffmpeg-state-machine/results-output/"
+DEFAULT_STATUSES = ["FAILED", "TIMED_OUT", "ABORTED"]
+ITEM_KEYS = [
+    "name",
+    "compute",
+    "input_url",
+    "input_file_options",
+    "global_options",
+    "output_url",
+    "output_file_options",
+]
+
+
+def manifest_key(map_run_arn: str) -> str:
+    """Return the key of the ``ResultWriter`` manifest of a map run.
+
+    Examples:
+        >>> manifest_key("arn:aws:states:us-east-1:123456789012:mapRun:batch-ffmpeg-state-machine/S3objectkeys:8d3bc4a9")
+        'batch-ffmpeg-state-machine/results-output/8d3bc4a9/manifest.json'
+    """
+    return f"{RESULTS_PREFIX}{map_run_arn.rsplit(':', 1)[1]}/manifest.json"
+
+
+def result_files(
+    manifest: Dict[str, Any], statuses: Optional[List[str]] = None
+) -> List[str]:
+    """Return the keys of the result files of the statuses to redrive.
+
+    Examples:
+        >>> manifest = {"ResultFiles": {"FAILED": [{"Key": "r/FAILED_0.json", "Size": 10}],
+        ...                             "SUCCEEDED": [{"Key": "r/SUCCEEDED_0.json", "Size": 90}]}}
+        >>> result_files(manifest)
+        ['r/FAILED_0.json']
+    """
+    files = manifest.get("ResultFiles", {})
+    return [
+        result["Key"]
+        for status in statuses or DEFAULT_STATUSES
+        for result in files.get(status, [])
+    ]
+
+
+def failed_job_id(result: Dict[str, Any]) -> Optional[str]:
+    """Return the id of the AWS Batch job in the cause of a failed child
+    execution, None if the failure is not a job failure.
+
+    Examples:
+        >>> failed_job_id({"Status": "FAILED", "Cause": '{"JobId": "a1", "Status": "FAILED"}'})
+        'a1'
+        >>> failed_job_id({"Status": "TIMED_OUT"}) is None
+        True
+    """
+    try:
+        return json.loads(result["Cause"])["JobId"]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def failed_inputs(
+    results: Iterable[Dict[str, Any]],
+    statuses: Optional[List[str]] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Return the inputs of the child executions to redrive, with the id
+    of their failed AWS Batch job in ``failed_job_id`` when known. Inputs
+    not included in the results (too large) are counted as ``missing``.
+
+    Examples:
+        >>> results = [{"Status": "FAILED", "Input": '{"name": "a", "compute": "intel"}',
+        ...             "Cause": '{"JobId": "a1"}'},
+        ...            {"Status": "SUCCEEDED", "Input": '{"name": "b"}'},
+        ...            {"Status": "TIMED_OUT", "InputDetails": {"Included": False}}]
+        >>> stats = {}
+        >>> list(failed_inputs(results, stats=stats)), stats
+        ([{'name': 'a', 'compute': 'intel', 'failed_job_id': 'a1'}], {'results': 3, 'missing': 1})
+    """
+    statuses = statuses or DEFAULT_STATUSES
+    stats = stats if stats is not None else {}
+    for result in results:
+        stats["results"] = stats.get("results", 0) + 1
+        if result.get("Status") not in statuses:
+            continue
+        if "Input" not in result:
+            stats["missing"] = stats.get("missing", 0) + 1
+            logger.warning(f"Input of {result.get('ExecutionArn')} not in the results")
+            continue
+        item = json.loads(result["Input"])
+        job_id = failed_job_id(result)
+        if job_id:
+            item["failed_job_id"] = job_id
+        yield item
+
+
+def redrive_item(item: Dict[str, Any], compute: Optional[str] = None) -> Dict[str, Any]:
+    """Return the item of the per-object map relaunching a failed item or a
+    command of a failed pack, on ``compute`` if given.
+
+    Examples:
+        >>> redrive_item({"name": "ep1", "compute": "intel", "input_url": "s3://b/ep1.mp4",
+        ...               "output_url": "s3://b/out/ep1.mp4", "output_file_options": "-an"}, "arm")
+        {'name': 'ep1', 'compute': 'arm', 'input_url': 's3://b/ep1.mp4', 'input_file_options': 'null', 'global_options': 'null', 'output_url': 's3://b/out/ep1.mp4', 'output_file_options': '-an'}
+    """
+    redriven = {key: item.get(key) or "null" for key in ITEM_KEYS}
+    if compute:
+        redriven["compute"] = compute
+    return redriven
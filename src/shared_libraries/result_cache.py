@@ -0,0 +1,273 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Index of the results of the jobs, to skip unchanged work.
+
+Re-running the state machine over a prefix would re-encode every object
+even when neither the inputs nor the command changed. The result of a job
+is indexed by the fingerprint of:
+
+- the ETags of its inputs, in order: the content, not the keys
+- its ffmpeg options, normalized, and the container format of its output
+- the ffmpeg version, from the tag of the container image
+- the compute family, whose encoders can differ (e.g. NVENC)
+- the settings of the wrapper rewriting the ffmpeg arguments (stream copy,
+  GPU pipeline and scaler, thread tuning) of the compute family
+
+and maps to its output url and the ETag and size of the output. A job with
+an indexed result whose output is still in place with the same ETag is
+skipped before any compute is spent: the output is reused, and copied
+server-side when the job writes to another url.
+
+The index is an Amazon DynamoDB table (``batch-ffmpeg-results``), or a local
+directory of JSON documents as a stand-in (``file://`` url or path).
+Outputs of a directory (segments, ``%`` in the output url) and outputs
+written to FSx for Lustre are not indexed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+QUEUE_PREFIX = "batch-ffmpeg-job-queue-"
+# Environment variables of the wrapper rewriting the ffmpeg arguments of a
+# command, with their defaults
+REWRITE_SETTINGS = {
+    "FFMPEG_STREAM_COPY": "TRUE",
+    "FFMPEG_GPU_PIPELINE": "FALSE",
+    "FFMPEG_GPU_SCALER": "scale_cuda",
+    "FFMPEG_THREAD_TUNING": "TRUE",
+}
+
+
+def split_url(url: str) -> Tuple[str, str]:
+    """Return the bucket and key of an S3 url.
+
+    Examples:
+        >>> split_url("s3://media/shows/ep 1.mp4")
+        ('media', 'shows/ep 1.mp4')
+    """
+    parsed = urlparse(url, allow_fragments=False)
+    query = f"?{parsed.query}" if parsed.query else ""
+    return parsed.netloc, f"{parsed.path.lstrip('/')}{query}"
+
+
+def normalize_options(options: Optional[str]) -> str:
+    """Return ffmpeg options with their spacing and quoting normalized.
+
+    Examples:
+        >>> normalize_options("-c:v  libx264 -metadata title='My show'")
+        "-c:v libx264 -metadata 'title=My show'"
+        >>> normalize_options("null")
+        ''
+    """
+    if not options or options == "null":
+        return ""
+    return shlex.join(shlex.split(options))
+
+
+def cacheable(output_url: Optional[str]) -> bool:
+    """Return True if the output of a job can be indexed: a single object.
+
+    Examples:
+        >>> cacheable("s3://media/out/ep1.mp4")
+        True
+        >>> cacheable("s3://media/out/ep1/segment-%03d.ts")
+        False
+    """
+    return bool(output_url) and "%" not in output_url
+
+
+def compute_family(queue_name: Optional[str]) -> str:
+    """Return the compute family of a job queue.
+
+    Examples:
+        >>> compute_family("batch-ffmpeg-job-queue-nvidia")
+        'nvidia'
+        >>> compute_family(None)
+        'local'
+    """
+    if not queue_name:
+        return "local"
+    return queue_name.rsplit("/", 1)[-1].removeprefix(QUEUE_PREFIX)
+
+
+def rewrite_settings(environment: Dict[str, Optional[str]]) -> Dict[str, str]:
+    """Return the settings rewriting the ffmpeg arguments of the jobs of an
+    environment, with their defaults.
+
+    Examples:
+        >>> rewrite_settings({"FFMPEG_GPU_PIPELINE": "true", "LOGLEVEL": "DEBUG"})
+        {'FFMPEG_STREAM_COPY': 'TRUE', 'FFMPEG_GPU_PIPELINE': 'TRUE', 'FFMPEG_GPU_SCALER': 'SCALE_CUDA', 'FFMPEG_THREAD_TUNING': 'TRUE'}
+    """
+    return {
+        name: (environment.get(name) or default).upper()
+        for name, default in REWRITE_SETTINGS.items()
+    }
+
+
+def fingerprint(
+    etags: List[str],
+    command: Dict[str, Optional[str]],
+    ffmpeg_version: str,
+    compute: str,
+    rewrites: Optional[Dict[str, str]] = None,
+) -> str:
+    """Return the fingerprint of the result of a command: its input ETags,
+    normalized options, output format, ffmpeg version, compute family and
+    the settings rewriting its ffmpeg arguments (``rewrite_settings``).
+
+    Examples:
+        >>> command = {"output_url": "s3://out/a.mp4", "output_file_options": "-c:v libx264"}
+        >>> other = {"output_url": "s3://out/b/a.mp4", "output_file_options": " -c:v   libx264 "}
+        >>> fingerprint(['"e1"'], command, "7.0", "intel") == fingerprint(["e1"], other, "7.0", "intel")
+        True
+        >>> fingerprint(["e1"], command, "7.0", "intel") == fingerprint(["e1"], command, "6.0", "intel")
+        False
+        >>> fingerprint(["e1"], command, "7.0", "intel", rewrite_settings({})) == fingerprint(["e1"], command, "7.0", "intel", rewrite_settings({"FFMPEG_STREAM_COPY": "FALSE"}))
+        False
+    """
+    document = {
+        "inputs": [etag.strip('"') for etag in etags],
+        "global_options": normalize_options(command.get("global_options")),
+        "input_file_options": normalize_options(command.get("input_file_options")),
+        "output_file_options": normalize_options(command.get("output_file_options")),
+        "output_format": os.path.splitext(command["output_url"])[1].lower(),
+        "ffmpeg_version": ffmpeg_version,
+        "compute": compute,
+        "rewrites": rewrites or {},
+    }
+    encoded = json.dumps(document, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def input_etags(s3_client, input_urls: List[str]) -> List[str]:
+    """Return the ETags of the inputs of a job."""
+    etags = []
+    for url in input_urls:
+        bucket, key = split_url(url)
+        etags.append(s3_client.head_object(Bucket=bucket, Key=key)["ETag"])
+    return etags
+
+
+class DynamoDbIndex:
+    """Result index in an Amazon DynamoDB table, partition key
+    ``fingerprint``."""
+
+    def __init__(self, dynamodb_client, table_name: str):
+        self.dynamodb = dynamodb_client
+        self.table_name = table_name
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        response = self.dynamodb.get_item(
+            TableName=self.table_name, Key={"fingerprint": {"S": key}}
+        )
+        if "Item" not in response:
+            return None
+        return json.loads(response["Item"]["result"]["S"])
+
+    def put(self, key: str, result: Dict[str, Any]):
+        self.dynamodb.put_item(
+            TableName=self.table_name,
+            Item={
+                "fingerprint": {"S": key},
+                "output_url": {"S": result["output_url"]},
+                "result": {"S": json.dumps(result)},
+            },
+        )
+
+
+class DirectoryIndex:
+    """Local result index: one ``<fingerprint>.json`` document per result."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(os.path.join(self.path, f"{key}.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.path, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(result, f)
+        os.replace(f.name, os.path.join(self.path, f"{key}.json"))
+
+
+def open_index(index_url: str, dynamodb_client=None):
+    """Return the result index of a DynamoDB table name, or of a local
+    directory.
+
+    Examples:
+        >>> open_index("batch-ffmpeg-results", object()).table_name
+        'batch-ffmpeg-results'
+    """
+    parsed = urlparse(index_url)
+    if parsed.scheme == "file":
+        return DirectoryIndex(parsed.path)
+    # Table names have no "/"
+    if "/" in index_url:
+        return DirectoryIndex(index_url)
+    return DynamoDbIndex(dynamodb_client, index_url)
+
+
+def lookup(index, s3_client, key: str) -> Optional[Dict[str, Any]]:
+    """Return the indexed result of a fingerprint if its output is still in
+    place with the same ETag."""
+    result = index.get(key)
+    if not result:
+        return None
+    bucket, output_key = split_url(result["output_url"])
+    try:
+        head = s3_client.head_object(Bucket=bucket, Key=output_key)
+    except ClientError as e:
+        logger.info(f"Indexed output {result['output_url']} not found - {e}")
+        return None
+    if head["ETag"] != result["etag"]:
+        logger.info(f"Indexed output {result['output_url']} changed")
+        return None
+    return result
+
+
+def reuse(s3_client, result: Dict[str, Any], output_url: str) -> str:
+    """Put the output of an indexed result at ``output_url``, with a
+    server-side copy if it is elsewhere, and return how."""
+    if result["output_url"] == output_url:
+        return "in-place"
+    source_bucket, source_key = split_url(result["output_url"])
+    bucket, key = split_url(output_url)
+    s3_client.copy({"Bucket": source_bucket, "Key": source_key}, bucket, key)
+    return "copied"
+
+
+def record(
+    index, s3_client, key: str, output_url: str, details: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Index the output of a job under its fingerprint."""
+    bucket, output_key = split_url(output_url)
+    head = s3_client.head_object(Bucket=bucket, Key=output_key)
+    result = {
+        "output_url": output_url,
+        "etag": head["ETag"],
+        "size": head["ContentLength"],
+        "created": time.time(),
+        **details,
+    }
+    index.put(key, result)
+    return result
@@ -0,0 +1,376 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+"""Persistent worker pulling wrapper jobs from a work queue.
+
+A short job spends a large part of its duration in scheduling, container
+start, AWS client setup and cold caches. In worker mode, one long-running
+AWS Batch job pulls the job payloads from a queue and runs them back to
+back, reusing its AWS clients, the host input cache and the warm FSx for
+Lustre or NVMe state.
+
+A payload is a JSON object with the parameters of the wrapper and optional
+environment variables of the job::
+
+    {"job_id": "clip-42",
+     "parameters": {"input_url": "s3://...", "output_url": "s3://...",
+                    "output_file_options": "-c:v libx264"},
+     "environment": {"FFMPEG_THREADS": "4"}}
+
+The queue is an Amazon SQS queue url, or a local directory of ``.json``
+payloads as a stand-in (``file://`` url or path). An SQS-compatible local
+server (e.g. ElasticMQ) can be used with the ``AWS_ENDPOINT_URL_SQS``
+environment variable of the AWS SDK.
+
+Each job runs in its own working directory (temporary files, current
+directory of ffmpeg) removed after the job. A failed payload becomes
+visible again after a delay growing with its number of attempts. On SIGTERM
+or SIGINT, the worker stops pulling payloads, interrupts the job in progress
+and puts its payload back in the queue: AWS Batch kills the container 30
+seconds after SIGTERM, too early to finish most jobs.
+"""
+
+import json
+import logging
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
+logging.basicConfig(level=LOGLEVEL)
+logger = logging.getLogger(__name__)
+
+# Long polling of SQS, short enough to drain quickly on SIGTERM, and polling
+# interval of a local directory
+WAIT_SECONDS = 10
+POLL_INTERVAL = 1.0
+# The payload of a running job stays invisible to the other workers: the
+# visibility timeout is extended every half timeout
+VISIBILITY_TIMEOUT = 120
+# A failed payload is retried after RETRY_DELAY seconds, doubled at each
+# attempt up to MAX_RETRY_DELAY
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 900
+
+
+def retry_delay(attempts: int) -> int:
+    """Return the delay before the retry of a payload failed ``attempts``
+    times.
+
+    Examples:
+        >>> [retry_delay(attempts) for attempts in [1, 2, 3, 10]]
+        [60, 120, 240, 900]
+    """
+    return min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (max(1, attempts) - 1))
+
+
+class JobInterrupted(BaseException):
+    """Raised in the job in progress when the worker is stopped. Not an
+    ``Exception``, so that the error handling of the job does not catch it."""
+
+
+class Message:
+    """A payload received from a work queue."""
+
+    def __init__(self, message_id: str, body: str, receipt: Any, attempts: int = 1):
+        self.message_id = message_id
+        self.body = body
+        self.receipt = receipt
+        self.attempts = attempts
+
+    @property
+    def payload(self) -> Dict[str, Any]:
+        """Return the payload, parameters at the top level or under
+        ``parameters``.
+
+        Examples:
+            >>> Message("1", '{"input_url": "s3://b/k"}', None).payload
+            {'parameters': {'input_url': 's3://b/k'}, 'environment': {}, 'job_id': '1'}
+        """
+        payload = json.loads(self.body)
+        if "parameters" not in payload:
+            payload = {"parameters": payload}
+        payload.setdefault("environment", {})
+        payload.setdefault("job_id", self.message_id)
+        return payload
+
+
+class SqsQueue:
+    """Amazon SQS work queue. A failed payload is made visible again after
+    its retry delay and moves to the dead-letter queue of the queue after its
+    maximum receive count."""
+
+    def __init__(self, sqs_client, queue_url: str):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+
+    def receive(self, wait_seconds: int = WAIT_SECONDS) -> Optional[Message]:
+        response = self.sqs.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=wait_seconds,
+            VisibilityTimeout=VISIBILITY_TIMEOUT,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        messages = response.get("Messages", [])
+        if not messages:
+            return None
+        message = messages[0]
+        return Message(
+            message["MessageId"],
+            message["Body"],
+            message["ReceiptHandle"],
+            int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1)),
+        )
+
+    def extend(self, message: Message):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=message.receipt,
+            VisibilityTimeout=VISIBILITY_TIMEOUT,
+        )
+
+    def succeeded(self, message: Message):
+        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=message.receipt)
+
+    def failed(self, message: Message):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=message.receipt,
+            VisibilityTimeout=retry_delay(message.attempts),
+        )
+
+    def release(self, message: Message):
+        self.sqs.change_message_visibility(
+            QueueUrl=self.queue_url, ReceiptHandle=message.receipt, VisibilityTimeout=0
+        )
+
+
+class DirectoryQueue:
+    """Local work queue: the ``.json`` files of a directory, claimed by
+    renaming them to ``running/`` and moved to ``succeeded/`` or ``failed/``,
+    or back to the directory when released. Several workers can share the
+    directory."""
+
+    def __init__(self, path: str):
+        self.path = path
+        for state in ["running", "succeeded", "failed"]:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def receive(self, wait_seconds: int = WAIT_SECONDS) -> Optional[Message]:
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            for name in sorted(os.listdir(self.path)):
+                if not name.endswith(".json"):
+                    continue
+                running = os.path.join(self.path, "running", name)
+                try:
+                    os.rename(os.path.join(self.path, name), running)
+                except FileNotFoundError:
+                    # Claimed by another worker
+                    continue
+                with open(running) as f:
+                    return Message(name[: -len(".json")], f.read(), running)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def extend(self, message: Message):
+        os.utime(message.receipt)
+
+    def _move(self, message: Message, state: str):
+        os.rename(
+            message.receipt,
+            os.path.join(self.path, state, os.path.basename(message.receipt)),
+        )
+
+    def succeeded(self, message: Message):
+        self._move(message, "succeeded")
+
+    def failed(self, message: Message):
+        self._move(message, "failed")
+
+    def release(self, message: Message):
+        os.rename(
+            message.receipt,
+            os.path.join(self.path, os.path.basename(message.receipt)),
+        )
+
+
+def open_queue(queue_url: str, sqs_client=None):
+    """Return the work queue of an SQS url, or of a local directory.
+
+    Examples:
+        >>> open_queue("https://sqs.us-east-1.amazonaws.com/1/q", object()).queue_url
+        'https://sqs.us-east-1.amazonaws.com/1/q'
+    """
+    parsed = urlparse(queue_url)
+    if parsed.scheme in ["http", "https"]:
+        return SqsQueue(sqs_client, queue_url)
+    return DirectoryQueue(parsed.path if parsed.scheme == "file" else queue_url)
+
+
+@contextmanager
+def job_environment(
+    payload: Dict[str, Any], root: Optional[str] = None
+) -> Iterator[str]:
+    """Run a job in its own working directory and with its environment
+    variables, restored afterwards.
+
+    The temporary files of the job (``tempfile``, ``TMPDIR`` of ffmpeg) and
+    the current directory (e.g. two-pass logs) are in a directory under
+    ``root``, removed after the job. ``AWS_BATCH_JOB_ID`` is the id of the
+    worker job followed by the id of the payload, to keep the metrics of the
+    jobs apart.
+
+    The environment variables, ``tempfile.tempdir`` and the current
+    directory are global to the process: the jobs of a process must run
+    strictly one at a time, as the ``Worker`` does.
+    """
+    workdir = tempfile.mkdtemp(prefix="ffmpeg_job_", dir=root)
+    saved_environ = dict(os.environ)
+    saved_tempdir = tempfile.tempdir
+    saved_cwd = os.getcwd()
+    try:
+        worker_id = os.environ.get("WORKER_JOB_ID", "local")
+        os.environ.update({k: str(v) for k, v in payload["environment"].items()})
+        os.environ["AWS_BATCH_JOB_ID"] = f"{worker_id}-{payload['job_id']}"
+        os.environ["TMPDIR"] = workdir
+        tempfile.tempdir = workdir
+        os.chdir(workdir)
+        yield workdir
+    finally:
+        os.chdir(saved_cwd)
+        tempfile.tempdir = saved_tempdir
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class Worker:
+    """Run the payloads of a work queue back to back.
+
+    ``run_job`` runs the parameters of a payload and returns the exit code
+    of the job. The worker stops after ``idle_timeout`` seconds without
+    payload (0 to wait forever), after ``max_jobs`` jobs (0 for no limit),
+    or on SIGTERM/SIGINT, interrupting the job in progress and releasing its
+    payload. The jobs run one at a time in the main thread (see
+    ``job_environment``).
+    """
+
+    def __init__(
+        self,
+        queue,
+        run_job: Callable[[Dict[str, Any]], int],
+        idle_timeout: float = 300,
+        max_jobs: int = 0,
+        root: Optional[str] = None,
+    ):
+        self.queue = queue
+        self.run_job = run_job
+        self.idle_timeout = idle_timeout
+        self.max_jobs = max_jobs
+        self.root = root
+        self.stopping = threading.Event()
+        self.current: Optional[Message] = None
+        self.stats = {"succeeded": 0, "failed": 0, "released": 0, "busy_seconds": 0.0}
+
+    def stop(self, signum=None, frame=None):
+        """Drain: stop pulling payloads. As signal handler, put the payload
+        of the job in progress back in the queue right away, the container
+        being killed shortly after, and interrupt the job."""
+        logger.info(f"Worker draining (signal {signum})")
+        self.stopping.set()
+        message, self.current = self.current, None
+        if signum is not None and message is not None:
+            self.stats["released"] += 1
+            self.queue.release(message)
+            raise JobInterrupted(f"signal {signum}")
+
+    def _heartbeat(self, message: Message, done: threading.Event):
+        while not done.wait(VISIBILITY_TIMEOUT / 2):
+            try:
+                self.queue.extend(message)
+            except Exception as e:
+                logger.error(f"Visibility of {message.message_id} not extended: {e}")
+
+    def process(self, message: Message) -> Optional[int]:
+        """Run the job of a payload and acknowledge it. Return the exit code
+        of the job, or None if it was interrupted."""
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(message, done), daemon=True
+        )
+        heartbeat.start()
+        start = time.monotonic()
+        try:
+            payload = message.payload
+            logger.info(f"Job {payload['job_id']} started")
+            with job_environment(payload, self.root):
+                self.current = message
+                try:
+                    code = self.run_job(payload["parameters"])
+                finally:
+                    self.current = None
+        except JobInterrupted as e:
+            logger.warning(f"Job {message.message_id} interrupted ({e})")
+            code = None
+        # The wrapper exits on errors
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            logger.error(f"Job {message.message_id} failed: {str(e)}")
+            code = 1
+        finally:
+            done.set()
+            heartbeat.join()
+        duration = time.monotonic() - start
+        self.stats["busy_seconds"] += duration
+        # An interrupted payload is already released by the signal handler
+        if code == 0:
+            self.stats["succeeded"] += 1
+            self.queue.succeeded(message)
+        elif code is not None:
+            self.stats["failed"] += 1
+            self.queue.failed(message)
+        logger.info(f"Job {message.message_id} exited with {code} in {duration:.1f} s")
+        return code
+
+    def run(self) -> Dict[str, Any]:
+        """Pull and run payloads until stopped, and return the statistics
+        of the worker."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        start = time.monotonic()
+        idle_since = start
+        while not self.stopping.is_set():
+            jobs = self.stats["succeeded"] + self.stats["failed"]
+            if self.max_jobs and jobs >= self.max_jobs:
+                break
+            if self.idle_timeout and time.monotonic() - idle_since >= self.idle_timeout:
+                logger.info(f"Worker idle for {self.idle_timeout} s")
+                break
+            wait_seconds = WAIT_SECONDS
+            if self.idle_timeout:
+                wait_seconds = max(
+                    0,
+                    min(
+                        wait_seconds,
+                        int(self.idle_timeout - (time.monotonic() - idle_since)),
+                    ),
+                )
+            message = self.queue.receive(wait_seconds)
+            if message is None:
+                continue
+            self.process(message)
+            idle_since = time.monotonic()
+        self.stats["jobs"] = self.stats["succeeded"] + self.stats["failed"]
+        self.stats["uptime_seconds"] = round(time.monotonic() - start, 3)
+        self.stats["busy_seconds"] = round(self.stats["busy_seconds"], 3)
+        logger.info(f"Worker stopped : {self.stats}")
+        return self.stats
@@ -3,19 +3,32 @@ import json
 import logging
 import os
 import shlex
+import shutil
 import subprocess  # nosec B404
 import sys
 import tempfile
 import time
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
 
 import boto3
 import click
 from aws_xray_sdk.core import xray_recorder
 from botocore.exceptions import ClientError
 
+from shared_libraries import array_manifest
 from shared_libraries import aws
 from shared_libraries import aws_s3
+from shared_libraries import cgroup
+from shared_libraries import ffmpeg_command
+from shared_libraries import ffprobe
+from shared_libraries import input_cache
+from shared_libraries import io_strategy as io_strategy_lib
+from shared_libraries import lustre
+from shared_libraries import nvidia
+from shared_libraries import result_cache
+from shared_libraries import work_queue
 from shared_libraries.aws_s3 import S3Url
 from ffmpeg_quality_metrics import FfmpegQualityMetrics as ffqm
 
@@ -24,6 +37,17 @@ xray_recorder.configure(
     sampling=False, plugins=["EC2Plugin", "ECSPlugin"], context_missing="LOG_ERROR"
 )
 
+# Maximum expiration of the presigned urls of the streamed inputs (6 hours,
+# the maximum duration of the job role credentials)
+PRESIGNED_URL_EXPIRATION = 6 * 3600
+
+# SSM parameters read by the jobs, with the time they were read
+SSM_PARAMETERS = {}
+SSM_CACHE_SECONDS = 300
+
+# Result indexes of the jobs, by `RESULT_CACHE`
+RESULT_INDEXES = {}
+
 # Logging configuration
 LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
 logging.basicConfig(level=LOGLEVEL)
@@ -38,9 +62,15 @@ def configure_aws_clients(aws_region: str):
 
 
 def get_ssm_parameter(ssm_client, parameter_name: str, default_value: str) -> str:
+    # The jobs of a persistent worker share the parameters for a while
+    cached = SSM_PARAMETERS.get(parameter_name)
+    if cached and time.monotonic() - cached[0] < SSM_CACHE_SECONDS:
+        return cached[1]
     try:
         parameter = ssm_client.get_parameter(Name=parameter_name, WithDecryption=False)
-        return parameter["Parameter"]["Value"]
+        value = parameter["Parameter"]["Value"]
+        SSM_PARAMETERS[parameter_name] = (time.monotonic(), value)
+        return value
     except ClientError as e:
         logging.error(
             f"{parameter_name} not found in SSM Parameter - Error message : {str(e)}"
@@ -48,61 +78,264 @@ def get_ssm_parameter(ssm_client, parameter_name: str, default_value: str) -> st
         return default_value
 
 
+def presigned_url_expiration(s3_client) -> int:
+    """Return the expiration of the presigned urls of the streamed inputs:
+    a url signed with temporary credentials is invalid once they expire."""
+    # The credentials of the client are not exposed by boto3
+    credentials = s3_client._request_signer._credentials
+    if credentials is None:
+        return PRESIGNED_URL_EXPIRATION
+    # Refreshed if they expire soon
+    credentials.get_frozen_credentials()
+    expiry = getattr(credentials, "_expiry_time", None)
+    if not expiry:
+        return PRESIGNED_URL_EXPIRATION
+    seconds = (expiry - datetime.now(timezone.utc)).total_seconds()
+    return max(1, min(PRESIGNED_URL_EXPIRATION, int(seconds)))
+
+
 def prepare_assets(
-    input_url: str, output_url: str, fsx_lustre_mount_point: str, s3_client
-) -> Tuple[List[str], str, tempfile.TemporaryDirectory]:
-    """Prepare media assets by downloading from S3 url to local storage or
-    translate urls from S3 to FSx for Lustre path."""
+    input_url: str,
+    output_url: str,
+    fsx_lustre_mount_point: str,
+    s3_client,
+    cache: Optional[input_cache.InputCache] = None,
+    workdir: Optional[str] = None,
+    io_strategy: str = "auto",
+) -> Tuple[List[str], str, tempfile.TemporaryDirectory, dict]:
+    """Prepare media assets with the I/O strategy of the job: download from
+    S3 url to local storage, stream with presigned urls, or translate urls
+    from S3 to FSx for Lustre path.
+
+    With ``io_strategy`` "auto", the strategy is chosen from the size and
+    format of the inputs, the free space of the local disks and the mounts
+    (see `shared_libraries.io_strategy`). Downloads go to ``workdir`` (e.g.
+    the NVMe instance store) if given, else to the default temporary
+    directory.
+
+    With the host input cache, inputs are read from the cache and only the
+    output is written to the temporary directory.
+    """
+    start = time.time()
     s3_output_url = S3Url(output_url)
     s3_inputs = input_url.replace(" ", "").split(",")
 
-    if not fsx_lustre_mount_point:
-        # Create a temporary directory for S3 downloads
-        logging.info(
-            "No FSx for Lustre mount point provided, using temporary directory"
-        )
-        tmp_dir = tempfile.TemporaryDirectory(prefix="ffmpeg_workdir_")
-        logging.info(f"Created temporary directory: {tmp_dir.name}")
-        output_file_path = os.path.join(tmp_dir.name, s3_output_url.key)
+    # Inputs on Lustre, or HEAD of the S3 objects
+    inputs = []
+    lustre_inputs = bool(fsx_lustre_mount_point)
+    for s3_input in s3_inputs:
+        s3_input_url = S3Url(s3_input)
+        item = {"url": s3_input, "key": s3_input_url.key, "size": None}
+        if fsx_lustre_mount_point:
+            item["path"] = os.path.join(fsx_lustre_mount_point, s3_input_url.key)
+            if os.path.isfile(item["path"]):
+                item["size"] = os.path.getsize(item["path"])
+            else:
+                logging.info(f"File {item['path']} not found on Lustre")
+                lustre_inputs = False
+        inputs.append(item)
+    if not lustre_inputs:
         try:
-            input_files_path = aws_s3.download_s3_files(
-                s3_client, s3_inputs, tmp_dir.name
-            )
+            for item in inputs:
+                head = s3_client.head_object(
+                    Bucket=S3Url(item["url"]).bucket, Key=item["key"]
+                )
+                item["size"] = head["ContentLength"]
+                item["head"] = {k: head[k] for k in ["ETag", "ContentLength"]}
         except Exception as e:
             logging.error(f"Download Error: ${s3_inputs} - {e}")
-            tmp_dir.cleanup()
             sys.exit(1)
+
+    disks = {"tmpdir": tempfile.gettempdir()}
+    if workdir:
+        disks["nvme"] = workdir
+    free_bytes = {disk: shutil.disk_usage(path).free for disk, path in disks.items()}
+    url_seconds = presigned_url_expiration(s3_client)
+    strategy, reason = io_strategy_lib.choose(
+        inputs, free_bytes, lustre_inputs, url_seconds
+    )
+    if io_strategy != "auto":
+        if io_strategy == "lustre" and not lustre_inputs:
+            raise FileNotFoundError(
+                errno.ENOENT, "Inputs not found on Lustre", fsx_lustre_mount_point
+            )
+        strategy, reason = io_strategy, "IO_STRATEGY"
+    io = {
+        "strategy": strategy,
+        "reason": reason,
+        "url_seconds": url_seconds,
+        # With FSx for Lustre, the output is written on the file system
+        # whatever the strategy of the inputs, and exported to S3 later
+        "output": "lustre" if fsx_lustre_mount_point else "s3",
+        "lustre_inputs": [item["path"] for item in inputs] if lustre_inputs else [],
+        "input_bytes": sum(item["size"] for item in inputs),
+        "free_bytes": free_bytes,
+    }
+    logging.info(f"I/O strategy : {io}")
+
+    # Temporary directory for the S3 downloads and the output written locally
+    tmp_dir = None
+    if io["output"] == "s3" or (strategy in ["tmpdir", "nvme"] and not cache):
+        disk = strategy
+        if strategy not in disks:
+            disk = io_strategy_lib.output_disk(free_bytes)
+        tmp_dir = tempfile.TemporaryDirectory(
+            prefix="ffmpeg_workdir_", dir=disks.get(disk)
+        )
+        logging.info(f"Created temporary directory: {tmp_dir.name}")
+    if io["output"] == "lustre":
+        output_file_path = os.path.join(fsx_lustre_mount_point, s3_output_url.key)
     else:
+        output_file_path = os.path.join(tmp_dir.name, s3_output_url.key)
+    logging.info(f"Output file path: {output_file_path}")
+
+    if strategy == "lustre":
         # Use FSx for Lustre
         logging.info("Using FSx for Lustre mount point")
-        tmp_dir = None
-        output_file_path = os.path.join(fsx_lustre_mount_point, s3_output_url.key)
-        logging.info(f"Output file path: {output_file_path}")
-        input_files_path = []
-        for s3_input in s3_inputs:
-            s3_input_url = S3Url(s3_input)
-            input_file_path = os.path.join(fsx_lustre_mount_point, s3_input_url.key)
-            if not os.path.isfile(input_file_path):
-                logging.error(f"File {input_file_path} not found on Lustre")
-                raise FileNotFoundError(
-                    errno.ENOENT, os.strerror(errno.ENOENT), input_file_path
+        input_files_path = io["lustre_inputs"]
+    else:
+        try:
+            if strategy == "stream":
+                input_files_path = [
+                    s3_client.generate_presigned_url(
+                        "get_object",
+                        Params={
+                            "Bucket": S3Url(item["url"]).bucket,
+                            "Key": item["key"],
+                        },
+                        ExpiresIn=url_seconds,
+                    )
+                    for item in inputs
+                ]
+            elif cache:
+                with xray_recorder.in_subsegment("download") as subsegment:
+                    input_files_path = cache.fetch_all(
+                        s3_client, s3_inputs, [item.get("head") for item in inputs]
+                    )
+                    subsegment.put_metadata("input_cache", cache.stats)
+            else:
+                input_files_path = aws_s3.download_s3_files(
+                    s3_client, s3_inputs, tmp_dir.name
                 )
-            input_files_path.append(input_file_path)
+        except Exception as e:
+            logging.error(f"Download Error: ${s3_inputs} - {e}")
+            if tmp_dir:
+                tmp_dir.cleanup()
+            sys.exit(1)
+
+    io["prepare_seconds"] = round(time.time() - start, 3)
+    if strategy in ["tmpdir", "nvme"]:
+        io["download_mb_s"] = io_strategy_lib.throughput(
+            io["input_bytes"], io["prepare_seconds"]
+        )
 
     # Ensure the output directory exists
     os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-    return input_files_path, output_file_path, tmp_dir
+    return input_files_path, output_file_path, tmp_dir, io
+
+
+def working_directory(env_vars: dict) -> Optional[str]:
+    """Return the NVMe instance store directory if the host mounted one,
+    else None to use the default temporary directory."""
+    path = env_vars["INSTANCE_STORE_DIR"]
+    if path and os.path.isfile(os.path.join(path, ".instance-store")):
+        logging.info(f"Using NVMe instance store as working directory: {path}")
+        return path
+    return None
+
+
+def lustre_prefetch(
+    input_files_path: List[str], env_vars: dict
+) -> Optional[lustre.HsmPrefetch]:
+    """Restore the FSx for Lustre inputs from S3 in the background.
+
+    ffmpeg starts when all the inputs are restored, or after a head start of
+    `LUSTRE_PREFETCH_WAIT` seconds while the restores continue (a negative
+    value disables the prefetch).
+    """
+    if not env_vars["FSX_MOUNT_POINT"] or env_vars["LUSTRE_PREFETCH_WAIT"] < 0:
+        return None
+    with xray_recorder.in_subsegment("lustre-prefetch") as subsegment:
+        prefetch = lustre.HsmPrefetch(input_files_path)
+        prefetch.start()
+        restored = prefetch.wait(env_vars["LUSTRE_PREFETCH_WAIT"])
+        summary = prefetch.summary()
+        logging.info(f"Lustre inputs restored: {restored} - {summary}")
+        subsegment.put_metadata("prefetch", summary)
+    return prefetch
+
+
+def lustre_layout(
+    expected_size: int, output_file_path: str, output_url: str, env_vars: dict
+) -> Optional[str]:
+    """Set the FSx for Lustre layout of the output before ffmpeg writes it.
+
+    The output size is expected to be close to the inputs size: large
+    outputs are striped over several storage targets, sequences of segments
+    get a compact layout on their directory (`LUSTRE_STRIPING`).
+
+    Returns:
+        str: The empty output file created with the layout, which ffmpeg
+        must overwrite (`-y`) and which is removed if ffmpeg fails. None if
+        no file was created.
+    """
+    if not env_vars["FSX_MOUNT_POINT"] or not env_vars["LUSTRE_STRIPING"]:
+        return None
+    segments = "%" in S3Url(output_url).key
+    path = os.path.dirname(output_file_path) if segments else output_file_path
+    try:
+        layout = lustre.apply_layout(
+            path, expected_size, segments, env_vars["LUSTRE_STRIPING"]
+        )
+        xray_recorder.put_metadata(
+            "lustre_layout",
+            {"path": path, "layout": layout, "expected_size": expected_size},
+        )
+        return output_file_path if layout and not segments else None
+    except Exception as e:
+        logging.error(f"Lustre layout error {str(e)}")
+        return None
+
+
+def remove_placeholder(path: str):
+    """Remove the output file created by `lustre_layout` when ffmpeg did not
+    write it."""
+    try:
+        os.remove(path)
+        logging.info(f"Lustre layout placeholder {path} removed")
+    except FileNotFoundError:
+        pass
 
 
 def execute_ffmpeg_command(command_list: List[str]):
-    """Execute a FFmpeg command and log the results."""
+    """Execute a FFmpeg command and log the results.
+
+    CFS throttling counters of the container are reported before and after
+    the execution.
+    """
     logging.info(f"ffmpeg command to launch: {' '.join(command_list)}")
+    cgroup_reader = cgroup.CgroupReader()
 
     # Start X-Ray subsegment
     with xray_recorder.in_subsegment("cmd-execution") as subsegment:
         subsegment.put_metadata("command", " ".join(command_list))
 
+        throttling_before = cgroup_reader.cpu_throttling()
         result = subprocess.run(command_list, capture_output=True, text=True)  # nosec B404 B603 B607
+        throttling_after = cgroup_reader.cpu_throttling()
+        throttling = {
+            "before": throttling_before,
+            "after": throttling_after,
+            "nr_throttled": throttling_after["nr_throttled"]
+            - throttling_before["nr_throttled"],
+            "throttled_seconds": round(
+                throttling_after["throttled_seconds"]
+                - throttling_before["throttled_seconds"],
+                3,
+            ),
+        }
+        logging.info(f"ffmpeg CPU throttling : {throttling}")
+        subsegment.put_metadata("cpu_throttling", throttling)
 
         if result.returncode != 0:
             logging.error(f"ffmpeg failed - return code: {result.returncode}")
@@ -132,7 +365,7 @@ def nvidia_smi():
     Raises:
         SystemExit: If the nvidia-smi command fails.
     """
-    result = subprocess.run(["nvidia-smi"], capture_output=True, text=True)  # nosec B404 B603 B607
+    result = subprocess.run([nvidia.NVIDIA_SMI], capture_output=True, text=True)  # nosec B404 B603 B607
     if result.returncode != 0:
         logging.error(f"Nvidia smi command failed - return code: {result.returncode}")
         logging.error(f"Nvidia smi command failed - output: {result.stdout}")
@@ -149,24 +382,113 @@ def create_ffmpeg_command(
     input_files_path,
     output_file_options,
     output_file_path,
+    threads=None,
+    gpu_pipeline=False,
+    media=None,
+    overwrite=False,
+    stream_copy=True,
+    gpu_scaler="scale_cuda",
 ):
     """Create the FFmpeg command list based on the provided options and file
-    paths."""
+    paths.
+
+    With the ffprobe summary of the input (``media``) and ``stream_copy``, a
+    re-encode into the codecs the input already has is replaced with a
+    stream copy.
+
+    With ``gpu_pipeline``, x264/x265 commands are rewritten to decode,
+    filter (scale filter replaced with ``gpu_scaler``) and encode on the
+    NVIDIA GPU, decoding on the CPU the inputs NVDEC does not support.
+
+    When a ``threads`` count is given (the job sizing recommendation or the
+    CPU allocation of the container), decoder, filter and encoder threads
+    are set to it unless the user already set them.
+
+    With ``overwrite``, the output file already exists (created with its
+    FSx for Lustre layout) and ``-y`` is added to the global options.
+    """
+    global_tokens = shlex.split(global_options or "")
+    if overwrite and not ffmpeg_command.has_option(global_tokens, "-y"):
+        global_tokens = ["-y"] + global_tokens
+    input_tokens = shlex.split(input_file_options or "")
+    output_tokens = shlex.split(output_file_options or "")
+    if stream_copy and media and input_files_path and output_file_path:
+        copy_tokens, changes = ffmpeg_command.stream_copy(
+            global_tokens, input_tokens, output_tokens, media, output_file_path
+        )
+        logging.info(f"ffmpeg stream copy : {changes}")
+        xray_recorder.put_metadata("stream_copy", changes)
+        if changes["stream_copy"] == "yes":
+            output_tokens = copy_tokens
+            gpu_pipeline = False
+            threads = None
+    if gpu_pipeline and input_files_path and output_file_path:
+        global_tokens, input_tokens, output_tokens, changes = (
+            ffmpeg_command.gpu_pipeline(
+                global_tokens, input_tokens, output_tokens, gpu_scaler, media
+            )
+        )
+        logging.info(f"ffmpeg GPU pipeline : {changes}")
+        xray_recorder.put_metadata("gpu_pipeline", changes)
+    if threads:
+        global_tokens, input_tokens, output_tokens, changes = (
+            ffmpeg_command.tune_threads(
+                global_tokens,
+                input_tokens if input_files_path else [],
+                output_tokens if output_file_path else [],
+                threads,
+            )
+        )
+        logging.info(f"ffmpeg threads set to {threads} : {changes}")
+
     command_list = ["ffmpeg"]
-    if global_options:
-        command_list.extend(shlex.split(global_options))
+    command_list.extend(global_tokens)
     if input_files_path:
-        if input_file_options:
-            command_list.extend(shlex.split(input_file_options))
+        command_list.extend(input_tokens)
         for file in input_files_path:
+            # Presigned urls of the streamed inputs
+            if file.startswith("https://"):
+                command_list.extend(io_strategy_lib.STREAM_INPUT_OPTIONS)
             command_list.extend(["-i", file])
     if output_file_path:
-        if output_file_options:
-            command_list.extend(shlex.split(output_file_options))
+        command_list.extend(output_tokens)
         command_list.append(output_file_path)
     return command_list
 
 
+def ffmpeg_threads(env_vars: dict) -> int:
+    """Return the ffmpeg thread count: the job sizing recommendation, else the
+    CPU allocation of the container, or 0 when thread tuning is disabled."""
+    if int(env_vars["FFMPEG_THREADS"] or 0) > 0:
+        return int(env_vars["FFMPEG_THREADS"])
+    if env_vars["FFMPEG_THREAD_TUNING"] != "TRUE":
+        return 0
+    return cgroup.effective_cpus()
+
+
+def probe_input(input_files_path: List[str], env_vars: dict) -> Optional[dict]:
+    """Describe the single input of the command with ffprobe for the stream
+    copy analysis and the NVDEC support of the GPU pipeline, unless both are
+    disabled (`FFMPEG_STREAM_COPY`, `FFMPEG_GPU_PIPELINE`)."""
+    enabled = "TRUE" in [
+        env_vars["FFMPEG_STREAM_COPY"],
+        env_vars["FFMPEG_GPU_PIPELINE"],
+    ]
+    if not enabled or len(input_files_path) != 1:
+        return None
+    try:
+        return ffprobe.media_summary(ffprobe.probe(input_files_path[0]))
+    except Exception as e:
+        logging.warning(f"ffprobe failed, input codecs not analyzed - {e}")
+        return None
+
+
+def ffmpeg_gpu_pipeline(env_vars: dict) -> bool:
+    """Check if commands should be rewritten for the GPU: opt-in with
+    `FFMPEG_GPU_PIPELINE`, and only when a GPU is visible."""
+    return env_vars["FFMPEG_GPU_PIPELINE"] == "TRUE" and bool(nvidia.list_gpus())
+
+
 def upload_to_s3(s3_client, output_file_path, output_url):
     """Upload the output file or directory to S3."""
     s3_output_url = S3Url(output_url)
@@ -204,6 +526,62 @@ def upload_to_s3(s3_client, output_file_path, output_url):
     )
 
 
+def record_lustre_output(output_file_path: str, output_url: str, env_vars: dict):
+    """Queue a completed Lustre output for the batched export to S3.
+
+    The path is relative to the file system root, as expected by the data
+    repository tasks. The whole directory is exported when the output is a
+    sequence of files (`%` in the url).
+    """
+    if not env_vars["LUSTRE_EXPORT_QUEUE_URL"]:
+        logging.info("No Lustre export queue, the output stays on the file system")
+        return
+    if "%" in S3Url(output_url).key:
+        output_file_path = os.path.dirname(output_file_path)
+    path = os.path.relpath(output_file_path, env_vars["FSX_MOUNT_POINT"])
+    try:
+        sqs_client = boto3.client("sqs", region_name=aws.detect_running_region())
+        sqs_client.send_message(
+            QueueUrl=env_vars["LUSTRE_EXPORT_QUEUE_URL"],
+            MessageBody=json.dumps(
+                {"path": path, "job_id": env_vars["AWS_BATCH_JOB_ID"]}
+            ),
+        )
+        logging.info(f"Lustre output queued for export : {path}")
+    except Exception as e:
+        logging.error(f"Lustre export queue error {str(e)}")
+        sys.exit(1)
+
+
+def record_lustre_access(
+    input_files_path: List[str],
+    output_file_path: str,
+    output_url: str,
+    env_vars: dict,
+    s3_client,
+):
+    """Record the Lustre files touched by the job, for the release of the
+    least recently used files (`lustre/access/jobs/` in the S3 bucket)."""
+    if "%" in S3Url(output_url).key:
+        output_file_path = os.path.dirname(output_file_path)
+    record = {
+        "time": time.time(),
+        "job_id": env_vars["AWS_BATCH_JOB_ID"],
+        "paths": [
+            os.path.relpath(path, env_vars["FSX_MOUNT_POINT"])
+            for path in input_files_path + [output_file_path]
+        ],
+    }
+    try:
+        s3_client.put_object(
+            Bucket=env_vars["S3_BUCKET"],
+            Key=f"lustre/access/jobs/{env_vars['AWS_BATCH_JOB_ID']}-{time.time_ns()}.json",
+            Body=json.dumps(record),
+        )
+    except Exception as e:
+        logging.error(f"Lustre access record error {str(e)}")
+
+
 ## Quality Metrics
 def calculate_quality_metrics(source: str, destination: str) -> dict:
     """Calculate video quality metrics using ffmpeg-quality-metrics."""
@@ -222,6 +600,102 @@ def save_quality_metrics(s3_client, s3_bucket: str, document: dict):
     s3_client.put_object(Bucket=s3_bucket, Key=key, Body=json.dumps(document))
 
 
+## I/O Metrics
+def io_metrics(io: dict, ffmpeg_seconds: float, env_vars: dict, s3_client):
+    """Record the I/O strategy of the job and its measured throughput.
+
+    `read_mb_s` is the throughput of the inputs from the start of the
+    preparation to the end of ffmpeg, comparable across strategies.
+    """
+    try:
+        io["ffmpeg_seconds"] = round(ffmpeg_seconds, 3)
+        io["read_mb_s"] = io_strategy_lib.throughput(
+            io["input_bytes"], io["prepare_seconds"] + ffmpeg_seconds
+        )
+        logging.info(f"I/O metrics : {io}")
+        xray_recorder.put_annotation("io_strategy", io["strategy"])
+        xray_recorder.put_metadata("io", io)
+        if env_vars["S3_BUCKET"]:
+            document = dict(io)
+            document.update(
+                {
+                    k: env_vars[k]
+                    for k in [
+                        "AWS_BATCH_JOB_ID",
+                        "AWS_BATCH_JQ_NAME",
+                        "AWS_BATCH_CE_NAME",
+                    ]
+                }
+            )
+            key = f"metrics/io/{time.strftime('year=%Y/month=%b/day=%d')}/{document['AWS_BATCH_JQ_NAME']}_{document['AWS_BATCH_CE_NAME']}_{document['AWS_BATCH_JOB_ID']}_{time.time_ns()}.json"
+            s3_client.put_object(
+                Bucket=env_vars["S3_BUCKET"], Key=key, Body=json.dumps(document)
+            )
+    except Exception as e:
+        logging.error(f"I/O Metrics Error {str(e)}")
+
+
+## Resource Metrics
+def start_resource_sampler(interval: str) -> Optional[cgroup.ResourceSampler]:
+    """Start the container resource sampler if the interval is positive."""
+    try:
+        interval_seconds = float(interval or 0)
+    except ValueError:
+        logging.error(f"Invalid resource sampler interval: {interval}")
+        return None
+    if interval_seconds <= 0:
+        logging.info("Resource sampler disabled")
+        return None
+    sampler = cgroup.ResourceSampler(interval=interval_seconds)
+    logging.info(
+        f"Resource sampler started - cgroup v{sampler.reader.version} - interval {interval_seconds}s"
+    )
+    sampler.start()
+    return sampler
+
+
+def save_resource_metrics(s3_client, s3_bucket: str, document: dict):
+    """Save resource metrics to an S3 bucket."""
+    key = f"metrics/resources/{time.strftime('year=%Y/month=%b/day=%d')}/{document['AWS_BATCH_JQ_NAME']}_{document['AWS_BATCH_CE_NAME']}_{document['AWS_BATCH_JOB_ID']}.json"
+    logging.info(f"Saving resource metrics to S3 : {s3_bucket}/{key}")
+    s3_client.put_object(Bucket=s3_bucket, Key=key, Body=json.dumps(document))
+
+
+@xray_recorder.capture("resource-metrics")
+def resource_metrics(sampler, command_list, env_vars, s3_client):
+    """Stop the resource sampler and save the CPU, memory and I/O time
+    series with the job metrics."""
+    try:
+        document = sampler.stop()
+        logging.info(
+            "Resource usage - bound: %s - peaks: %r - totals: %r - limits: %r",
+            document["bound"],
+            document["peaks"],
+            document["totals"],
+            document["limits"],
+        )
+        xray_recorder.current_subsegment().put_metadata(
+            "resources",
+            {k: document[k] for k in ["bound", "peaks", "totals", "limits"]},
+        )
+        document.update(
+            {
+                k: env_vars[k]
+                for k in [
+                    "AWS_BATCH_JOB_ID",
+                    "AWS_BATCH_JQ_NAME",
+                    "AWS_BATCH_CE_NAME",
+                ]
+            }
+        )
+        document["command"] = " ".join(command_list or [])
+        document["profile"] = env_vars["SIZING_PROFILE"]
+        if env_vars["S3_BUCKET"]:
+            save_resource_metrics(s3_client, env_vars["S3_BUCKET"], document)
+    except Exception as e:
+        logging.error(f"Resource Metrics Error {str(e)}")
+
+
 @xray_recorder.capture("quality-metrics")
 def quality_metrics(
     input_files_path, output_file_path, output_url, env_vars, s3_client, ssm_client
@@ -232,6 +706,9 @@ def quality_metrics(
         banned_formats = ["%", ".m4a", ".mp3"]
         # Get AWS parameters
         metrics_flag = get_ssm_parameter(ssm_client, "/batch-ffmpeg/ffqm", "FALSE")
+        # The VMAF of the benchmark jobs is part of their report
+        if env_vars["BENCHMARK_RUN_ID"]:
+            metrics_flag = "TRUE"
         logging.info(
             f"Quality metrics flag : {metrics_flag} - Number of source : {len(input_files_path)} - No banned Formats : {not any(x in output_url for x in banned_formats)}"
         )
@@ -259,52 +736,365 @@ def quality_metrics(
         logging.error(f"Quality Metrics Error {str(e)}")
 
 
-@click.command(name="main")
-@click.option("--global_options", help="ffmpeg global options", type=str)
-@click.option("--input_file_options", help="ffmpeg input file options", type=str)
-@click.option("--input_url", help="Amazon S3 input url", type=str, required=True)
-@click.option("--output_file_options", help="ffmpeg output file options", type=str)
-@click.option("--output_url", help="Amazon S3 output url", type=str, required=True)
-@click.option("--name", help="Optional name to identify cmd in logs", type=str)
-def main(
-    global_options, input_file_options, input_url, output_file_options, output_url, name
+## Input cache
+def open_input_cache(env_vars: dict) -> Optional[input_cache.InputCache]:
+    """Open the host input cache when its directory is mounted."""
+    if not env_vars["INPUT_CACHE_DIR"]:
+        return None
+    try:
+        return input_cache.InputCache(
+            env_vars["INPUT_CACHE_DIR"], env_vars["INPUT_CACHE_MAX_BYTES"]
+        )
+    except OSError as e:
+        logging.error(f"Input cache disabled: {str(e)}")
+        return None
+
+
+def close_input_cache(cache: input_cache.InputCache):
+    """Release the cached inputs of the job and report the hit/miss
+    statistics of the job and of the host."""
+    try:
+        stats = cache.close()
+        logging.info(f"Input cache statistics : {stats}")
+        xray_recorder.current_segment().put_metadata("input_cache", stats)
+    except Exception as e:
+        logging.error(f"Input cache error {str(e)}")
+
+
+## Result index
+def result_index(env_vars: dict, s3_client):
+    """Return the result index of the jobs (`RESULT_CACHE`, DynamoDB table
+    or local directory), None if disabled or for a benchmark, whose jobs
+    must run."""
+    index_url = env_vars["RESULT_CACHE"]
+    if not index_url or index_url == "null" or env_vars["BENCHMARK_RUN_ID"]:
+        return None
+    if index_url not in RESULT_INDEXES:
+        RESULT_INDEXES[index_url] = result_cache.open_index(
+            index_url,
+            boto3.client("dynamodb", region_name=s3_client.meta.region_name),
+        )
+    return RESULT_INDEXES[index_url]
+
+
+def result_fingerprint(command: dict, env_vars: dict, s3_client) -> Optional[str]:
+    """Return the fingerprint of the result of a command, None if its
+    result is not indexed (see `shared_libraries.result_cache`)."""
+    if not result_index(env_vars, s3_client):
+        return None
+    if not result_cache.cacheable(command["output_url"]):
+        return None
+    try:
+        etags = result_cache.input_etags(
+            s3_client, command["input_url"].replace(" ", "").split(",")
+        )
+    except ClientError as e:
+        logging.warning(f"Result index skipped, inputs not found : {e}")
+        return None
+    return result_cache.fingerprint(
+        etags,
+        command,
+        env_vars["FFMPEG_VERSION"],
+        result_cache.compute_family(env_vars["AWS_BATCH_JQ_NAME"]),
+        result_cache.rewrite_settings(env_vars),
+    )
+
+
+def reuse_result(key: str, output_url: str, env_vars: dict, s3_client) -> bool:
+    """Reuse the indexed result of a command, and return True if its output
+    is in place."""
+    try:
+        result = result_cache.lookup(result_index(env_vars, s3_client), s3_client, key)
+        if not result:
+            logging.info(f"Result {key} not indexed")
+            return False
+        how = result_cache.reuse(s3_client, result, output_url)
+    except ClientError as e:
+        logging.warning(f"Result {key} not reused : {e}")
+        return False
+    logging.info(f"Result {key} reused ({how}) from {result['output_url']}")
+    xray_recorder.current_segment().put_annotation("result_cache", how)
+    return True
+
+
+def record_result(key: str, command: dict, env_vars: dict, s3_client):
+    """Index the output of a command under its fingerprint."""
+    try:
+        result_cache.record(
+            result_index(env_vars, s3_client),
+            s3_client,
+            key,
+            command["output_url"],
+            {
+                "input_url": command["input_url"],
+                "ffmpeg_version": env_vars["FFMPEG_VERSION"],
+                "job_id": env_vars["AWS_BATCH_JOB_ID"],
+            },
+        )
+    except ClientError as e:
+        logging.warning(f"Result {key} not indexed : {e}")
+
+
+## Multi-command jobs
+def load_commands(s3_client, commands_url: str) -> List[dict]:
+    """Load the ffmpeg commands of a multi-command job.
+
+    The document is a JSON list of objects with the parameters of the
+    wrapper: `global_options`, `input_file_options`, `input_url`,
+    `output_file_options`, `output_url` and `name`.
+    """
+    s3_commands_url = S3Url(commands_url)
+    response = s3_client.get_object(
+        Bucket=s3_commands_url.bucket, Key=s3_commands_url.key
+    )
+    commands = json.loads(response["Body"].read())
+    return [
+        {key: None if value == "null" else value for key, value in command.items()}
+        for command in commands
+    ]
+
+
+def run_command(
+    command: dict,
+    env_vars: dict,
+    s3_client,
+    threads: int,
+    device: Optional[int] = None,
+    gpu_pipeline: bool = False,
+    cache: Optional[input_cache.InputCache] = None,
 ):
-    """Main function to process video files using FFmpeg with AWS
-    integration."""
-    aws_region = aws.detect_running_region()
-    ssm_client, s3_client = configure_aws_clients(aws_region)
+    """Download, encode and upload one command of a multi-command job."""
+    result_key = result_fingerprint(command, env_vars, s3_client)
+    if result_key and reuse_result(
+        result_key, command["output_url"], env_vars, s3_client
+    ):
+        return
+    input_files_path, output_file_path, tmp_dir, io = prepare_assets(
+        input_url=command["input_url"],
+        output_url=command["output_url"],
+        s3_client=s3_client,
+        fsx_lustre_mount_point=env_vars["FSX_MOUNT_POINT"],
+        cache=cache,
+        workdir=working_directory(env_vars),
+        io_strategy=env_vars["IO_STRATEGY"],
+    )
+    prefetch = None
+    placeholder = None
+    if io["strategy"] == "lustre":
+        prefetch = lustre_prefetch(input_files_path, env_vars)
+    if io["output"] == "lustre":
+        placeholder = lustre_layout(
+            io["input_bytes"], output_file_path, command["output_url"], env_vars
+        )
+    try:
+        command_list = create_ffmpeg_command(
+            command.get("global_options"),
+            command.get("input_file_options"),
+            input_files_path,
+            command.get("output_file_options"),
+            output_file_path,
+            threads=threads,
+            gpu_pipeline=gpu_pipeline,
+            media=probe_input(input_files_path, env_vars),
+            overwrite=bool(placeholder),
+            stream_copy=env_vars["FFMPEG_STREAM_COPY"] == "TRUE",
+            gpu_scaler=env_vars["FFMPEG_GPU_SCALER"],
+        )
+        if device is not None:
+            command_list = nvidia.assign_device(command_list, device)
+        ffmpeg_start = time.time()
+        execute_ffmpeg_command(command_list)
+        placeholder = None
+        io_metrics(io, time.time() - ffmpeg_start, env_vars, s3_client)
+        if io["output"] == "s3":
+            upload_to_s3(s3_client, output_file_path, command["output_url"])
+            if result_key:
+                record_result(result_key, command, env_vars, s3_client)
+        else:
+            record_lustre_output(output_file_path, command["output_url"], env_vars)
+            record_lustre_access(
+                io["lustre_inputs"],
+                output_file_path,
+                command["output_url"],
+                env_vars,
+                s3_client,
+            )
+    finally:
+        if placeholder:
+            remove_placeholder(placeholder)
+        if prefetch:
+            prefetch.stop()
+        if tmp_dir:
+            tmp_dir.cleanup()
 
-    # Log all parameters
-    for param_name, value in locals().items():
-        logging.info(f"{param_name}: {value}")
 
-    # Convert "null" strings to None
-    if global_options == "null":
-        global_options = None
-    if input_file_options == "null":
-        input_file_options = None
-    if input_url == "null":
-        input_url = None
-    if output_file_options == "null":
-        output_file_options = None
-    if output_url == "null":
-        output_url = None
-    if name == "null":
-        name = None
+def run_commands(
+    commands: List[dict],
+    env_vars: dict,
+    s3_client,
+    cache: Optional[input_cache.InputCache] = None,
+) -> List[dict]:
+    """Run the commands of a multi-command job.
 
-    # Get env variables
-    env_vars = {
+    On GPU instances, the commands run concurrently: each one takes an NVENC
+    session slot on one of the visible GPUs, in round-robin, and is pinned
+    to it. Without GPU, the commands run concurrently on a pool of one
+    worker per vCPU of the container (`COMMAND_WORKERS` to set it), which
+    share the ffmpeg threads.
+
+    Returns:
+        list: The status of each command.
+    """
+    gpus = nvidia.list_gpus()
+    scheduler = nvidia.GpuScheduler(gpus, env_vars["NVENC_SESSIONS_PER_GPU"])
+    if scheduler.capacity:
+        workers = min(scheduler.capacity, len(commands))
+    else:
+        workers = min(
+            env_vars["COMMAND_WORKERS"] or cgroup.effective_cpus(), len(commands)
+        )
+    workers = max(1, workers)
+    threads = ffmpeg_threads(env_vars)
+    if threads:
+        threads = max(1, threads // workers)
+    gpu_pipeline = env_vars["FFMPEG_GPU_PIPELINE"] == "TRUE" and bool(gpus)
+    logging.info(
+        f"Running {len(commands)} commands - {len(gpus)} GPU - {workers} concurrent - {threads} threads"
+    )
+    segment = xray_recorder.current_segment()
+
+    def run(index: int, command: dict) -> dict:
+        xray_recorder.set_trace_entity(segment)
+        device = scheduler.acquire() if scheduler.capacity else None
+        status = {
+            "index": index,
+            "name": command.get("name"),
+            "output_url": command.get("output_url"),
+            "device": device,
+        }
+        start = time.time()
+        try:
+            with xray_recorder.in_subsegment(f"command-{index}"):
+                run_command(
+                    command,
+                    env_vars,
+                    s3_client,
+                    threads,
+                    device=device,
+                    gpu_pipeline=gpu_pipeline,
+                    cache=cache,
+                )
+            status["status"] = "SUCCEEDED"
+        # prepare_assets and upload_to_s3 exit on errors
+        except BaseException as e:
+            logging.error(f"Command {index} failed: {str(e)}")
+            status["status"] = "FAILED"
+            status["error"] = str(e)
+        finally:
+            if device is not None:
+                scheduler.release(device)
+            xray_recorder.clear_trace_entities()
+        status["duration"] = round(time.time() - start, 3)
+        return status
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run, range(len(commands)), commands))
+    segment.put_metadata("commands", results)
+    return results
+
+
+def job_env_vars() -> dict:
+    """Return the settings of a job from the environment variables."""
+    return {
         "AWS_BATCH_JOB_ID": os.getenv("AWS_BATCH_JOB_ID", "local"),
         "AWS_BATCH_JQ_NAME": os.getenv("AWS_BATCH_JQ_NAME", "local"),
         "AWS_BATCH_CE_NAME": os.getenv("AWS_BATCH_CE_NAME", "local"),
+        "AWS_BATCH_JOB_ARRAY_INDEX": os.getenv("AWS_BATCH_JOB_ARRAY_INDEX"),
+        "WORKER_JOB_ID": os.getenv("WORKER_JOB_ID"),
         "S3_BUCKET": os.getenv("S3_BUCKET"),
         "FSX_MOUNT_POINT": os.getenv("FSX_MOUNT_POINT"),
+        "RESOURCE_SAMPLER_INTERVAL": os.getenv("RESOURCE_SAMPLER_INTERVAL", "0"),
+        "FFMPEG_THREADS": os.getenv("FFMPEG_THREADS"),
+        "FFMPEG_THREAD_TUNING": os.getenv("FFMPEG_THREAD_TUNING", "TRUE").upper(),
+        "SIZING_PROFILE": os.getenv("SIZING_PROFILE", "unknown"),
+        "FFMPEG_STREAM_COPY": os.getenv("FFMPEG_STREAM_COPY", "TRUE").upper(),
+        "FFMPEG_GPU_PIPELINE": os.getenv("FFMPEG_GPU_PIPELINE", "FALSE").upper(),
+        "FFMPEG_GPU_SCALER": os.getenv("FFMPEG_GPU_SCALER", "scale_cuda").lower(),
+        "NVENC_SESSIONS_PER_GPU": int(
+            os.getenv("NVENC_SESSIONS_PER_GPU", str(nvidia.NVENC_SESSIONS_PER_GPU))
+        ),
+        "LUSTRE_PREFETCH_WAIT": float(os.getenv("LUSTRE_PREFETCH_WAIT", "60")),
+        "LUSTRE_EXPORT_QUEUE_URL": os.getenv("LUSTRE_EXPORT_QUEUE_URL"),
+        "LUSTRE_STRIPING": json.loads(os.getenv("LUSTRE_STRIPING") or "null"),
+        "INSTANCE_STORE_DIR": os.getenv("INSTANCE_STORE_DIR"),
+        "INPUT_CACHE_DIR": os.getenv("INPUT_CACHE_DIR"),
+        "INPUT_CACHE_MAX_BYTES": int(os.getenv("INPUT_CACHE_MAX_BYTES", "0")),
+        "IO_STRATEGY": os.getenv("IO_STRATEGY", "auto").lower(),
+        "BENCHMARK_RUN_ID": os.getenv("BENCHMARK_RUN_ID"),
+        "COMMAND_WORKERS": int(os.getenv("COMMAND_WORKERS", "0")),
+        "RESULT_CACHE": os.getenv("RESULT_CACHE"),
+        "FFMPEG_VERSION": os.getenv("FFMPEG_VERSION", "local"),
+    }
+
+
+def run_job(parameters: dict, ssm_client, s3_client) -> int:
+    """Run one job with the wrapper parameters and return its exit code.
+
+    Errors of the downloads and uploads exit the process (SystemExit).
+    """
+    parameters = {
+        key: parameters.get(key)
+        for key in [
+            "global_options",
+            "input_file_options",
+            "input_url",
+            "output_file_options",
+            "output_url",
+            "name",
+            "commands_url",
+            "manifest_url",
+        ]
     }
 
+    # Resolve the parameters of an array job child from the manifest
+    if parameters["manifest_url"] and parameters["manifest_url"] != "null":
+        item = array_manifest.read_item(
+            s3_client,
+            parameters["manifest_url"],
+            int(os.getenv("AWS_BATCH_JOB_ARRAY_INDEX", "0")),
+        )
+        parameters.update({key: item[key] for key in item if key in parameters})
+
+    # Log all parameters
+    for param_name, value in parameters.items():
+        logging.info(f"{param_name}: {value}")
+
+    # Convert "null" strings to None
+    parameters = {
+        key: None if value == "null" else value for key, value in parameters.items()
+    }
+    global_options = parameters["global_options"]
+    input_file_options = parameters["input_file_options"]
+    input_url = parameters["input_url"]
+    output_file_options = parameters["output_file_options"]
+    output_url = parameters["output_url"]
+    commands_url = parameters["commands_url"]
+    if not commands_url and not (input_url and output_url):
+        raise click.UsageError("--input_url and --output_url are required")
+
+    # Get env variables
+    env_vars = job_env_vars()
+
     logging.info("Environment variables : %r", env_vars)
 
     # Start X-Ray segment
     xray_recorder.begin_segment("batch-ffmpeg-job")
+    sampler = start_resource_sampler(env_vars["RESOURCE_SAMPLER_INTERVAL"])
+    command_list = None
+    tmp_dir = None
+    prefetch = None
+    placeholder = None
+    cache = open_input_cache(env_vars)
 
     try:
         # Set X-Ray metadata and annotations
@@ -313,16 +1103,46 @@ def main(
             "execution", f"ffmpeg-wrapper-{time.strftime('%Y%m%d-%H%M%S')}"
         )
         segment.put_annotation("application", "batch-ffmpeg")
-        for key, value in {**locals(), **env_vars}.items():
-            if key not in ["ssm_client", "s3_client", "env_vars", "segment"]:
-                segment.put_annotation(key, str(value))
+        for key, value in {**parameters, **env_vars}.items():
+            segment.put_annotation(key, str(value))
 
-        input_files_path, output_file_path, tmp_dir = prepare_assets(
+        if commands_url:
+            if sampler:
+                sampler.phase("commands")
+            results = run_commands(
+                load_commands(s3_client, commands_url), env_vars, s3_client, cache
+            )
+            failed = [r for r in results if r["status"] != "SUCCEEDED"]
+            logging.info(
+                f"{len(results) - len(failed)}/{len(results)} commands succeeded"
+            )
+            if sampler:
+                resource_metrics(sampler, None, env_vars, s3_client)
+                sampler = None
+            return 1 if failed else 0
+
+        # Skip the job if its result is indexed and still in place
+        result_key = result_fingerprint(parameters, env_vars, s3_client)
+        if result_key and reuse_result(result_key, output_url, env_vars, s3_client):
+            return 0
+
+        if sampler:
+            sampler.phase("prepare")
+        input_files_path, output_file_path, tmp_dir, io = prepare_assets(
             input_url=input_url,
             output_url=output_url,
             s3_client=s3_client,
             fsx_lustre_mount_point=env_vars["FSX_MOUNT_POINT"],
+            cache=cache,
+            workdir=working_directory(env_vars),
+            io_strategy=env_vars["IO_STRATEGY"],
         )
+        if io["strategy"] == "lustre":
+            prefetch = lustre_prefetch(input_files_path, env_vars)
+        if io["output"] == "lustre":
+            placeholder = lustre_layout(
+                io["input_bytes"], output_file_path, output_url, env_vars
+            )
 
         if env_vars["AWS_BATCH_JQ_NAME"] == "batch-ffmpeg-job-queue-nvidia":
             nvidia_smi()
@@ -333,11 +1153,36 @@ def main(
             input_files_path,
             output_file_options,
             output_file_path,
+            threads=ffmpeg_threads(env_vars),
+            gpu_pipeline=ffmpeg_gpu_pipeline(env_vars),
+            media=probe_input(input_files_path, env_vars),
+            overwrite=bool(placeholder),
+            stream_copy=env_vars["FFMPEG_STREAM_COPY"] == "TRUE",
+            gpu_scaler=env_vars["FFMPEG_GPU_SCALER"],
         )
+        if sampler:
+            sampler.phase("ffmpeg")
+        ffmpeg_start = time.time()
         execute_ffmpeg_command(command_list)
-        # Upload output to S3 if not using FSx for Lustre
-        if not env_vars["FSX_MOUNT_POINT"]:
+        placeholder = None
+        io_metrics(io, time.time() - ffmpeg_start, env_vars, s3_client)
+        # Upload output to S3 if not written on FSx for Lustre
+        if io["output"] == "s3":
+            if sampler:
+                sampler.phase("upload")
             upload_to_s3(s3_client, output_file_path, output_url)
+            if result_key:
+                record_result(result_key, parameters, env_vars, s3_client)
+        else:
+            record_lustre_output(output_file_path, output_url, env_vars)
+            record_lustre_access(
+                io["lustre_inputs"], output_file_path, output_url, env_vars, s3_client
+            )
+
+        # Save container resource usage
+        if sampler:
+            resource_metrics(sampler, command_list, env_vars, s3_client)
+            sampler = None
 
         # Calculate video quality metrics
         quality_metrics(
@@ -348,18 +1193,84 @@ def main(
             s3_client,
             ssm_client,
         )
-        sys.exit(0)
+        return 0
     except Exception as e:
         logging.error(f"An error occurred: {str(e)}")
         xray_recorder.current_segment().add_exception(e)
-        sys.exit(1)
+        return 1
     finally:
+        # Stop the resource sampler if the job failed before saving it
+        if sampler:
+            resource_metrics(sampler, command_list, env_vars, s3_client)
+        # Remove the output file created with its Lustre layout if ffmpeg failed
+        if placeholder:
+            remove_placeholder(placeholder)
         # Clean up the temporary directory if it was created
         if tmp_dir:
             tmp_dir.cleanup()
+        # Report the restores of the Lustre inputs which continued during ffmpeg
+        if prefetch:
+            prefetch.stop()
+            xray_recorder.current_segment().put_metadata(
+                "lustre_prefetch", prefetch.summary()
+            )
+        # Release the cached inputs and report the cache statistics
+        if cache:
+            close_input_cache(cache)
         # End X-Ray segment
         xray_recorder.end_segment()
 
 
+def run_worker(queue_url: str, ssm_client, s3_client, aws_region: str) -> dict:
+    """Run the job payloads of a work queue back to back with the same AWS
+    clients, input cache and warm Lustre or NVMe state (see
+    `shared_libraries.work_queue`)."""
+    os.environ.setdefault("WORKER_JOB_ID", os.getenv("AWS_BATCH_JOB_ID", "local"))
+    queue = work_queue.open_queue(
+        queue_url, boto3.client("sqs", region_name=aws_region)
+    )
+    worker = work_queue.Worker(
+        queue,
+        lambda parameters: run_job(parameters, ssm_client, s3_client),
+        idle_timeout=float(os.getenv("WORKER_IDLE_TIMEOUT", "300")),
+        max_jobs=int(os.getenv("WORKER_MAX_JOBS", "0")),
+    )
+    return worker.run()
+
+
+@click.command(name="main")
+@click.option("--global_options", help="ffmpeg global options", type=str)
+@click.option("--input_file_options", help="ffmpeg input file options", type=str)
+@click.option("--input_url", help="Amazon S3 input url", type=str)
+@click.option("--output_file_options", help="ffmpeg output file options", type=str)
+@click.option("--output_url", help="Amazon S3 output url", type=str)
+@click.option("--name", help="Optional name to identify cmd in logs", type=str)
+@click.option(
+    "--commands_url",
+    help="Amazon S3 url of a JSON list of commands to run in this job",
+    type=str,
+)
+@click.option(
+    "--manifest_url",
+    help="Amazon S3 url of the manifest of an array job, parameters of each child",
+    type=str,
+)
+@click.option(
+    "--queue_url",
+    help="Amazon SQS url or local directory of job payloads to run as a persistent worker",
+    type=str,
+)
+def main(queue_url, **parameters):
+    """Main function to process video files using FFmpeg with AWS
+    integration."""
+    aws_region = aws.detect_running_region()
+    ssm_client, s3_client = configure_aws_clients(aws_region)
+
+    if queue_url and queue_url != "null":
+        run_worker(queue_url, ssm_client, s3_client, aws_region)
+        sys.exit(0)
+    sys.exit(run_job(parameters, ssm_client, s3_client))
+
+
 if __name__ == "__main__":
     main()  # This actually runs the Click command